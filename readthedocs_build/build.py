@@ -1,10 +1,197 @@
+from collections import OrderedDict
+from multiprocessing import Pool
+import json
+import os
+
 from .builder import builder_types
+from .builder.host import RunningBuilds
+from .scheduler import Scheduler
+from .utils import redirect_output
+
+
+def get_environment_key(build_config):
+    """
+    Build configs with the same key can share one virtualenv.
+    """
+    return json.dumps([
+        build_config.get('type'),
+        build_config.get('python'),
+        build_config.get('requirements_file'),
+    ], sort_keys=True)
+
+
+def group_by_environment(project_config):
+    groups = OrderedDict()
+    for build_config in project_config:
+        key = get_environment_key(build_config)
+        groups.setdefault(key, []).append(build_config)
+    return list(groups.values())
+
+
+def in_config_order(project_config, build_configs, reports):
+    """
+    Return the ``reports`` of the ``build_configs`` in the order of the
+    configs in ``project_config``.
+    """
+    reports_by_config = dict(
+        (id(build_config), report)
+        for build_config, report in zip(build_configs, reports))
+    return [
+        reports_by_config[id(build_config)]
+        for build_config in project_config]
+
+
+def get_log_path(build_config):
+    log_dir = os.path.join(
+        build_config['output_base'],
+        build_config['name'])
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    return os.path.join(log_dir, 'build.log')
+
+
+def build_group(build_configs):
+    """
+    Build all ``build_configs`` one after another in a single virtualenv.
+    The output of each build goes to ``build.log`` in its output directory.
+    Returns the timing reports of the builds. If the setup of the virtualenv
+    fails, its timing report is written with the first config.
+    """
+    builder_class = builder_types[build_configs[0]['type']]
+    owner = builder_class(build_config=build_configs[0])
+    reports = []
+    is_set_up = False
+    try:
+        with redirect_output(get_log_path(build_configs[0])):
+            owner.setup()
+        is_set_up = True
+        for build_config in build_configs:
+            builder = builder_class(
+                build_config=build_config,
+                venv=owner.venv)
+            if build_config is build_configs[0]:
+                # Report the setup of the virtualenv with the first config.
+                builder.timings = owner.timings
+            with redirect_output(get_log_path(build_config)):
+                reports.append(builder.build())
+    finally:
+        try:
+            owner.cleanup()
+        finally:
+            if not is_set_up:
+                owner.write_timings()
+    return reports
 
 
-def build(project_config):
+def get_group_stages(build_configs):
+    """
+    Return the builders and stages of all ``build_configs``. They use the
+    virtualenv of the first config, which is cleaned up after all of them.
+    """
+    builder_class = builder_types[build_configs[0]['type']]
+    owner = builder_class(build_config=build_configs[0])
+    builders = [owner]
+    stages = []
+    for build_config in build_configs[1:]:
+        builder = builder_class(build_config=build_config)
+        builders.append(builder)
+        stages.extend(builder.get_stages(owner=owner))
+    cleanup_after = [stage.name for stage in stages]
+    return builders, owner.get_stages(cleanup_after=cleanup_after) + stages
+
+
+def build_stages(project_config, jobs=1, io_jobs=None):
+    """
+    Build all configs in ``project_config`` in one process as graph of
+    stages. Any stage runs as soon as the stages it depends on are done, at
+    most ``jobs`` CPU bound and ``io_jobs`` I/O bound stages at a time.
+    Configs with the same python settings share one virtualenv. Returns
+    the timing reports of the builds.
+    """
+    scheduler = Scheduler(limits={
+        'cpu': jobs,
+        'io': io_jobs or jobs,
+    })
+    builders = []
+    for group in group_by_environment(project_config):
+        group_builders, stages = get_group_stages(group)
+        builders.extend(group_builders)
+        for stage in stages:
+            scheduler.add(stage)
+    # All configs run at the same time, each counts as a running build.
+    running_builds = RunningBuilds()
+    entries = [running_builds.register() for builder in builders]
+    try:
+        scheduler.run()
+    finally:
+        for entry in entries:
+            running_builds.unregister(entry)
+    return in_config_order(
+        project_config,
+        [builder.build_config for builder in builders],
+        [builder.timings.as_dict() for builder in builders])
+
+
+def refill_virtualenv_pools(project_config):
+    """
+    Start refilling the virtualenv pools of all configs in
+    ``project_config`` in the background, once per pool and builder type.
+    """
+    pools = set()
     for build_config in project_config:
-        builder_type = build_config['type']
-        builder_class = builder_types[builder_type]
-        builder = builder_class(
-            build_config=build_config)
-        builder.build()
+        key = json.dumps([
+            build_config.get('venv_pool'),
+            build_config['type'],
+        ], sort_keys=True)
+        if key in pools:
+            continue
+        pools.add(key)
+        builder_class = builder_types[build_config['type']]
+        builder_class(build_config=build_config).refill_virtualenv_pool()
+
+
+def build(project_config, jobs=1, io_jobs=None, stages=False):
+    """
+    Build all configs in ``project_config``.
+
+    With more than one job, configs are built in a pool of ``jobs``
+    processes, and configs with the same python settings share one
+    virtualenv. With ``stages``, the builds are scheduled by
+    :func:`build_stages` instead. Once all builds are done, the virtualenv
+    pools are refilled in a detached process, which doesn't delay the
+    return.
+
+    Returns the timing reports of all builds, see
+    :class:`~readthedocs_build.builder.timing.TimingReport`.
+    """
+    reports = run_builds(
+        project_config, jobs=jobs, io_jobs=io_jobs, stages=stages)
+    refill_virtualenv_pools(project_config)
+    return reports
+
+
+def run_builds(project_config, jobs=1, io_jobs=None, stages=False):
+    if stages:
+        return build_stages(project_config, jobs=jobs, io_jobs=io_jobs)
+
+    if jobs <= 1:
+        reports = []
+        for build_config in project_config:
+            builder_type = build_config['type']
+            builder_class = builder_types[builder_type]
+            builder = builder_class(
+                build_config=build_config)
+            reports.append(builder.build())
+        return reports
+
+    groups = group_by_environment(project_config)
+    pool = Pool(processes=min(jobs, len(groups)), maxtasksperchild=1)
+    try:
+        group_reports = pool.map(build_group, groups, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return in_config_order(
+        project_config,
+        [build_config for group in groups for build_config in group],
+        [report for reports in group_reports for report in reports])
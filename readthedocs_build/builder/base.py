@@ -1,28 +1,295 @@
+from multiprocessing.pool import ThreadPool
 import os
 
+from ..search.export import export_search_data
+from ..search.export import get_sink
+from ..search.index import build_index
+from ..search.manifest import build_manifest
+from ..search.manifest import diff_manifests
+from ..search.manifest import load_manifest
+from ..search.manifest import write_json
+from ..scheduler import Stage
+from .cache import VirtualEnvCache
+from .host import RunningBuilds
+from .logs import BuildLog
+from .pool import fill_in_background
+from .requirements import has_only_named_requirements
+from .pool import get_pool
+from .timing import TimingReport
+from .trash import get_trash
 from .virtualenv import VirtualEnv
+from .wheelhouse import Wheelhouse
+
+
+def get_format_name(format_build):
+    """
+    Name of a format build method, e.g. ``html`` for ``build_html``.
+    """
+    name = getattr(format_build, '__name__', 'format')
+    if name.startswith('build_'):
+        return name[len('build_'):]
+    return name
 
 
 class BaseBuilder(object):
+    """
+    Builds the documentation for one build config.
+
+    A ``venv`` that was set up by another builder with the same python
+    settings can be passed in. It is then used as is and not cleaned up by
+    this builder.
+    """
+
     python_dependencies = ()
+    # Build the first format before all others, e.g. because it produces
+    # files that the others read.
+    first_format_alone = False
+    search_manifest_filename = 'manifest.json'
+    search_changes_filename = 'changes.json'
+    timings_filename = 'timings.json'
+    resources_filename = 'resources.json'
+    log_filename = 'build.log.gz'
+    venv = None
 
-    def __init__(self, build_config):
+    def __init__(self, build_config, venv=None):
         self.build_config = build_config
+        sampler_config = build_config.get('resource_sampler') or {}
+        self.timings = TimingReport(
+            build_config.get('name'),
+            sample_interval=sampler_config.get('interval'),
+            log=self.get_build_log())
+        self.shared_venv = venv is not None
+        # Leases on the cache entries the virtualenv is made of.
+        self.cache_leases = []
+        if venv is not None:
+            self.venv = venv
 
     def get_source_directory(self):
         return self.build_config['base']
 
     def setup(self):
-        self.setup_virtualenv()
+        if not self.shared_venv:
+            self.setup_virtualenv()
 
-    def setup_virtualenv(self):
+    def get_virtualenv_options(self):
+        """
+        Return keyword arguments for every ``VirtualEnv`` created by this
+        builder.
+        """
+        options = {}
+        wheelhouse_config = self.build_config.get('wheelhouse')
+        if wheelhouse_config:
+            options['wheelhouse'] = Wheelhouse(
+                wheelhouse_config['path'],
+                max_size=wheelhouse_config.get('max_size'),
+                offline=wheelhouse_config.get('offline', False))
+        trash_config = self.build_config.get('trash')
+        if trash_config:
+            options['trash'] = get_trash(trash_config['path'])
+        return options
+
+    def get_requirements_files(self):
+        requirements_file = self.build_config.get('requirements_file')
+        if requirements_file:
+            return [requirements_file]
+        return []
+
+    def get_venv_cache_config(self):
+        """
+        Return the config of the virtualenv cache, or ``None`` if it is not
+        used. Requirements like local projects, editable installs or version
+        control checkouts depend on more than the content of the
+        requirements files, they bypass the cache.
+        """
+        cache_config = self.build_config.get('venv_cache')
+        if not cache_config:
+            return None
+        args = ['-r{}'.format(path) for path in self.get_requirements_files()]
+        if not has_only_named_requirements(args):
+            return None
+        return cache_config
+
+    def get_project_install(self):
+        """
+        Return a ``(path, extras)`` tuple for the project that gets installed
+        with pip in batch install mode or ``None``.
+        """
         python_config = self.build_config['python']
-        self.venv = VirtualEnv(python_config)
-        for package in self.python_dependencies:
-            self.venv.install(package)
-        if python_config['setup_py_install']:
+        if (python_config.get('pip_install', False) or
+                python_config['setup_py_install']):
+            path = os.path.dirname(python_config['setup_py_path'])
+            return path, python_config.get('extra_requirements', [])
+        return None
+
+    def install_dependencies(self, venv, include_project=False):
+        """
+        Install the builder's ``python_dependencies`` and the requirements
+        files. In batch install mode this is a single pip call that also
+        installs the project if ``include_project`` is true.
+        """
+        packages = [
+            package for package in self.python_dependencies
+            if package not in venv.provided_dependencies]
+        requirements_files = self.get_requirements_files()
+        if self.build_config.get('batch_install'):
+            project_path, extras = None, ()
+            if include_project and self.get_project_install() is not None:
+                project_path, extras = self.get_project_install()
+            venv.install_all(
+                packages=packages,
+                requirements_files=requirements_files,
+                project_path=project_path,
+                extras=extras)
+            return
+        for package in packages:
+            venv.install(package)
+        for requirements_file in requirements_files:
+            venv.install('-r{}'.format(requirements_file))
+
+    def install_project(self, venv):
+        python_config = self.build_config['python']
+        if self.build_config.get('batch_install'):
+            project = self.get_project_install()
+            if project is not None:
+                project_path, extras = project
+                venv.install_all(project_path=project_path, extras=extras)
+        elif python_config['setup_py_install']:
             setup_py_path = python_config['setup_py_path']
-            self.venv.python_run(setup_py_path, ['install'])
+            venv.python_run(setup_py_path, ['install'])
+
+    def get_cached_virtualenv(self, cache_config):
+        """
+        Return a virtualenv with all dependencies installed from the
+        virtualenv cache. It gets populated if there is no matching entry.
+
+        Cache entries are never modified. If the project gets installed, the
+        returned virtualenv is a fresh one with the cache entry as its base
+        layer.
+        """
+        python_config = self.build_config['python']
+        options = self.get_virtualenv_options()
+        cache = VirtualEnvCache(
+            cache_config['path'],
+            max_size=cache_config.get('max_size'),
+            max_entries=cache_config.get('max_entries'),
+            trash=options.get('trash'))
+        key = cache.get_key(
+            python_config,
+            self.python_dependencies,
+            self.get_requirements_files())
+
+        def setup(path):
+            venv = VirtualEnv(python_config, base_path=path,
+                              persistent=True, **options)
+            self.install_dependencies(venv)
+        lease = cache.acquire(key, setup)
+        self.cache_leases.append(lease)
+        cache.evict(keep=[key])
+        venv = VirtualEnv(python_config, base_path=lease.path,
+                          persistent=True, **options)
+        if self.get_project_install() is None:
+            return venv
+        return VirtualEnv(python_config, base_layer=venv, **options)
+
+    def get_base_layer(self, layers_config):
+        """
+        Return the read-only virtualenv with the builder's
+        ``python_dependencies`` for the configured python version. It is
+        shared by all builds and created on first use.
+        """
+        python_config = self.build_config['python']
+        layer_config = {
+            'version': python_config.get('version', '2.7'),
+            'use_system_site_packages': python_config.get(
+                'use_system_site_packages', False),
+        }
+        options = self.get_virtualenv_options()
+        layers = VirtualEnvCache(
+            layers_config['path'],
+            max_entries=layers_config.get('max_entries'),
+            trash=options.get('trash'))
+        key = layers.get_key(layer_config, self.python_dependencies)
+
+        def setup(path):
+            venv = VirtualEnv(layer_config, base_path=path,
+                              persistent=True, **options)
+            for package in self.python_dependencies:
+                venv.install(package)
+            venv.compile()
+            venv.make_read_only()
+        lease = layers.acquire(key, setup)
+        self.cache_leases.append(lease)
+        layers.evict(keep=[key])
+        base_layer = VirtualEnv(layer_config, base_path=lease.path,
+                                persistent=True)
+        base_layer.provided_dependencies = self.python_dependencies
+        return base_layer
+
+    def create_virtualenv(self):
+        """
+        Create the virtualenv. If it comes from the virtualenv cache, the
+        dependencies are installed already.
+        """
+        python_config = self.build_config['python']
+        cache_config = self.get_venv_cache_config()
+        pool_config = self.build_config.get('venv_pool')
+        layers_config = self.build_config.get('venv_layers')
+        if cache_config:
+            self.venv = self.get_cached_virtualenv(cache_config)
+            return
+
+        options = self.get_virtualenv_options()
+        if layers_config:
+            options['base_layer'] = self.get_base_layer(layers_config)
+        elif pool_config:
+            options['pool'] = get_pool(
+                pool_config,
+                self.python_dependencies,
+                wheelhouse=options.get('wheelhouse'),
+                trash=options.get('trash'))
+        self.venv = VirtualEnv(python_config, **options)
+        if 'pool' in options:
+            self.timings.venv_pool = (
+                'hit' if self.venv.pool is not None else 'miss')
+
+    def refill_virtualenv_pool(self):
+        """
+        Start refilling the virtualenv pool in a detached process, if the
+        virtualenv is leased from one. Should be called once the build is
+        done, so creating virtualenvs doesn't slow it down.
+        """
+        pool_config = self.build_config.get('venv_pool')
+        if (not pool_config or self.get_venv_cache_config() or
+                self.build_config.get('venv_layers')):
+            return
+        fill_in_background(
+            pool_config,
+            self.build_config['type'],
+            wheelhouse_config=self.build_config.get('wheelhouse'))
+
+    def install_virtualenv_dependencies(self):
+        if self.get_venv_cache_config():
+            return
+        if self.build_config.get('batch_install'):
+            self.install_dependencies(self.venv, include_project=True)
+        else:
+            self.install_dependencies(self.venv)
+
+    def install_virtualenv_project(self):
+        # In batch install mode the project is installed together with the
+        # dependencies, unless they came from the cache.
+        if (self.build_config.get('batch_install') and
+                not self.get_venv_cache_config()):
+            return
+        self.install_project(self.venv)
+
+    def timed(self, stage, function):
+        return self.timings.timed(stage, function)
+
+    def setup_virtualenv(self):
+        self.timed('virtualenv', self.create_virtualenv)()
+        self.timed('dependencies', self.install_virtualenv_dependencies)()
+        self.timed('project', self.install_virtualenv_project)()
 
     def get_output_directory(self, format):
         out_dir = os.path.join(
@@ -33,14 +300,185 @@ class BaseBuilder(object):
             os.makedirs(out_dir)
         return out_dir
 
+    def get_build_log(self):
+        """
+        Return the log that captures the output of all subprocesses if
+        ``log_capture`` is enabled.
+        """
+        capture_config = self.build_config.get('log_capture')
+        if not capture_config:
+            return None
+        return BuildLog(
+            self.get_timings_path(self.log_filename),
+            tail_size=capture_config['tail_size'])
+
+    def get_timings_path(self, filename=None):
+        return os.path.join(
+            self.build_config['output_base'],
+            self.build_config['name'],
+            filename or self.timings_filename)
+
+    def write_timings(self):
+        """
+        Write the timing report to ``timings.json`` in the output directory
+        and return it. The resource samples, if taken, are written to
+        ``resources.json``. The captured log is closed.
+        """
+        if self.timings.log is not None:
+            self.timings.log.close()
+        report = self.timings.as_dict()
+        write_json(self.get_timings_path(), report)
+        if self.timings.sample_interval:
+            write_json(
+                self.get_timings_path(self.resources_filename),
+                self.timings.get_timeline())
+        return report
+
     def build(self):
         """
-        Initializes the build.
+        Initializes the build. Returns the timing report, which is also
+        written to the output directory, even if the build fails. Cleans up
+        in any case.
+        """
+        running_builds = RunningBuilds()
+        entry = running_builds.register()
+        try:
+            self.setup()
+            self.build_formats()
+        finally:
+            try:
+                self.timed('cleanup', self.cleanup)()
+            finally:
+                running_builds.unregister(entry)
+                report = self.write_timings()
+        return report
+
+    def get_format_builds(self):
+        """
+        Return the methods that build the output formats. They must not
+        depend on each other.
+        """
+        return [
+            self.build_html,
+            self.build_search_data,
+        ]
+
+    def get_post_builds(self):
+        """
+        Return the methods that process the output after all formats are
+        built.
+        """
+        return [
+            self.build_search_index,
+            self.export_search_data,
+        ]
+
+    def build_formats(self):
+        format_builds = [
+            self.timed(get_format_name(format_build), format_build)
+            for format_build in self.get_format_builds()]
+        if self.first_format_alone:
+            format_builds[0]()
+            format_builds = format_builds[1:]
+        self.run_format_builds(format_builds)
+        for post_build in self.get_post_builds():
+            self.timed(get_format_name(post_build), post_build)()
+
+    def share_virtualenv(self, owner):
+        self.venv = owner.venv
+
+    def get_stage_name(self, stage):
+        return '{}:{}'.format(self.build_config['name'], stage)
+
+    def get_stages(self, owner=None, cleanup_after=()):
+        """
+        Return the stages of this build for the
+        :class:`~readthedocs_build.scheduler.Scheduler`, named
+        ``<name>:<stage>``.
+
+        If ``owner`` is given, this build uses the virtualenv of the
+        ``owner`` builder once it is set up. The cleanup runs after all
+        stages named in ``cleanup_after``.
         """
-        self.setup()
-        self.build_html()
-        self.build_search_data()
-        self.cleanup()
+        if owner is not None:
+            self.shared_venv = True
+            setup_stages = [Stage(
+                self.get_stage_name('virtualenv'),
+                self.timed(
+                    'virtualenv', lambda: self.share_virtualenv(owner)),
+                dependencies=[owner.get_stage_name('project')],
+                resource='io')]
+        elif self.shared_venv:
+            setup_stages = []
+        else:
+            setup_stages = [
+                Stage(
+                    self.get_stage_name('virtualenv'),
+                    self.timed('virtualenv', self.create_virtualenv),
+                    resource='io'),
+                Stage(
+                    self.get_stage_name('dependencies'),
+                    self.timed(
+                        'dependencies', self.install_virtualenv_dependencies),
+                    dependencies=[self.get_stage_name('virtualenv')],
+                    resource='io'),
+                Stage(
+                    self.get_stage_name('project'),
+                    self.timed('project', self.install_virtualenv_project),
+                    dependencies=[self.get_stage_name('dependencies')],
+                    resource='io'),
+            ]
+
+        format_stages = []
+        for format_build in self.get_format_builds():
+            dependencies = [stage.name for stage in setup_stages[-1:]]
+            if self.first_format_alone and format_stages:
+                dependencies.append(format_stages[0].name)
+            format_name = get_format_name(format_build)
+            format_stages.append(Stage(
+                self.get_stage_name(format_name),
+                self.timed(format_name, format_build),
+                dependencies=dependencies))
+        post_stages = [
+            Stage(
+                self.get_stage_name(get_format_name(post_build)),
+                self.timed(get_format_name(post_build), post_build),
+                dependencies=[stage.name for stage in format_stages],
+                resource='io')
+            for post_build in self.get_post_builds()]
+        stages = setup_stages + format_stages + post_stages
+
+        def cleanup():
+            try:
+                self.timed('cleanup', self.cleanup)()
+            finally:
+                self.write_timings()
+
+        stages.append(Stage(
+            self.get_stage_name('cleanup'),
+            cleanup,
+            dependencies=[stage.name for stage in stages] + list(
+                cleanup_after),
+            resource='io',
+            always=True))
+        return stages
+
+    def run_format_builds(self, format_builds):
+        """
+        Run all ``format_builds``. Up to ``format_concurrency`` of them run at
+        the same time.
+        """
+        concurrency = self.build_config.get('format_concurrency', 1)
+        if concurrency <= 1 or len(format_builds) <= 1:
+            for format_build in format_builds:
+                format_build()
+            return
+        pool = ThreadPool(processes=min(concurrency, len(format_builds)))
+        try:
+            pool.map(lambda format_build: format_build(), format_builds)
+        finally:
+            pool.close()
+            pool.join()
 
     def build_html(self):
         # Must be overriden by subclass.
@@ -54,5 +492,76 @@ class BaseBuilder(object):
         # Must be overriden by subclass.
         pass
 
+    def get_search_state_path(self):
+        state_config = self.build_config.get('search_state')
+        if not state_config:
+            return None
+        return os.path.join(
+            state_config['path'],
+            self.build_config['name'].replace(os.sep, '-') + '.json')
+
+    def load_search_manifest(self):
+        """
+        Return the search manifest of the previous build. Call it before the
+        search data is written.
+        """
+        state_path = self.get_search_state_path()
+        if state_path is None:
+            state_path = os.path.join(
+                self.get_output_directory('search_data'),
+                self.search_manifest_filename)
+        return load_manifest(state_path)
+
+    def write_search_manifest(self, previous_manifest):
+        """
+        Write the content hashes of all pages to ``manifest.json`` and the
+        ``added``, ``changed`` and ``removed`` pages since
+        ``previous_manifest`` to ``changes.json`` in the search data.
+        """
+        search_data_dir = self.get_output_directory('search_data')
+        manifest = build_manifest(search_data_dir)
+        write_json(
+            os.path.join(search_data_dir, self.search_changes_filename),
+            diff_manifests(previous_manifest, manifest))
+        write_json(
+            os.path.join(search_data_dir, self.search_manifest_filename),
+            manifest)
+        state_path = self.get_search_state_path()
+        if state_path is not None:
+            write_json(state_path, manifest)
+
+    def build_search_index(self):
+        """
+        Write the search data as inverted index to ``search_index/search.idx``
+        if ``search_index`` is enabled. Run it after ``build_search_data``.
+        """
+        if not self.build_config.get('search_index'):
+            return
+        build_index(
+            self.get_output_directory('search_data'),
+            os.path.join(
+                self.get_output_directory('search_index'), 'search.idx'))
+
+    def export_search_data(self):
+        """
+        Stream the search data as bulk NDJSON files into the configured
+        ``search_export`` sink. Run it after ``build_search_data``.
+        """
+        export_config = self.build_config.get('search_export')
+        if not export_config:
+            return
+        export_kwargs = {'compress': export_config.get('compress', False)}
+        if export_config.get('max_bytes'):
+            export_kwargs['max_bytes'] = export_config['max_bytes']
+        export_search_data(
+            self.get_output_directory('search_data'),
+            get_sink(export_config, self.build_config['name']),
+            self.build_config['name'],
+            **export_kwargs)
+
     def cleanup(self):
-        self.venv.cleanup()
+        # The virtualenv is missing if its setup failed.
+        if not self.shared_venv and self.venv is not None:
+            self.venv.cleanup()
+        while self.cache_leases:
+            self.cache_leases.pop().release()
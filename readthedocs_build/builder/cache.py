@@ -0,0 +1,276 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from .requirements import get_requirements_files
+
+
+class VirtualEnvCache(object):
+    """
+    Persistent store of ready to use virtualenvs.
+
+    Every entry is a directory named after a key that is derived from all
+    inputs that influence the content of a virtualenv. Entries are built in a
+    temporary directory next to the cache and renamed into place once they are
+    complete, so a half-populated entry is never visible to other builds.
+
+    Entries are never modified after they are complete. Builds use them
+    through a :class:`CacheLease`, a shared lock on the entry's lock file.
+    The least recently used entries are removed when the cache grows over
+    ``max_size`` bytes or ``max_entries`` entries, but never while a build
+    holds a lease on them. Removed entries are moved into the ``trash`` if
+    one is given.
+    """
+
+    metadata_filename = '.rtd-cache.json'
+    lock_filename = '.rtd-cache.lock'
+    tmp_prefix = '.tmp-'
+
+    # Leftovers of crashed builds are removed after that many seconds.
+    tmp_max_age = 24 * 60 * 60
+
+    def __init__(self, path, max_size=None, max_entries=None, trash=None):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.trash = trash
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def get_key(self, python_config, dependencies, requirements_files=()):
+        """
+        Return the cache key for a virtualenv with the given python config,
+        installed ``dependencies`` and the content of ``requirements_files``
+        and all files they include.
+        """
+        key = {
+            'version': str(python_config.get('version', '2.7')),
+            'use_system_site_packages': bool(
+                python_config.get('use_system_site_packages', False)),
+            'dependencies': list(dependencies),
+            'requirements': [],
+        }
+        args = ['-r{}'.format(path) for path in requirements_files]
+        for requirements_file in get_requirements_files(args):
+            with open(requirements_file, 'rb') as f:
+                content_hash = hashlib.sha256(f.read()).hexdigest()
+            key['requirements'].append(content_hash)
+        serialized = json.dumps(key, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(serialized).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.path, key)
+
+    def get_metadata_path(self, key):
+        return os.path.join(self.get_path(key), self.metadata_filename)
+
+    def get_lock_path(self, key):
+        return os.path.join(self.get_path(key), self.lock_filename)
+
+    def open_lock(self, key):
+        """
+        Return the opened lock file of the entry for ``key`` or ``None`` if
+        there is no such entry.
+        """
+        try:
+            return open(self.get_lock_path(key), 'a')
+        except (IOError, OSError):
+            return None
+
+    def is_current(self, key, lock_file):
+        """
+        Whether ``lock_file`` still belongs to the entry for ``key``. It does
+        not if the entry was removed, and maybe populated again, after the
+        file was opened.
+        """
+        try:
+            current = os.stat(self.get_lock_path(key))
+        except OSError:
+            return False
+        return current.st_ino == os.fstat(lock_file.fileno()).st_ino
+
+    def lookup(self, key):
+        """
+        Return the path of the cached virtualenv for ``key`` or ``None`` if
+        there is no such entry. The entry is marked as recently used.
+        """
+        metadata_path = self.get_metadata_path(key)
+        if not os.path.exists(metadata_path):
+            return None
+        os.utime(metadata_path, None)
+        return self.get_path(key)
+
+    def lease(self, key):
+        """
+        Return a :class:`CacheLease` on the entry for ``key`` or ``None`` if
+        there is no such entry. The entry is marked as recently used.
+        """
+        lock_file = self.open_lock(key)
+        if lock_file is None:
+            return None
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        # The entry might have been removed while we waited for the lock.
+        if not self.is_current(key, lock_file) or self.lookup(key) is None:
+            lock_file.close()
+            return None
+        return CacheLease(self.get_path(key), lock_file)
+
+    def acquire(self, key, setup):
+        """
+        Return a :class:`CacheLease` on the entry for ``key``. The entry is
+        populated with ``setup`` if it is missing.
+        """
+        while True:
+            lease = self.lease(key)
+            if lease is not None:
+                return lease
+            self.populate(key, setup)
+
+    def populate(self, key, setup):
+        """
+        Create the entry for ``key``.
+
+        ``setup`` is called with the path to an empty directory and must
+        create the virtualenv in there. Returns the path of the entry.
+        """
+        tmp_path = tempfile.mkdtemp(
+            prefix='{prefix}{key}-'.format(prefix=self.tmp_prefix, key=key),
+            dir=self.path)
+        try:
+            setup(tmp_path)
+            metadata = {
+                'size': get_directory_size(tmp_path),
+                'created': time.time(),
+            }
+            with open(os.path.join(tmp_path, self.metadata_filename),
+                      'w') as f:
+                json.dump(metadata, f)
+            with open(os.path.join(tmp_path, self.lock_filename), 'w'):
+                pass
+            os.rename(tmp_path, self.get_path(key))
+        except OSError:
+            # Another build populated the same entry in the meantime.
+            if self.lookup(key) is None:
+                raise
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        return self.get_path(key)
+
+    def get_entries(self):
+        """
+        Return a list of ``(last_used, size, key)`` tuples, least recently
+        used first.
+        """
+        entries = []
+        for key in os.listdir(self.path):
+            if key.startswith(self.tmp_prefix):
+                continue
+            metadata_path = self.get_metadata_path(key)
+            try:
+                with open(metadata_path, 'r') as f:
+                    metadata = json.load(f)
+                last_used = os.path.getmtime(metadata_path)
+            except (IOError, OSError, ValueError):
+                continue
+            entries.append((last_used, metadata.get('size', 0), key))
+        return sorted(entries)
+
+    def remove(self, key):
+        """
+        Remove the entry for ``key`` unless a build holds a lease on it.
+        Returns whether the entry was removed.
+        """
+        lock_file = self.open_lock(key)
+        if lock_file is None:
+            return False
+        try:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return False
+            if not self.is_current(key, lock_file):
+                return False
+            # Rename first so that concurrent lookups never see a partially
+            # deleted entry.
+            tmp_path = tempfile.mkdtemp(
+                prefix='{prefix}{key}-'.format(
+                    prefix=self.tmp_prefix, key=key),
+                dir=self.path)
+            try:
+                os.rename(self.get_path(key), os.path.join(tmp_path, key))
+            finally:
+                self.discard(tmp_path)
+            return True
+        finally:
+            lock_file.close()
+
+    def remove_stale_tmp_directories(self):
+        now = time.time()
+        for filename in os.listdir(self.path):
+            if not filename.startswith(self.tmp_prefix):
+                continue
+            path = os.path.join(self.path, filename)
+            try:
+                if now - os.path.getmtime(path) > self.tmp_max_age:
+                    self.discard(path)
+            except OSError:
+                pass
+
+    def discard(self, path):
+        if self.trash is not None:
+            self.trash.discard(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def evict(self, keep=()):
+        """
+        Remove least recently used entries until the cache fits into
+        ``max_size`` and ``max_entries``. Keys in ``keep`` and leased
+        entries are never removed.
+        """
+        self.remove_stale_tmp_directories()
+        entries = self.get_entries()
+        total_size = sum(size for last_used, size, key in entries)
+        count = len(entries)
+        for last_used, size, key in entries:
+            too_big = self.max_size is not None and total_size > self.max_size
+            too_many = (
+                self.max_entries is not None and count > self.max_entries)
+            if not too_big and not too_many:
+                break
+            if key in keep or not self.remove(key):
+                continue
+            total_size -= size
+            count -= 1
+
+
+class CacheLease(object):
+    """
+    Keeps the cache entry at ``path`` from being removed until
+    :meth:`release` is called.
+    """
+
+    def __init__(self, path, lock_file):
+        self.path = path
+        self.lock_file = lock_file
+
+    def release(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+def get_directory_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import tempfile
+import uuid
+
+from .utils import pid_exists
+
+
+DEFAULT_RUNNING_BUILDS_PATH = os.path.join(
+    tempfile.gettempdir(), 'rtd-build-running')
+
+
+class RunningBuilds(object):
+    """
+    Registry of the builds running on this host. Every running build has a
+    ``<pid>-<id>`` file in ``path``. Entries of processes that died are
+    ignored and removed.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = DEFAULT_RUNNING_BUILDS_PATH
+        self.path = os.path.abspath(path)
+        if not os.path.exists(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # Created by another build in the meantime.
+                pass
+
+    def register(self):
+        """
+        Register a running build and return its entry.
+        """
+        entry = os.path.join(self.path, '{pid}-{id}'.format(
+            pid=os.getpid(), id=uuid.uuid4().hex))
+        with open(entry, 'w'):
+            pass
+        return entry
+
+    def unregister(self, entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+    def count(self):
+        count = 0
+        for filename in os.listdir(self.path):
+            try:
+                pid = int(filename.split('-', 1)[0])
+            except ValueError:
+                continue
+            if pid_exists(pid):
+                count += 1
+            else:
+                self.unregister(os.path.join(self.path, filename))
+        return count
+
+
+def get_cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def get_parallel_jobs(jobs, max_jobs=None, running_builds=1,
+                      concurrency=1):
+    """
+    Return how many parallel jobs a build should use.
+
+    ``jobs`` is the number the build asked for or ``'auto'``, ``max_jobs``
+    the operator's cap. The CPUs are shared evenly between all
+    ``running_builds`` on this host and the ``concurrency`` processes of this
+    build, so builds don't oversubscribe the CPUs.
+    """
+    cpu_count = get_cpu_count()
+    if jobs == 'auto':
+        jobs = cpu_count
+    if max_jobs is not None:
+        jobs = min(jobs, max_jobs)
+    fair_share = cpu_count // max(1, running_builds * concurrency)
+    return max(1, min(jobs, fair_share))
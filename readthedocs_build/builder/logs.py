@@ -0,0 +1,206 @@
+"""
+Captures the output of build subprocesses.
+
+Instead of inheriting our stdout, the subprocesses write into pipes that
+are read as the output arrives. Every line is written with a timestamp, the
+label of the subprocess and the stream name to a gzip compressed per build
+log. Only the last bytes of every subprocess are kept in memory, to report
+them if it fails.
+"""
+
+from collections import deque
+import errno
+import gzip
+import os
+import select
+import threading
+import time
+
+try:
+    import selectors
+except ImportError:  # Python 2
+    selectors = None
+
+
+__all__ = ('BuildLog', 'RingBuffer')
+
+
+DEFAULT_TAIL_SIZE = 64 * 1024
+
+READ_SIZE = 64 * 1024
+
+# Output without newlines is split into lines of at most this size.
+MAX_LINE_SIZE = 64 * 1024
+
+
+class RingBuffer(object):
+    """
+    Keeps the last ``size`` bytes written to it.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.chunks = deque()
+        self.length = 0
+
+    def write(self, data):
+        if len(data) >= self.size:
+            self.chunks.clear()
+            self.chunks.append(data[-self.size:])
+            self.length = self.size
+            return
+        self.chunks.append(data)
+        self.length += len(data)
+        while self.length - len(self.chunks[0]) >= self.size:
+            self.length -= len(self.chunks.popleft())
+
+    def getvalue(self):
+        return b''.join(self.chunks)[-self.size:]
+
+
+class SelectorPoller(object):
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+
+    def register(self, fd):
+        self.selector.register(fd, selectors.EVENT_READ)
+
+    def unregister(self, fd):
+        self.selector.unregister(fd)
+
+    def poll(self):
+        return [key.fd for key, events in self.selector.select()]
+
+    def close(self):
+        self.selector.close()
+
+
+class SelectPoller(object):
+    """
+    Fallback for Pythons without the ``selectors`` module.
+    """
+
+    def __init__(self):
+        self.fds = set()
+
+    def register(self, fd):
+        self.fds.add(fd)
+
+    def unregister(self, fd):
+        self.fds.discard(fd)
+
+    def poll(self):
+        while True:
+            try:
+                return select.select(list(self.fds), [], [])[0]
+            except select.error as error:
+                if error.args[0] != errno.EINTR:
+                    raise
+
+    def close(self):
+        pass
+
+
+def get_poller():
+    if selectors is not None:
+        return SelectorPoller()
+    return SelectPoller()
+
+
+def read_pipes(pipes, callback):
+    """
+    Call ``callback(name, data)`` with the output of the named ``pipes`` as
+    it arrives, until all of them are closed. All pipes are read as soon as
+    they have data, so a subprocess never blocks on a full pipe.
+    """
+    names = dict((pipe.fileno(), name) for name, pipe in pipes.items())
+    poller = get_poller()
+    try:
+        for fd in names:
+            poller.register(fd)
+        while names:
+            for fd in poller.poll():
+                data = os.read(fd, READ_SIZE)
+                if data:
+                    callback(names[fd], data)
+                else:
+                    poller.unregister(fd)
+                    del names[fd]
+    finally:
+        poller.close()
+
+
+def get_timestamp():
+    now = time.time()
+    return '{}.{:03d}Z'.format(
+        time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)),
+        int(now % 1 * 1000))
+
+
+class BuildLog(object):
+    """
+    Gzip compressed log at ``path`` of all subprocesses of a build. Several
+    subprocesses can write to it at the same time, their lines are not
+    mixed up. The last ``tail_size`` bytes of every subprocess are kept in
+    memory.
+
+    The log of a previous build at ``path`` is replaced on the first write.
+    """
+
+    def __init__(self, path, tail_size=DEFAULT_TAIL_SIZE):
+        self.path = path
+        self.tail_size = tail_size
+        self.lock = threading.Lock()
+        self.file = None
+        self.mode = 'wb'
+
+    def write_line(self, label, stream, line):
+        prefix = '{timestamp} [{label}:{stream}] '.format(
+            timestamp=get_timestamp(), label=label, stream=stream)
+        with self.lock:
+            if self.file is None:
+                directory = os.path.dirname(self.path)
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                self.file = gzip.GzipFile(self.path, self.mode)
+                # Reopening after close appends a gzip member, gzip readers
+                # concatenate them.
+                self.mode = 'ab'
+            self.file.write(prefix.encode('utf-8') + line + b'\n')
+
+    def capture(self, popen, label):
+        """
+        Write the output of ``popen``, whose stdout and stderr must be
+        pipes, to the log until both are closed. Returns the last bytes of
+        the output.
+        """
+        tail = RingBuffer(self.tail_size)
+        pending = {'stdout': b'', 'stderr': b''}
+
+        def write(stream, data):
+            tail.write(data)
+            lines = (pending[stream] + data).split(b'\n')
+            pending[stream] = lines.pop()
+            while len(pending[stream]) > MAX_LINE_SIZE:
+                lines.append(pending[stream][:MAX_LINE_SIZE])
+                pending[stream] = pending[stream][MAX_LINE_SIZE:]
+            for line in lines:
+                self.write_line(label, stream, line)
+
+        pipes = {'stdout': popen.stdout, 'stderr': popen.stderr}
+        try:
+            read_pipes(pipes, write)
+        finally:
+            popen.stdout.close()
+            popen.stderr.close()
+        for stream in sorted(pending):
+            if pending[stream]:
+                self.write_line(label, stream, pending[stream])
+        return tail.getvalue()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
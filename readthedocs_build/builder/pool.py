@@ -0,0 +1,268 @@
+import collections
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import uuid
+
+from .utils import get_new_session_options
+from .utils import pid_exists
+from .virtualenv import VirtualEnv
+
+
+class VirtualEnvPool(object):
+    """
+    Keeps ``size`` ready-made virtualenvs per python version in ``versions``
+    with ``dependencies`` already installed.
+
+    Leasing a virtualenv is a rename of its directory, so multiple processes
+    can share one pool directory. The pool is refilled by :meth:`fill`,
+    which builds start in a detached process after they are done, see
+    :func:`fill_in_background`. Only one process fills the pool at a time.
+    Packages are installed from the ``wheelhouse`` if one is given.
+    Discarded virtualenvs are moved into the ``trash`` if one is given.
+
+    The layout of the pool directory is::
+
+        ready/<version>/<id>  virtualenvs waiting to be leased
+        leased/<pid>-<id>     virtualenvs used by a build
+        tmp/<pid>-<id>        virtualenvs being created
+        fill.lock             held by the process filling the pool
+        fill.log              output of the background fills
+    """
+
+    def __init__(self, path, versions, dependencies=(), size=2,
+                 wheelhouse=None, trash=None):
+        self.path = os.path.abspath(path)
+        self.wheelhouse = wheelhouse
+        self.trash = trash
+        self.versions = [str(version) for version in versions]
+        self.dependencies = tuple(dependencies)
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.ready = {}
+        for version in self.versions:
+            ready_path = self.get_ready_path(version)
+            if not os.path.exists(ready_path):
+                os.makedirs(ready_path)
+            self.load_ready(version)
+        for directory in ('leased', 'tmp'):
+            directory = os.path.join(self.path, directory)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            remove_orphans(directory)
+
+    def load_ready(self, version):
+        """
+        Read the ready virtualenvs of ``version`` from the pool directory,
+        other processes might have leased or added some.
+        """
+        ready = collections.deque(sorted(
+            os.listdir(self.get_ready_path(version))))
+        with self.lock:
+            self.ready[version] = ready
+
+    def get_ready_path(self, version, venv_id=None):
+        path = os.path.join(self.path, 'ready', str(version))
+        if venv_id is not None:
+            path = os.path.join(path, venv_id)
+        return path
+
+    def get_python_config(self, version):
+        return {
+            'version': version,
+            'use_system_site_packages': False,
+        }
+
+    def lease(self, python_config):
+        """
+        Return the path of a ready virtualenv matching ``python_config`` or
+        ``None`` if there is none.
+        """
+        version = str(python_config.get('version', '2.7'))
+        if (version not in self.ready or
+                python_config.get('use_system_site_packages', False)):
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            while True:
+                with self.lock:
+                    venv_id = self.ready[version].popleft()
+                leased_path = os.path.join(
+                    self.path, 'leased', '{pid}-{id}'.format(
+                        pid=os.getpid(), id=venv_id))
+                try:
+                    os.rename(self.get_ready_path(version, venv_id),
+                              leased_path)
+                except OSError:
+                    # Leased by another process sharing the pool directory.
+                    continue
+                with self.lock:
+                    self.hits += 1
+                return leased_path
+        except IndexError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+    def release(self, path, reuse=False):
+        """
+        Return a leased virtualenv. It is put back into the pool if ``reuse``
+        is true, otherwise it gets deleted.
+        """
+        version = self.get_version(path)
+        if reuse and version in self.ready:
+            venv_id = uuid.uuid4().hex
+            os.rename(path, self.get_ready_path(version, venv_id))
+            with self.lock:
+                self.ready[version].append(venv_id)
+        elif self.trash is not None:
+            self.trash.discard(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def get_version(self, path):
+        version_file = os.path.join(path, '.rtd-pool-version')
+        try:
+            with open(version_file, 'r') as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    def create(self, version):
+        tmp_path = os.path.join(self.path, 'tmp', '{pid}-{id}'.format(
+            pid=os.getpid(), id=uuid.uuid4().hex))
+        try:
+            venv = VirtualEnv(
+                self.get_python_config(version),
+                base_path=tmp_path,
+                persistent=True,
+                wheelhouse=self.wheelhouse)
+            for package in self.dependencies:
+                venv.install(package)
+            with open(os.path.join(tmp_path, '.rtd-pool-version'), 'w') as f:
+                f.write(version)
+            venv_id = uuid.uuid4().hex
+            os.rename(tmp_path, self.get_ready_path(version, venv_id))
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        with self.lock:
+            self.ready[version].append(venv_id)
+
+    def refill(self, version):
+        while True:
+            # Builds in other processes lease virtualenvs meanwhile.
+            self.load_ready(version)
+            with self.lock:
+                if len(self.ready[version]) >= self.size:
+                    return
+            self.create(version)
+
+    def fill(self):
+        """
+        Create virtualenvs until there are ``size`` ready ones of every
+        version. Returns ``False`` without creating any if another process
+        is filling the pool already.
+        """
+        with open(os.path.join(self.path, 'fill.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return False
+            for version in self.versions:
+                try:
+                    self.refill(version)
+                except Exception:  # pylint: disable=broad-except
+                    # A failing refill only costs a pool miss later on.
+                    pass
+        return True
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'ready': dict(
+                    (version, len(ready))
+                    for version, ready in self.ready.items()),
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(pool_config, dependencies=(), wheelhouse=None, trash=None):
+    """
+    Return the shared pool for ``pool_config`` and ``dependencies``. It is
+    created on first use.
+    """
+    key = (os.path.abspath(pool_config['path']), tuple(dependencies))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = VirtualEnvPool(
+                pool_config['path'],
+                versions=pool_config['versions'],
+                dependencies=dependencies,
+                size=pool_config.get('size', 2),
+                wheelhouse=wheelhouse,
+                trash=trash)
+        return _pools[key]
+
+
+def get_fill_command(pool_config, builder_type, wheelhouse_config=None):
+    """
+    Return the ``rtd-build pool fill`` command that fills the pool of
+    ``pool_config`` with the dependencies of ``builder_type``.
+    """
+    command = [
+        sys.executable, '-m', 'readthedocs_build.cli', 'pool', 'fill',
+        pool_config['path'],
+        '--type', builder_type,
+        '--size', str(pool_config.get('size', 2)),
+    ]
+    for version in pool_config['versions']:
+        command.extend(['--version', str(version)])
+    if wheelhouse_config:
+        command.extend(['--wheelhouse', wheelhouse_config['path']])
+        if wheelhouse_config.get('offline', False):
+            command.append('--offline')
+    return command
+
+
+def fill_in_background(pool_config, builder_type, wheelhouse_config=None):
+    """
+    Fill the pool of ``pool_config`` in a detached process, which keeps
+    running after our process exits. Its output goes to ``fill.log`` in the
+    pool directory.
+    """
+    if not os.path.exists(pool_config['path']):
+        os.makedirs(pool_config['path'])
+    log_path = os.path.join(pool_config['path'], 'fill.log')
+    with open(log_path, 'ab') as log:
+        subprocess.Popen(
+            get_fill_command(pool_config, builder_type, wheelhouse_config),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            close_fds=True,
+            **get_new_session_options())
+
+
+def remove_orphans(directory):
+    """
+    Remove ``<pid>-<id>`` entries whose process is not running anymore.
+    """
+    for filename in os.listdir(directory):
+        try:
+            pid = int(filename.split('-', 1)[0])
+        except ValueError:
+            continue
+        if not pid_exists(pid):
+            shutil.rmtree(
+                os.path.join(directory, filename), ignore_errors=True)
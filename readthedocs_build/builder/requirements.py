@@ -0,0 +1,175 @@
+"""
+Just enough of pip's requirements file format to tell which requirements
+are installed from the package index by name, and which come from local
+paths, URLs or version control.
+"""
+
+import io
+import os
+import re
+import shlex
+
+
+__all__ = (
+    'get_requirements_files', 'has_only_named_requirements',
+    'is_named_requirement', 'iter_requirements')
+
+
+EDITABLE_OPTIONS = ('-e', '--editable')
+REQUIREMENTS_OPTIONS = ('-r', '--requirement')
+CONSTRAINTS_OPTIONS = ('-c', '--constraint')
+
+# Options that change where pip finds packages.
+INDEX_OPTIONS = (
+    '-i', '--index-url', '--extra-index-url', '-f', '--find-links',
+    '--no-index')
+
+# Options that are followed by a value.
+VALUE_OPTIONS = (
+    EDITABLE_OPTIONS + REQUIREMENTS_OPTIONS + CONSTRAINTS_OPTIONS +
+    ('-i', '--index-url', '--extra-index-url', '-f', '--find-links'))
+
+# A project name with extras and version specifiers, like
+# ``requests[socks]>=2.0,<3; python_version < "3"``. URLs and paths don't
+# match because of their ``/``, ``:`` or ``@``.
+NAMED_REQUIREMENT_RE = re.compile(
+    r'^[A-Za-z0-9]([A-Za-z0-9._-]*[A-Za-z0-9])?'
+    r'(\s*\[[A-Za-z0-9._,\s-]*\])?'
+    r'(\s*(===|==|!=|<=|>=|~=|<|>)\s*[A-Za-z0-9.*+!]+'
+    r'(\s*,\s*(===|==|!=|<=|>=|~=|<|>)\s*[A-Za-z0-9.*+!]+)*)?'
+    r'\s*(;[^@]*)?$')
+
+# Per-requirement options like ``--hash`` start after whitespace.
+LINE_OPTIONS_RE = re.compile(r'\s+--?[A-Za-z]')
+
+
+def is_named_requirement(requirement):
+    """
+    Whether ``requirement`` is installed from the package index by its name.
+    """
+    return bool(NAMED_REQUIREMENT_RE.match(requirement.strip()))
+
+
+def split_option(arg):
+    """
+    Return the option and the value glued to it of ``arg``, like
+    ``('-r', 'docs.txt')`` for ``-rdocs.txt`` or ``--requirement=docs.txt``.
+    The value is ``None`` if it is not glued to the option.
+    """
+    if arg.startswith('--'):
+        option, separator, value = arg.partition('=')
+        return option, value if separator else None
+    if len(arg) > 2:
+        return arg[:2], arg[2:]
+    return arg, None
+
+
+def read_lines(path):
+    """
+    Return the lines of the requirements file ``path``, with continued
+    lines joined and without comments and blank lines.
+    """
+    with io.open(path, encoding='utf-8') as f:
+        content = f.read()
+    lines = []
+    for line in content.replace('\\\n', '').splitlines():
+        line = re.sub(r'(^|\s)#.*$', '', line).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def iter_requirements(args, base_dir=None, constraint=False, seen=None):
+    """
+    Iterate over the pip arguments ``args`` and all requirements and
+    constraints files they include. Yields ``(kind, value)`` tuples, kind is
+    one of:
+
+    - ``'requirement'`` or ``'constraint'``, value is the requirement
+    - ``'editable'``, value is the path or URL of the editable project
+    - ``'requirements_file'`` or ``'constraints_file'``, value is the path
+    - ``'index_option'`` or ``'option'``, value is the option
+    - ``'unreadable'``, value is the path of a file that can't be read
+
+    Paths of included files are relative to ``base_dir``, the current
+    directory by default. Files are only read once.
+    """
+    if seen is None:
+        seen = set()
+    args = iter(args)
+    for arg in args:
+        if not arg.startswith('-'):
+            yield ('constraint' if constraint else 'requirement'), arg
+            continue
+        option, value = split_option(arg)
+        if option in VALUE_OPTIONS and value is None:
+            value = next(args, '')
+        if option in EDITABLE_OPTIONS:
+            yield 'editable', value
+        elif option in REQUIREMENTS_OPTIONS + CONSTRAINTS_OPTIONS:
+            is_constraints = constraint or option in CONSTRAINTS_OPTIONS
+            path = os.path.join(base_dir or os.getcwd(), value)
+            yield (
+                'constraints_file' if is_constraints
+                else 'requirements_file'), path
+            for item in iter_requirements_file(path, is_constraints, seen):
+                yield item
+        elif option in INDEX_OPTIONS:
+            yield 'index_option', option
+        else:
+            yield 'option', option
+
+
+def iter_requirements_file(path, constraint=False, seen=None):
+    """
+    Iterate over the requirements file ``path``, like
+    :func:`iter_requirements`.
+    """
+    if seen is None:
+        seen = set()
+    path = os.path.abspath(path)
+    if path in seen:
+        return
+    seen.add(path)
+    try:
+        lines = read_lines(path)
+    except (IOError, OSError, UnicodeDecodeError):
+        yield 'unreadable', path
+        return
+    for line in lines:
+        if line.startswith('-'):
+            args = shlex.split(line)
+        else:
+            # Options after a requirement only apply to it, like --hash.
+            args = [LINE_OPTIONS_RE.split(line, 1)[0]]
+        for item in iter_requirements(
+                args, os.path.dirname(path), constraint, seen):
+            yield item
+
+
+def get_requirements_files(args, base_dir=None):
+    """
+    Return the paths of all requirements and constraints files included by
+    the pip arguments ``args``, also the ones included by other files.
+    """
+    return [
+        value for kind, value in iter_requirements(args, base_dir)
+        if kind in ('requirements_file', 'constraints_file')]
+
+
+def has_only_named_requirements(args):
+    """
+    Whether all requirements in the pip arguments ``args`` and the files
+    they include are installed from a package index by name. What gets
+    installed then only depends on the content of the requirements files,
+    not on the checkout or the local file system.
+    """
+    for kind, value in iter_requirements(args):
+        if kind in ('editable', 'unreadable'):
+            return False
+        if kind == 'index_option' and value in ('-f', '--find-links'):
+            return False
+        if (kind in ('requirement', 'constraint') and
+                not is_named_requirement(value)):
+            return False
+    return True
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Samples the resource usage of a running subprocess and its descendants from
+``/proc``. Only works on Linux, elsewhere no samples are taken.
+
+Every sample is a list of the fields in :data:`FIELDS`: the seconds since
+the subprocess started, the resident set size in kilobytes, the CPU seconds
+used so far, and the bytes read and written so far. The values are summed
+over the process tree.
+"""
+
+import io
+import os
+import threading
+import time
+
+
+__all__ = ('FIELDS', 'Sampler', 'format_timeline', 'sparkline')
+
+
+FIELDS = ('time', 'rss', 'cpu', 'read_bytes', 'write_bytes')
+
+PROC_PATH = '/proc'
+
+SPARKS = u'▁▂▃▄▅▆▇█'
+
+
+def get_clock_ticks():
+    try:
+        return os.sysconf('SC_CLK_TCK')
+    except (AttributeError, ValueError, OSError):
+        return 100
+
+
+def get_page_size():
+    try:
+        return os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 4096
+
+
+CLOCK_TICKS = get_clock_ticks()
+PAGE_SIZE = get_page_size()
+
+
+def read_file(path):
+    try:
+        with io.open(path, encoding='ascii', errors='replace') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def parse_stat(content):
+    """
+    Return the fields after the command name of ``/proc/<pid>/stat``. The
+    command name is in parentheses and may contain spaces.
+    """
+    return content[content.rindex(')') + 2:].split()
+
+
+def read_process(pid):
+    """
+    Return ``(rss, cpu, read_bytes, write_bytes)`` of the process ``pid``,
+    or ``None`` if it is gone. The CPU time includes the children that the
+    process already waited for.
+    """
+    stat = read_file(os.path.join(PROC_PATH, str(pid), 'stat'))
+    if not stat:
+        return None
+    fields = parse_stat(stat)
+    # utime, stime, cutime and cstime are fields 14 to 17 of the file.
+    cpu = sum(int(value) for value in fields[11:15]) / float(CLOCK_TICKS)
+    rss = int(fields[21]) * PAGE_SIZE // 1024
+    read_bytes = write_bytes = 0
+    content = read_file(os.path.join(PROC_PATH, str(pid), 'io')) or ''
+    for line in content.splitlines():
+        name, _, value = line.partition(':')
+        if name == 'read_bytes':
+            read_bytes = int(value)
+        elif name == 'write_bytes':
+            write_bytes = int(value)
+    return rss, cpu, read_bytes, write_bytes
+
+
+def get_children(pid):
+    """
+    Return the ids of the child processes of ``pid``.
+    """
+    task_dir = os.path.join(PROC_PATH, str(pid), 'task')
+    try:
+        tasks = os.listdir(task_dir)
+    except OSError:
+        return []
+    children = []
+    for task in tasks:
+        content = read_file(os.path.join(task_dir, task, 'children'))
+        if content is None:
+            return get_children_from_stat(pid)
+        children.extend(int(child) for child in content.split())
+    return children
+
+
+def get_children_from_stat(pid):
+    """
+    Slower fallback for kernels without ``/proc/<pid>/task/<tid>/children``.
+    """
+    children = []
+    for name in os.listdir(PROC_PATH):
+        if not name.isdigit():
+            continue
+        stat = read_file(os.path.join(PROC_PATH, name, 'stat'))
+        if stat and int(parse_stat(stat)[1]) == pid:
+            children.append(int(name))
+    return children
+
+
+def get_process_tree(pid):
+    pids = [pid]
+    for parent in pids:
+        pids.extend(get_children(parent))
+    return pids
+
+
+class Sampler(threading.Thread):
+    """
+    Thread that samples the process tree of ``pid`` every ``interval``
+    seconds until :meth:`stop` is called. The sample times are relative to
+    ``started``, by default the time the sampler is created.
+    """
+
+    def __init__(self, pid, interval, started=None):
+        super(Sampler, self).__init__()
+        self.daemon = True
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.started = time.time() if started is None else started
+        self.stopped = threading.Event()
+
+    def sample(self):
+        totals = [0, 0, 0, 0]
+        found = False
+        for pid in get_process_tree(self.pid):
+            usage = read_process(pid)
+            if usage is None:
+                continue
+            found = True
+            totals = [total + value for total, value in zip(totals, usage)]
+        if not found:
+            return
+        rss, cpu, read_bytes, write_bytes = totals
+        self.samples.append([
+            round(time.time() - self.started, 3),
+            rss,
+            round(cpu, 2),
+            read_bytes,
+            write_bytes,
+        ])
+
+    def run(self):
+        while True:
+            self.sample()
+            if self.stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        """
+        Stop sampling and return the samples.
+        """
+        self.stopped.set()
+        self.join()
+        return self.samples
+
+
+def sparkline(values, width=40):
+    """
+    Render ``values`` as line of block characters, at most ``width`` wide.
+    Neighbouring values are merged by their maximum.
+    """
+    if not values:
+        return u''
+    if len(values) > width:
+        size = float(len(values)) / width
+        values = [
+            max(values[int(index * size):int((index + 1) * size)] or [0])
+            for index in range(width)]
+    top = max(values)
+    if not top:
+        return SPARKS[0] * len(values)
+    return u''.join(
+        SPARKS[min(len(SPARKS) - 1, int(value * len(SPARKS) / float(top)))]
+        for value in values)
+
+
+def get_stage_rss(series, interval):
+    """
+    Return the RSS of all subprocesses in ``series`` per interval, summed
+    over subprocesses that ran at the same time.
+    """
+    if not series:
+        return []
+    start = min(entry['started'] for entry in series)
+    buckets = {}
+    for entry in series:
+        offset = entry['started'] - start
+        entry_buckets = {}
+        for sample in entry['samples']:
+            bucket = int((offset + sample[0]) / interval)
+            entry_buckets[bucket] = max(
+                entry_buckets.get(bucket, 0), sample[1])
+        for bucket, rss in entry_buckets.items():
+            buckets[bucket] = buckets.get(bucket, 0) + rss
+    if not buckets:
+        return []
+    return [buckets.get(bucket, 0) for bucket in range(max(buckets) + 1)]
+
+
+def format_timeline(timeline, width=40):
+    """
+    Return the lines of a table with the peak RSS and an RSS sparkline per
+    stage of a ``resources.json`` ``timeline``.
+    """
+    row = u'{stage:<20} {peak:>12}  {sparkline}'
+    lines = [row.format(stage='stage', peak='peak_rss_mb', sparkline='rss')]
+    stages = []
+    for entry in timeline['series']:
+        if entry['stage'] not in stages:
+            stages.append(entry['stage'])
+    for stage in stages:
+        rss = get_stage_rss(
+            [entry for entry in timeline['series']
+             if entry['stage'] == stage],
+            timeline['interval'])
+        lines.append(row.format(
+            stage=stage,
+            peak='{:.1f}'.format(max(rss or [0]) / 1024.0),
+            sparkline=sparkline(rss, width=width)))
+    return lines
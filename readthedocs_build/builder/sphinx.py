@@ -1,4 +1,21 @@
+from multiprocessing.pool import ThreadPool
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+
+from ..search.html import write_search_data
+from ..search.shards import shard_searchindex
 from .base import BaseBuilder
+from .host import RunningBuilds
+from .host import get_parallel_jobs
+from .sphinx_runner import SphinxWorker
+from .timing import in_current_stage
+from .utils import run
 
 
 class SphinxBuilder(BaseBuilder):
@@ -7,28 +24,319 @@ class SphinxBuilder(BaseBuilder):
 
     - Build HTML in dirhtml format
     - Build HTML in singlehtml format + local media build
-    - Build PDF
-    - Build ePUB
     """
 
     python_dependencies = BaseBuilder.python_dependencies + (
         'Sphinx>=1.5.2',
     )
 
+    doctree_dir = None
+    doctree_dir_persistent = False
+    installed_packages = None
+    fingerprint_filename = '.rtd-fingerprint'
+    worker = None
+    # The first format populates the shared doctrees. The others only read
+    # them and can safely run at the same time.
+    first_format_alone = True
+    htmlzip_exclude = ('.buildinfo',)
+    latexmk_command = ('latexmk', '-pdf', '-interaction=nonstopmode')
+
+    def __init__(self, *args, **kwargs):
+        super(SphinxBuilder, self).__init__(*args, **kwargs)
+        self.worker_lock = threading.Lock()
+
+    def get_worker(self):
+        """
+        Return the long-lived Sphinx worker. It is started on first use.
+        """
+        with self.worker_lock:
+            if self.worker is None:
+                self.worker = SphinxWorker(self.venv)
+            return self.worker
+
+    def get_doctree_directory(self):
+        """
+        All formats share one doctree directory, so the sources are only read
+        and resolved once. Later formats only run Sphinx's write phase.
+
+        If ``doctree_cache`` is configured, the doctrees are kept between
+        builds so that Sphinx only reads changed sources.
+        """
+        if self.doctree_dir is None:
+            cache_config = self.build_config.get('doctree_cache')
+            if cache_config:
+                self.doctree_dir = self.get_cached_doctree_directory(
+                    cache_config)
+                self.doctree_dir_persistent = True
+            else:
+                self.doctree_dir = tempfile.mkdtemp(prefix='rtd-doctrees-')
+        return self.doctree_dir
+
+    def get_conf_file(self):
+        conf_file = self.build_config.get('conf_file')
+        if conf_file:
+            return os.path.join(self.get_source_directory(), conf_file)
+        return os.path.join(self.get_source_directory(), 'conf.py')
+
+    def get_doctree_fingerprint(self):
+        """
+        The cached doctrees are invalid once ``conf.py``, the Sphinx version
+        or any other installed package changes.
+        """
+        conf_hash = None
+        conf_file = self.get_conf_file()
+        if os.path.exists(conf_file):
+            with open(conf_file, 'rb') as f:
+                conf_hash = hashlib.sha256(f.read()).hexdigest()
+        fingerprint = {
+            'conf_file': conf_hash,
+            'packages': self.get_installed_packages(),
+        }
+        serialized = json.dumps(fingerprint, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(serialized).hexdigest()
+
+    def get_installed_packages(self):
+        """
+        Return the packages installed in the virtualenv, they don't change
+        after the setup.
+        """
+        if self.installed_packages is None:
+            self.installed_packages = self.venv.freeze()
+        return self.installed_packages
+
+    def get_sphinx_version(self):
+        for package in self.get_installed_packages():
+            name, _, version = package.partition('==')
+            if name.lower() == 'sphinx':
+                return version
+        return None
+
+    def get_cache_name(self):
+        """
+        Name of this build config's entries in the persistent caches. Only
+        the inputs of the Sphinx build are part of it, so changing e.g. the
+        output directory or the search options keeps the caches.
+        """
+        inputs = {
+            'conf_file': self.get_conf_file(),
+            'sphinx': self.get_sphinx_version(),
+            'python': str(self.build_config['python'].get('version', '2.7')),
+        }
+        serialized = json.dumps(inputs, sort_keys=True).encode('utf-8')
+        return '{name}-{inputs}'.format(
+            name=self.build_config['name'],
+            inputs=hashlib.sha256(serialized).hexdigest()[:16])
+
+    def get_cached_doctree_directory(self, cache_config):
+        doctree_dir = os.path.join(cache_config['path'], self.get_cache_name())
+        fingerprint = self.get_doctree_fingerprint()
+        fingerprint_path = os.path.join(doctree_dir, self.fingerprint_filename)
+        try:
+            with open(fingerprint_path, 'r') as f:
+                cached_fingerprint = f.read()
+        except IOError:
+            cached_fingerprint = None
+        if cached_fingerprint != fingerprint:
+            shutil.rmtree(doctree_dir, ignore_errors=True)
+            os.makedirs(doctree_dir)
+            with open(fingerprint_path, 'w') as f:
+                f.write(fingerprint)
+        return doctree_dir
+
+    def get_sphinx_jobs(self):
+        """
+        Number of parallel processes Sphinx uses to read and write documents.
+        The CPUs of the host are shared with the other running builds.
+        """
+        sphinx_config = self.build_config.get('sphinx', {})
+        jobs = sphinx_config.get('jobs', 1)
+        if jobs == 1:
+            return 1
+        return get_parallel_jobs(
+            jobs,
+            max_jobs=sphinx_config.get('max_jobs'),
+            running_builds=RunningBuilds().count(),
+            concurrency=self.build_config.get('format_concurrency', 1))
+
     def _run_sphinx_build(self, format, out_dir):
         source_dir = self.get_source_directory()
-        self.venv.python_run(
-            'sphinx-build', [
-                '-b',
+        jobs = self.get_sphinx_jobs()
+        if self.build_config.get('sphinx_worker'):
+            return self.get_worker().build(
                 format,
                 source_dir,
                 out_dir,
-            ])
+                self.get_doctree_directory(),
+                jobs=jobs)
+        args = [
+            '-b',
+            format,
+            '-d',
+            self.get_doctree_directory(),
+        ]
+        if jobs > 1:
+            args += ['-j', str(jobs)]
+        return self.venv.python_run(
+            'sphinx-build', args + [source_dir, out_dir])
+
+    def get_format_builds(self):
+        """
+        The extra ``formats`` are written from the doctrees of the HTML build.
+        ``htmlzip`` and the search data are made from the HTML output and must
+        run after ``build_html``, which is always built first.
+        """
+        format_builds = super(SphinxBuilder, self).get_format_builds()
+        extra_builds = {
+            'htmlzip': self.build_htmlzip,
+            'pdf': self.build_pdf,
+            'epub': self.build_epub,
+        }
+        for format in self.build_config.get('formats') or ():
+            format_builds.append(extra_builds[format])
+        return format_builds
+
+    def get_archive_name(self, extension):
+        return '{name}.{extension}'.format(
+            name=self.build_config['name'].replace(os.sep, '-'),
+            extension=extension)
 
     def build_html(self):
         out_dir = self.get_output_directory('html')
-        self._run_sphinx_build('html', out_dir)
+        exit_code = self._run_sphinx_build('html', out_dir)
+        assert exit_code == 0, 'html build failed'
+        if self.build_config.get('search_shards') and os.path.exists(
+                os.path.join(out_dir, 'searchindex.js')):
+            shard_searchindex(out_dir)
+
+    def build_htmlzip(self):
+        """
+        Write the HTML output into a zip archive file by file, without
+        copying it to a staging directory first.
+        """
+        html_dir = self.get_output_directory('html')
+        zip_path = os.path.join(
+            self.get_output_directory('htmlzip'),
+            self.get_archive_name('zip'))
+        prefix = os.path.splitext(os.path.basename(zip_path))[0]
+        tmp_path = zip_path + '.tmp'
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for root, dirs, files in os.walk(html_dir):
+                dirs.sort()
+                for filename in sorted(files):
+                    if filename in self.htmlzip_exclude:
+                        continue
+                    path = os.path.join(root, filename)
+                    archive.write(path, os.path.join(
+                        prefix, os.path.relpath(path, html_dir)))
+        os.rename(tmp_path, zip_path)
+
+    def get_latex_directory(self):
+        """
+        Return the LaTeX build directory and whether it is kept after the
+        build. With ``latex_cache`` the auxiliary files of the last build are
+        still there, so latexmk only runs the passes that are needed.
+        """
+        cache_config = self.build_config.get('latex_cache')
+        if not cache_config:
+            return tempfile.mkdtemp(prefix='rtd-latex-'), False
+        latex_dir = os.path.join(cache_config['path'], self.get_cache_name())
+        if not os.path.exists(latex_dir):
+            os.makedirs(latex_dir)
+        # Sphinx writes the .tex files of all current latex_documents again,
+        # leftovers of removed documents must not be built.
+        for tex_file in glob.glob(os.path.join(latex_dir, '*.tex')):
+            os.remove(tex_file)
+        return latex_dir, True
+
+    def get_latex_environment(self):
+        env = dict(os.environ)
+        cache_config = self.build_config.get('latex_cache')
+        if cache_config:
+            # Fonts generated by mktexpk and friends end up in TEXMFVAR.
+            env['TEXMFVAR'] = os.path.join(cache_config['path'], 'texmf-var')
+        return env
+
+    def run_latexmk(self, latex_dir, tex_file, env):
+        return run(
+            list(self.latexmk_command) + [os.path.basename(tex_file)],
+            cwd=latex_dir,
+            env=env)
+
+    def build_pdf(self):
+        """
+        Independent LaTeX documents are compiled at the same time, sharing the
+        CPUs with the other running builds.
+        """
+        latex_dir, persistent = self.get_latex_directory()
+        try:
+            exit_code = self._run_sphinx_build('latex', latex_dir)
+            assert exit_code == 0, 'latex build failed'
+            tex_files = sorted(glob.glob(os.path.join(latex_dir, '*.tex')))
+            env = self.get_latex_environment()
+            processes = get_parallel_jobs(
+                len(tex_files),
+                running_builds=RunningBuilds().count(),
+                concurrency=self.build_config.get('format_concurrency', 1))
+            pool = ThreadPool(processes=processes)
+            try:
+                exit_codes = pool.map(
+                    in_current_stage(lambda tex_file: self.run_latexmk(
+                        latex_dir, tex_file, env)),
+                    tex_files)
+            finally:
+                pool.close()
+                pool.join()
+            out_dir = self.get_output_directory('pdf')
+            for tex_file, exit_code in zip(tex_files, exit_codes):
+                pdf_file = os.path.splitext(tex_file)[0] + '.pdf'
+                assert exit_code == 0 and os.path.exists(pdf_file), (
+                    'latexmk failed for {}'.format(
+                        os.path.basename(tex_file)))
+                # latexmk compares against the PDF in the next build.
+                shutil.copy(pdf_file, out_dir)
+        finally:
+            if not persistent:
+                shutil.rmtree(latex_dir, ignore_errors=True)
+
+    def build_epub(self):
+        epub_dir = tempfile.mkdtemp(prefix='rtd-epub-')
+        try:
+            exit_code = self._run_sphinx_build('epub', epub_dir)
+            assert exit_code == 0, 'epub build failed'
+            epub_files = glob.glob(os.path.join(epub_dir, '*.epub'))
+            assert epub_files, 'epub build wrote no .epub file'
+            out_dir = self.get_output_directory('epub')
+            for epub_file in epub_files:
+                # Replaces the file of the previous build.
+                shutil.move(epub_file, os.path.join(
+                    out_dir, os.path.basename(epub_file)))
+        finally:
+            shutil.rmtree(epub_dir, ignore_errors=True)
 
     def build_search_data(self):
-        out_dir = self.get_output_directory('search_data')
-        self._run_sphinx_build('json', out_dir)
+        """
+        The search records are parsed from the HTML output instead of running
+        Sphinx's JSON builder.
+        """
+        previous_manifest = self.load_search_manifest()
+        # Records of removed pages must not be left behind.
+        shutil.rmtree(
+            self.get_output_directory('search_data'), ignore_errors=True)
+        processes = get_parallel_jobs(
+            'auto',
+            running_builds=RunningBuilds().count(),
+            concurrency=self.build_config.get('format_concurrency', 1))
+        write_search_data(
+            self.get_output_directory('html'),
+            self.get_output_directory('search_data'),
+            processes=processes)
+        self.write_search_manifest(previous_manifest)
+
+    def cleanup(self):
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
+        super(SphinxBuilder, self).cleanup()
+        if self.doctree_dir is not None and not self.doctree_dir_persistent:
+            shutil.rmtree(self.doctree_dir, ignore_errors=True)
+        self.doctree_dir = None
@@ -0,0 +1,129 @@
+import json
+import os
+import pkgutil
+import subprocess
+import threading
+import time
+import uuid
+
+from .logs import RingBuffer
+from .timing import get_build_log
+from .timing import record_samples
+from .timing import record_subprocess
+from .utils import MAX_RSS_UNIT
+from .utils import report_failure
+from .utils import start_sampler
+
+
+class SphinxWorkerError(Exception):
+    pass
+
+
+class SphinxWorker(object):
+    """
+    Runs Sphinx builds in one long-lived python process inside the
+    virtualenv. Sphinx, docutils and the configured extensions are imported
+    only once for all formats.
+
+    Builds are sent one after another over the worker's stdin and stdout.
+    Every build is recorded in the current timing stage like a
+    ``sphinx-build`` subprocess run by
+    :func:`~readthedocs_build.builder.utils.run`. If the current timing
+    report has a log, the output of every build is captured in it.
+    """
+
+    label = 'sphinx-build'
+
+    def __init__(self, venv):
+        python_bin = os.path.join(venv.base_path, 'bin', 'python')
+        # Pass the source, the package might be installed as a zipped egg.
+        script = pkgutil.get_data(__name__.rsplit('.', 1)[0],
+                                  'sphinx_worker.py')
+        self.lock = threading.Lock()
+        self.log = get_build_log()
+        self.process = subprocess.Popen(
+            [python_bin, '-c', script.decode('utf-8')],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE if self.log is not None else None)
+
+    def capture(self, marker=None):
+        """
+        Write the output of the worker to the log until it writes ``marker``
+        or exits. Returns the last bytes of the output.
+        """
+        tail = RingBuffer(self.log.tail_size)
+        if marker is not None:
+            marker = marker.encode('utf-8')
+        for line in iter(self.process.stderr.readline, b''):
+            if marker is not None and line.rstrip(b'\n') == marker:
+                break
+            tail.write(line)
+            self.log.write_line(self.label, 'stderr', line.rstrip(b'\n'))
+        return tail.getvalue()
+
+    def build(self, builder, source_dir, out_dir, doctree_dir, conf_dir=None,
+              jobs=1):
+        """
+        Run the Sphinx ``builder`` and return its exit code.
+        """
+        request = {
+            'builder': builder,
+            'srcdir': source_dir,
+            'confdir': conf_dir or source_dir,
+            'outdir': out_dir,
+            'doctreedir': doctree_dir,
+            'jobs': jobs,
+        }
+        if self.log is not None:
+            request['marker'] = 'rtd-sphinx-worker-{}'.format(
+                uuid.uuid4().hex)
+        args = [self.label, '-b', builder, '-d', doctree_dir]
+        if jobs > 1:
+            args += ['-j', str(jobs)]
+        args += [source_dir, out_dir]
+        with self.lock:
+            started = time.time()
+            sampler = start_sampler(self.process, started)
+            output_tail = None
+            try:
+                try:
+                    self.process.stdin.write(
+                        (json.dumps(request) + '\n').encode('utf-8'))
+                    self.process.stdin.flush()
+                except (IOError, OSError):
+                    raise SphinxWorkerError('Sphinx worker is not running')
+                if self.log is not None:
+                    output_tail = self.capture(request['marker'])
+                line = self.process.stdout.readline()
+            finally:
+                if sampler is not None:
+                    record_samples(self.label, started, sampler.stop())
+        if not line:
+            raise SphinxWorkerError(
+                'Sphinx worker exited with {}'.format(self.process.wait()))
+        response = json.loads(line.decode('utf-8'))
+        exit_code = response['status']
+        rusage = response.get('rusage')
+        if rusage is not None:
+            rusage['max_rss'] //= MAX_RSS_UNIT
+        if exit_code != 0 and output_tail is not None:
+            output_tail = output_tail.decode('utf-8', 'replace')
+            report_failure(self.label, exit_code, output_tail)
+        else:
+            output_tail = None
+        record_subprocess(
+            args, self.label, started, time.time(), exit_code, rusage=rusage,
+            output_tail=output_tail)
+        return exit_code
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        if self.process.stderr is not None:
+            # Output after the last build, e.g. of a crash on exit.
+            self.capture()
+            self.process.stderr.close()
+        return self.process.wait()
@@ -0,0 +1,139 @@
+"""
+Long-lived Sphinx worker that runs inside the build virtualenv.
+
+This script is executed with the virtualenv's python and must not import
+anything from ``readthedocs_build``. It reads one JSON request per line from
+stdin::
+
+    {"builder": "html", "srcdir": "...", "confdir": "...", "outdir": "...",
+     "doctreedir": "...", "jobs": 1, "marker": "..."}
+
+and answers each one with a JSON line ``{"status": <exit code>, "rusage":
+{...}}``. The resource usage is the one of the build, in the fields of
+:func:`readthedocs_build.builder.utils.get_rusage`, but with ``max_rss`` in
+the unit of ``ru_maxrss``. Sphinx itself writes to stderr, stdout is
+reserved for the answers. If the request has a ``marker``, it is written to
+stderr as a line of its own after the build.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import traceback
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+RUSAGE_FIELDS = (
+    ('user_time', 'ru_utime'),
+    ('system_time', 'ru_stime'),
+    ('block_input', 'ru_inblock'),
+    ('block_output', 'ru_oublock'),
+    ('voluntary_context_switches', 'ru_nvcsw'),
+    ('involuntary_context_switches', 'ru_nivcsw'),
+)
+
+
+def get_usages():
+    if resource is None:
+        return None
+    return (resource.getrusage(resource.RUSAGE_SELF),
+            resource.getrusage(resource.RUSAGE_CHILDREN))
+
+
+def get_rusage(before, after):
+    """
+    Return the resource usage between ``before`` and ``after``, including
+    the processes Sphinx forks for parallel builds.
+    """
+    if before is None:
+        return None
+    rusage = {}
+    for field, attribute in RUSAGE_FIELDS:
+        rusage[field] = sum(
+            getattr(usage, attribute) for usage in after) - sum(
+            getattr(usage, attribute) for usage in before)
+    rusage['max_rss'] = max(usage.ru_maxrss for usage in after)
+    return rusage
+
+
+@contextlib.contextmanager
+def nothing():
+    yield
+
+
+def get_patch_docutils(confdir):
+    try:
+        from sphinx.util.docutils import patch_docutils
+    except ImportError:
+        return nothing()
+    try:
+        return patch_docutils(confdir)
+    except TypeError:
+        # Sphinx before 3.0 takes no arguments.
+        return patch_docutils()
+
+
+def get_docutils_namespace():
+    try:
+        from sphinx.util.docutils import docutils_namespace
+    except ImportError:
+        return nothing()
+    return docutils_namespace()
+
+
+def build(request):
+    from sphinx.application import Sphinx
+
+    # Like sphinx-build, so that the roles, directives and nodes registered
+    # by one build do not leak into the next one.
+    with get_patch_docutils(request['confdir']):
+        with get_docutils_namespace():
+            app = Sphinx(
+                request['srcdir'],
+                request['confdir'],
+                request['outdir'],
+                request['doctreedir'],
+                request['builder'],
+                status=sys.stdout,
+                warning=sys.stderr,
+                freshenv=False,
+                parallel=request.get('jobs', 1))
+            app.build()
+            return app.statuscode
+
+
+def main():
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    # Importing Sphinx is the expensive part, do it only once.
+    import sphinx.application  # noqa
+
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        request = json.loads(line)
+        before = get_usages()
+        try:
+            status = build(request)
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc()
+            status = 1
+        rusage = get_rusage(before, get_usages())
+        sys.stdout.flush()
+        if request.get('marker'):
+            sys.stderr.write(request['marker'] + '\n')
+        sys.stderr.flush()
+        responses.write(json.dumps({'status': status, 'rusage': rusage}) +
+                        '\n')
+        responses.flush()
+
+
+if __name__ == '__main__':
+    main()
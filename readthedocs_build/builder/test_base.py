@@ -1,6 +1,13 @@
+from mock import Mock
 from mock import patch
+from pytest import raises
+import gzip
+import json
+import sys
+import threading
 
 from .base import BaseBuilder
+from .utils import run
 
 
 def get_config(extra=None):
@@ -12,15 +19,14 @@ def get_config(extra=None):
             'setup_py_install': False,
             'setup_py_path': '',
         },
-        'output_base': '/tmp',
     }
     if extra is not None:
         defaults.update(extra)
     return defaults
 
 
-def test_build_calls_setup():
-    build_config = get_config()
+def test_build_calls_setup(tmpdir):
+    build_config = get_config({'output_base': str(tmpdir)})
     with patch.object(BaseBuilder, 'setup') as setup:
          with patch.object(BaseBuilder, 'cleanup'):
             builder = BaseBuilder(build_config=build_config)
@@ -28,8 +34,8 @@ def test_build_calls_setup():
             setup.assert_called_with()
 
 
-def test_build_calls_cleanup():
-    build_config = get_config()
+def test_build_calls_cleanup(tmpdir):
+    build_config = get_config({'output_base': str(tmpdir)})
     with patch('readthedocs_build.builder.base.VirtualEnv'):
         with patch.object(BaseBuilder, 'cleanup') as cleanup:
             builder = BaseBuilder(build_config=build_config)
@@ -39,8 +45,8 @@ def test_build_calls_cleanup():
         builder.cleanup()
 
 
-def test_build_calls_build_html():
-    build_config = get_config()
+def test_build_calls_build_html(tmpdir):
+    build_config = get_config({'output_base': str(tmpdir)})
     with patch('readthedocs_build.builder.base.VirtualEnv'):
         with patch.object(BaseBuilder, 'build_html') as build_html:
             builder = BaseBuilder(build_config=build_config)
@@ -48,8 +54,8 @@ def test_build_calls_build_html():
             build_html.assert_called_with()
 
 
-def test_build_calls_build_search_data():
-    build_config = get_config()
+def test_build_calls_build_search_data(tmpdir):
+    build_config = get_config({'output_base': str(tmpdir)})
     mock_venv = patch('readthedocs_build.builder.base.VirtualEnv')
     mock_build_html = patch.object(BaseBuilder, 'build_html')
     mock_build_search_data = patch.object(BaseBuilder, 'build_search_data')
@@ -111,3 +117,473 @@ def test_cleanup_removes_virtualenv(tmpdir):
         builder.setup()
         builder.cleanup()
         builder.venv.cleanup.assert_called_with()
+
+
+def describe_setup_virtualenv_with_cache():
+    def it_populates_cache_on_miss(tmpdir):
+        build_config = get_config({
+            'venv_cache': {'path': str(tmpdir.join('cache'))},
+        })
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            builder = BaseBuilder(build_config=build_config)
+            builder.python_dependencies = ('Sphinx',)
+            builder.setup_virtualenv()
+            assert len(tmpdir.join('cache').listdir()) == 1
+            entry = tmpdir.join('cache').listdir()[0]
+            VirtualEnv.assert_any_call(
+                build_config['python'],
+                base_path=str(entry),
+                persistent=True)
+            VirtualEnv.return_value.install.assert_called_with('Sphinx')
+
+    def it_reuses_cached_virtualenv_on_hit(tmpdir):
+        build_config = get_config({
+            'venv_cache': {'path': str(tmpdir.join('cache'))},
+        })
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            builder = BaseBuilder(build_config=build_config)
+            builder.python_dependencies = ('Sphinx',)
+            builder.setup_virtualenv()
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            builder = BaseBuilder(build_config=build_config)
+            builder.python_dependencies = ('Sphinx',)
+            builder.setup_virtualenv()
+            assert VirtualEnv.call_count == 1
+            assert not VirtualEnv.return_value.install.called
+
+    def it_bypasses_cache_for_local_requirements(tmpdir):
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('Sphinx\n-e .\n')
+        build_config = get_config({
+            'venv_cache': {'path': str(tmpdir.join('cache'))},
+            'requirements_file': str(requirements),
+        })
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            builder = BaseBuilder(build_config=build_config)
+            builder.setup_virtualenv()
+            assert not tmpdir.join('cache').exists()
+            VirtualEnv.assert_called_once_with(build_config['python'])
+            VirtualEnv.return_value.install.assert_called_with(
+                '-r{}'.format(requirements))
+
+    def it_leases_cache_entry_until_cleanup(tmpdir):
+        build_config = get_config({
+            'venv_cache': {'path': str(tmpdir.join('cache')),
+                           'max_entries': 1},
+        })
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            first = BaseBuilder(build_config=build_config)
+            first.setup_virtualenv()
+            second = BaseBuilder(build_config=build_config)
+            second.python_dependencies = ('Sphinx',)
+            second.setup_virtualenv()
+            # The entry of the running first build is not evicted.
+            assert len(tmpdir.join('cache').listdir()) == 2
+            first.cleanup()
+            second.setup_virtualenv()
+            assert len(tmpdir.join('cache').listdir()) == 1
+            second.cleanup()
+
+    def it_installs_requirements_file(tmpdir):
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('foo')
+        build_config = get_config({
+            'requirements_file': str(requirements),
+        })
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            builder = BaseBuilder(build_config=build_config)
+            builder.setup_virtualenv()
+            VirtualEnv.return_value.install.assert_called_with(
+                '-r{}'.format(requirements))
+
+
+def describe_setup_virtualenv_with_pool():
+    def it_skips_dependencies_provided_by_pool(tmpdir):
+        build_config = get_config({
+            'venv_pool': {'path': str(tmpdir), 'versions': [2.7]},
+        })
+        get_pool = patch('readthedocs_build.builder.base.get_pool')
+        venv_patch = patch('readthedocs_build.builder.base.VirtualEnv')
+        with get_pool as get_pool:
+            with venv_patch as VirtualEnv:
+                venv = VirtualEnv.return_value
+                venv.provided_dependencies = ('Sphinx',)
+                builder = BaseBuilder(build_config=build_config)
+                builder.python_dependencies = ('Sphinx', 'foo')
+                builder.setup_virtualenv()
+                get_pool.assert_called_with(
+                    build_config['venv_pool'], ('Sphinx', 'foo'),
+                    wheelhouse=None, trash=None)
+                VirtualEnv.assert_called_with(
+                    build_config['python'], pool=get_pool.return_value)
+                venv.install.assert_called_once_with('foo')
+        assert builder.timings.as_dict()['venv_pool'] == 'hit'
+
+    def it_reports_pool_misses(tmpdir):
+        build_config = get_config({
+            'venv_pool': {'path': str(tmpdir), 'versions': [2.7]},
+        })
+        with patch('readthedocs_build.builder.base.get_pool'):
+            with patch('readthedocs_build.builder.base.VirtualEnv') as venv:
+                venv.return_value.pool = None
+                builder = BaseBuilder(build_config=build_config)
+                builder.create_virtualenv()
+        assert builder.timings.as_dict()['venv_pool'] == 'miss'
+
+
+def describe_refill_virtualenv_pool():
+    def it_fills_the_pool_in_background(tmpdir):
+        build_config = get_config({
+            'venv_pool': {'path': str(tmpdir), 'versions': [2.7]},
+        })
+        fill = patch('readthedocs_build.builder.base.fill_in_background')
+        with fill as fill_in_background:
+            BaseBuilder(build_config=build_config).refill_virtualenv_pool()
+            fill_in_background.assert_called_with(
+                build_config['venv_pool'], 'sphinx', wheelhouse_config=None)
+
+    def it_does_nothing_if_the_pool_is_not_used(tmpdir):
+        build_config = get_config({
+            'venv_pool': {'path': str(tmpdir), 'versions': [2.7]},
+            'venv_cache': {'path': str(tmpdir)},
+        })
+        fill = patch('readthedocs_build.builder.base.fill_in_background')
+        with fill as fill_in_background:
+            BaseBuilder(build_config=build_config).refill_virtualenv_pool()
+            assert not fill_in_background.called
+
+
+def describe_setup_virtualenv_with_batch_install():
+    def it_installs_everything_at_once(tmpdir):
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('foo')
+        build_config = get_config({
+            'batch_install': True,
+            'requirements_file': str(requirements),
+        })
+        build_config['python'].update({
+            'pip_install': True,
+            'extra_requirements': ['docs'],
+            'setup_py_path': str(tmpdir.join('setup.py')),
+        })
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            venv = VirtualEnv.return_value
+            builder = BaseBuilder(build_config=build_config)
+            builder.python_dependencies = ('Sphinx',)
+            builder.setup_virtualenv()
+            venv.install_all.assert_called_once_with(
+                packages=['Sphinx'],
+                requirements_files=[str(requirements)],
+                project_path=str(tmpdir),
+                extras=['docs'])
+            assert not venv.install.called
+            assert not venv.python_run.called
+
+    def it_installs_setup_py_project_with_pip(tmpdir):
+        build_config = get_config({'batch_install': True})
+        build_config['python'].update({
+            'setup_py_install': True,
+            'setup_py_path': str(tmpdir.join('setup.py')),
+        })
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            venv = VirtualEnv.return_value
+            builder = BaseBuilder(build_config=build_config)
+            builder.setup_virtualenv()
+            venv.install_all.assert_called_once_with(
+                packages=[],
+                requirements_files=[],
+                project_path=str(tmpdir),
+                extras=[])
+
+    def it_installs_project_on_cache_hit(tmpdir):
+        build_config = get_config({
+            'batch_install': True,
+            'venv_cache': {'path': str(tmpdir.join('cache'))},
+        })
+        build_config['python'].update({
+            'pip_install': True,
+            'setup_py_path': str(tmpdir.join('setup.py')),
+        })
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            venv = VirtualEnv.return_value
+            builder = BaseBuilder(build_config=build_config)
+            builder.python_dependencies = ('Sphinx',)
+            builder.setup_virtualenv()
+            venv.install_all.assert_any_call(
+                packages=['Sphinx'],
+                requirements_files=[],
+                project_path=None,
+                extras=())
+            venv.install_all.assert_called_with(
+                project_path=str(tmpdir),
+                extras=[])
+            # The project goes into a per-build virtualenv on top of the
+            # cache entry.
+            VirtualEnv.assert_called_with(
+                build_config['python'], base_layer=venv)
+
+
+def test_setup_virtualenv_uses_wheelhouse(tmpdir):
+    build_config = get_config({
+        'wheelhouse': {'path': str(tmpdir), 'offline': True},
+    })
+    with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+        builder = BaseBuilder(build_config=build_config)
+        builder.setup_virtualenv()
+        args, kwargs = VirtualEnv.call_args
+        assert kwargs['wheelhouse'].path == str(tmpdir)
+        assert kwargs['wheelhouse'].offline
+
+
+def describe_setup_virtualenv_with_layers():
+    def it_creates_read_only_base_layer_once(tmpdir):
+        build_config = get_config({
+            'venv_layers': {'path': str(tmpdir)},
+        })
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            venv = VirtualEnv.return_value
+            builder = BaseBuilder(build_config=build_config)
+            builder.python_dependencies = ('Sphinx',)
+            builder.setup_virtualenv()
+            venv.install.assert_called_with('Sphinx')
+            venv.compile.assert_called_with()
+            venv.make_read_only.assert_called_with()
+            args, kwargs = VirtualEnv.call_args
+            assert kwargs['base_layer'].provided_dependencies == ('Sphinx',)
+
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            builder = BaseBuilder(build_config=build_config)
+            builder.python_dependencies = ('Sphinx',)
+            builder.setup_virtualenv()
+            assert not VirtualEnv.return_value.make_read_only.called
+            # One for the base layer, one for the overlay.
+            assert VirtualEnv.call_count == 2
+
+
+def test_setup_virtualenv_uses_trash(tmpdir):
+    build_config = get_config({
+        'trash': {'path': str(tmpdir)},
+    })
+    with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+        builder = BaseBuilder(build_config=build_config)
+        builder.setup_virtualenv()
+        args, kwargs = VirtualEnv.call_args
+        assert kwargs['trash'].path == str(tmpdir)
+
+
+def describe_shared_virtualenv():
+    def it_does_not_setup_or_cleanup_shared_virtualenv(tmpdir):
+        build_config = get_config({'output_base': str(tmpdir)})
+        venv = Mock()
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            builder = BaseBuilder(build_config=build_config, venv=venv)
+            builder.build()
+            assert not VirtualEnv.called
+            assert builder.venv is venv
+            assert not venv.cleanup.called
+
+
+def describe_build_formats():
+    def it_builds_formats_one_after_another_by_default():
+        builder = BaseBuilder(build_config=get_config())
+        calls = []
+        builder.get_format_builds = lambda: [
+            lambda: calls.append('html'),
+            lambda: calls.append('search_data'),
+        ]
+        builder.build_formats()
+        assert calls == ['html', 'search_data']
+
+    def it_builds_formats_concurrently():
+        builder = BaseBuilder(build_config=get_config({
+            'format_concurrency': 2,
+        }))
+        barrier = threading.Event()
+        started = []
+
+        def format_build():
+            started.append(True)
+            if len(started) == 2:
+                barrier.set()
+            # Only returns if both builds run at the same time.
+            assert barrier.wait(5)
+
+        builder.get_format_builds = lambda: [format_build, format_build]
+        builder.build_formats()
+        assert len(started) == 2
+
+    def it_raises_errors_of_concurrent_builds():
+        builder = BaseBuilder(build_config=get_config({
+            'format_concurrency': 2,
+        }))
+
+        def failing_build():
+            raise ValueError
+
+        builder.get_format_builds = lambda: [failing_build, lambda: None]
+        with raises(ValueError):
+            builder.build_formats()
+
+
+def get_dependencies(stages):
+    return dict((stage.name, stage.dependencies) for stage in stages)
+
+
+def describe_get_stages():
+    def it_names_stages_after_the_config():
+        builder = BaseBuilder(build_config=get_config())
+        stages = builder.get_stages()
+        assert [stage.name for stage in stages] == [
+            'docs:virtualenv',
+            'docs:dependencies',
+            'docs:project',
+            'docs:html',
+            'docs:search_data',
+            'docs:search_index',
+            'docs:export_search_data',
+            'docs:cleanup',
+        ]
+        assert [stage.resource for stage in stages].count('cpu') == 2
+
+    def it_builds_formats_after_the_setup():
+        builder = BaseBuilder(build_config=get_config())
+        dependencies = get_dependencies(builder.get_stages())
+        assert dependencies['docs:project'] == ('docs:dependencies',)
+        assert dependencies['docs:html'] == ('docs:project',)
+        assert dependencies['docs:search_data'] == ('docs:project',)
+        assert dependencies['docs:search_index'] == (
+            'docs:html', 'docs:search_data')
+
+    def it_builds_the_first_format_alone():
+        builder = BaseBuilder(build_config=get_config())
+        builder.first_format_alone = True
+        dependencies = get_dependencies(builder.get_stages())
+        assert dependencies['docs:search_data'] == (
+            'docs:project', 'docs:html')
+
+    def it_always_cleans_up_last():
+        builder = BaseBuilder(build_config=get_config())
+        stages = builder.get_stages(cleanup_after=['other:html'])
+        cleanup = stages[-1]
+        assert cleanup.always
+        assert set(cleanup.dependencies) == set(
+            [stage.name for stage in stages[:-1]] + ['other:html'])
+
+    def it_shares_the_virtualenv_of_the_owner():
+        owner = BaseBuilder(build_config=get_config())
+        builder = BaseBuilder(build_config=get_config({'name': 'de'}))
+        stages = builder.get_stages(owner=owner)
+        assert stages[0].name == 'de:virtualenv'
+        assert stages[0].dependencies == ('docs:project',)
+        assert get_dependencies(stages)['de:html'] == ('de:virtualenv',)
+        owner.venv = Mock()
+        stages[0].run()
+        assert builder.venv is owner.venv
+        assert builder.shared_venv
+
+    def it_skips_the_setup_with_a_shared_virtualenv():
+        builder = BaseBuilder(build_config=get_config(), venv=Mock())
+        stages = builder.get_stages()
+        assert stages[0].name == 'docs:html'
+        assert stages[0].dependencies == ()
+
+
+def describe_timings():
+    def it_writes_a_report_to_the_output_directory(tmpdir):
+        builder = BaseBuilder(build_config=get_config({
+            'output_base': str(tmpdir),
+        }))
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            report = builder.build()
+        assert [stage['name'] for stage in report['stages']] == [
+            'virtualenv',
+            'dependencies',
+            'project',
+            'html',
+            'search_data',
+            'search_index',
+            'export_search_data',
+            'cleanup',
+        ]
+        written = json.loads(tmpdir.join('docs', 'timings.json').read())
+        assert written['stages'][0]['name'] == 'virtualenv'
+
+    def it_writes_a_report_if_the_build_fails(tmpdir):
+        builder = BaseBuilder(build_config=get_config({
+            'output_base': str(tmpdir),
+        }))
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            with patch.object(BaseBuilder, 'build_html', autospec=True,
+                              side_effect=ValueError):
+                with raises(ValueError):
+                    builder.build()
+        report = json.loads(tmpdir.join('docs', 'timings.json').read())
+        assert report['exit_code'] == 1
+        assert [stage['name'] for stage in report['stages'][-2:]] == [
+            'html', 'cleanup']
+        assert report['stages'][-1]['exit_code'] == 0
+
+    def it_cleans_up_if_the_build_fails(tmpdir):
+        builder = BaseBuilder(build_config=get_config({
+            'output_base': str(tmpdir),
+        }))
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            with patch.object(BaseBuilder, 'build_html', autospec=True,
+                              side_effect=ValueError):
+                with raises(ValueError):
+                    builder.build()
+            builder.venv.cleanup.assert_called_with()
+
+    def it_writes_resource_samples(tmpdir):
+        builder = BaseBuilder(build_config=get_config({
+            'output_base': str(tmpdir),
+            'resource_sampler': {'interval': 0.5},
+        }))
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            builder.build()
+        timeline = json.loads(tmpdir.join('docs', 'resources.json').read())
+        assert timeline['interval'] == 0.5
+        assert timeline['series'] == []
+
+    def it_writes_no_resource_samples_by_default(tmpdir):
+        builder = BaseBuilder(build_config=get_config({
+            'output_base': str(tmpdir),
+        }))
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            builder.build()
+        assert not tmpdir.join('docs', 'resources.json').exists()
+
+    def it_captures_the_output_of_subprocesses(tmpdir):
+        builder = BaseBuilder(build_config=get_config({
+            'output_base': str(tmpdir),
+            'log_capture': {'tail_size': 1024},
+        }))
+
+        def build_html():
+            run([sys.executable, '-c', 'print("building")'], label='sphinx')
+
+        builder.build_html = build_html
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            builder.build()
+        with gzip.open(str(tmpdir.join('docs', 'build.log.gz'))) as f:
+            assert f.read().endswith(b'[sphinx:stdout] building\n')
+
+
+def describe_build_search_index():
+    def it_is_disabled_by_default(tmpdir):
+        builder = BaseBuilder(build_config=get_config({
+            'output_base': str(tmpdir),
+        }))
+        builder.build_search_index()
+        assert not tmpdir.join('docs', 'search_index').exists()
+
+    def it_indexes_search_data(tmpdir):
+        builder = BaseBuilder(build_config=get_config({
+            'output_base': str(tmpdir),
+            'search_index': True,
+        }))
+        tmpdir.join('docs', 'search_data', 'index.fjson').write(
+            '{"path": "index", "title": "Index", "body": "Text"}',
+            ensure=True)
+        builder.build_search_index()
+        assert tmpdir.join('docs', 'search_index', 'search.idx').exists()
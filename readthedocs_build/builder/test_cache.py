@@ -0,0 +1,199 @@
+from mock import Mock
+import os
+import time
+
+from .cache import VirtualEnvCache
+
+
+python_config = {
+    'version': 2.7,
+    'use_system_site_packages': False,
+    'setup_py_install': False,
+    'setup_py_path': '/project/setup.py',
+}
+
+
+def create_fake_venv(size=0):
+    def setup(path):
+        os.makedirs(os.path.join(path, 'bin'))
+        with open(os.path.join(path, 'bin', 'python'), 'w') as f:
+            f.write('x' * size)
+    return setup
+
+
+def populate_entries(cache, keys):
+    for i, key in enumerate(keys):
+        cache.populate(key, create_fake_venv(size=100))
+        # Make sure the entries have distinct access times.
+        last_used = time.time() - 100 + i
+        os.utime(cache.get_metadata_path(key), (last_used, last_used))
+
+
+def describe_get_key():
+    def it_is_stable(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        first = cache.get_key(python_config, ('Sphinx',))
+        second = cache.get_key(dict(python_config), ['Sphinx'])
+        assert first == second
+
+    def it_depends_on_python_config(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        key = cache.get_key(python_config, ('Sphinx',))
+        other_version = dict(python_config, version=3)
+        assert key != cache.get_key(other_version, ('Sphinx',))
+        site_packages = dict(python_config, use_system_site_packages=True)
+        assert key != cache.get_key(site_packages, ('Sphinx',))
+
+    def it_depends_on_dependencies(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        key = cache.get_key(python_config, ('Sphinx',))
+        assert key != cache.get_key(python_config, ('Sphinx>=1.6',))
+
+    def it_depends_on_requirements_file_content(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir.mkdir('cache')))
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('foo==1.0')
+        first = cache.get_key(python_config, (), [str(requirements)])
+        requirements.write('foo==1.1')
+        second = cache.get_key(python_config, (), [str(requirements)])
+        assert first != second
+
+    def it_depends_on_included_requirements_files(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir.mkdir('cache')))
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('-r docs/nested.txt')
+        nested = tmpdir.join('docs', 'nested.txt')
+        nested.write('foo==1.0', ensure=True)
+        first = cache.get_key(python_config, (), [str(requirements)])
+        nested.write('foo==1.1')
+        second = cache.get_key(python_config, (), [str(requirements)])
+        assert first != second
+
+    def it_is_shared_by_projects(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        config = dict(python_config, setup_py_install=True)
+        other = dict(config, setup_py_path='/other/setup.py')
+        assert cache.get_key(config, ()) == cache.get_key(other, ())
+
+
+def describe_lookup():
+    def it_misses_on_empty_cache(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        assert cache.lookup('abc') is None
+
+    def it_hits_after_populate(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        path = cache.populate('abc', create_fake_venv())
+        assert path == str(tmpdir.join('abc'))
+        assert cache.lookup('abc') == path
+        assert os.path.exists(os.path.join(path, 'bin', 'python'))
+
+
+def describe_lease():
+    def it_misses_on_empty_cache(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        assert cache.lease('abc') is None
+
+    def it_populates_missing_entry(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        lease = cache.acquire('abc', create_fake_venv())
+        assert lease.path == str(tmpdir.join('abc'))
+        assert os.path.exists(os.path.join(lease.path, 'bin', 'python'))
+        lease.release()
+
+    def it_misses_removed_entry(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        cache.populate('abc', create_fake_venv())
+        lock_file = cache.open_lock('abc')
+        assert cache.remove('abc')
+        assert not cache.is_current('abc', lock_file)
+        lock_file.close()
+        assert cache.lease('abc') is None
+
+
+def describe_populate():
+    def it_leaves_nothing_behind_on_failure(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+
+        def setup(path):
+            create_fake_venv()(path)
+            raise AssertionError('pip failed')
+
+        try:
+            cache.populate('abc', setup)
+        except AssertionError:
+            pass
+        assert tmpdir.listdir() == []
+        assert cache.lookup('abc') is None
+
+    def it_keeps_existing_entry_on_race(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+
+        def setup(path):
+            create_fake_venv()(path)
+            # Another build finishes first.
+            cache.populate('abc', create_fake_venv(size=10))
+
+        path = cache.populate('abc', setup)
+        assert os.path.getsize(os.path.join(path, 'bin', 'python')) == 10
+        assert [p.basename for p in tmpdir.listdir()] == ['abc']
+
+
+def describe_evict():
+    def it_does_nothing_without_limits(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        populate_entries(cache, ['a', 'b', 'c'])
+        cache.evict()
+        assert [key for _, _, key in cache.get_entries()] == ['a', 'b', 'c']
+
+    def it_removes_least_recently_used_entries(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir), max_entries=2)
+        populate_entries(cache, ['a', 'b', 'c'])
+        cache.lookup('a')
+        cache.evict()
+        assert [key for _, _, key in cache.get_entries()] == ['c', 'a']
+        assert not tmpdir.join('b').exists()
+
+    def it_respects_size_budget(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir), max_size=250)
+        populate_entries(cache, ['a', 'b', 'c'])
+        cache.evict()
+        assert [key for _, _, key in cache.get_entries()] == ['b', 'c']
+
+    def it_never_removes_kept_keys(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir), max_entries=1)
+        populate_entries(cache, ['a', 'b', 'c'])
+        cache.evict(keep=['a'])
+        assert [key for _, _, key in cache.get_entries()] == ['a']
+
+    def it_never_removes_leased_entries(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir), max_entries=2)
+        populate_entries(cache, ['a', 'b', 'c'])
+        lease = cache.lease('a')
+        # Leasing marks the entry as recently used, make it the oldest again.
+        os.utime(cache.get_metadata_path('a'), (0, 0))
+        cache.evict()
+        assert [key for _, _, key in cache.get_entries()] == ['a', 'c']
+        lease.release()
+        cache.max_entries = 1
+        cache.evict()
+        assert [key for _, _, key in cache.get_entries()] == ['c']
+
+    def it_moves_removed_entries_into_trash(tmpdir):
+        trash = Mock()
+        cache = VirtualEnvCache(str(tmpdir), max_entries=1, trash=trash)
+        populate_entries(cache, ['a', 'b'])
+        cache.evict()
+        assert [key for _, _, key in cache.get_entries()] == ['b']
+        (path,), kwargs = trash.discard.call_args
+        assert os.path.basename(path).startswith('.tmp-a-')
+
+    def it_removes_stale_tmp_directories(tmpdir):
+        cache = VirtualEnvCache(str(tmpdir))
+        stale = tmpdir.mkdir('.tmp-abc-123')
+        old = time.time() - cache.tmp_max_age - 1
+        os.utime(str(stale), (old, old))
+        fresh = tmpdir.mkdir('.tmp-abc-456')
+        cache.evict()
+        assert not stale.exists()
+        assert fresh.exists()
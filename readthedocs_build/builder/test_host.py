@@ -0,0 +1,40 @@
+from mock import patch
+import os
+
+from .host import RunningBuilds
+from .host import get_parallel_jobs
+
+
+def describe_running_builds():
+    def it_counts_registered_builds(tmpdir):
+        running_builds = RunningBuilds(str(tmpdir))
+        first = running_builds.register()
+        running_builds.register()
+        assert running_builds.count() == 2
+        running_builds.unregister(first)
+        assert running_builds.count() == 1
+
+    def it_ignores_dead_processes(tmpdir):
+        tmpdir.join('999999999-abc').write('')
+        tmpdir.join('{}-abc'.format(os.getpid())).write('')
+        assert RunningBuilds(str(tmpdir)).count() == 1
+        assert not tmpdir.join('999999999-abc').exists()
+
+
+def describe_get_parallel_jobs():
+    def it_uses_all_cpus_for_auto():
+        with patch('readthedocs_build.builder.host.get_cpu_count',
+                   return_value=8):
+            assert get_parallel_jobs('auto') == 8
+
+    def it_respects_max_jobs():
+        with patch('readthedocs_build.builder.host.get_cpu_count',
+                   return_value=8):
+            assert get_parallel_jobs('auto', max_jobs=2) == 2
+
+    def it_shares_cpus_between_builds():
+        with patch('readthedocs_build.builder.host.get_cpu_count',
+                   return_value=8):
+            assert get_parallel_jobs(8, running_builds=4) == 2
+            assert get_parallel_jobs(8, running_builds=2, concurrency=2) == 2
+            assert get_parallel_jobs(8, running_builds=16) == 1
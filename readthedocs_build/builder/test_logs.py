@@ -0,0 +1,124 @@
+from mock import patch
+import gzip
+import re
+import sys
+
+from .logs import BuildLog
+from .logs import RingBuffer
+from .timing import TimingReport
+from .utils import run
+
+
+def read_log(path):
+    with gzip.open(str(path), 'rb') as f:
+        return f.read().decode('utf-8').splitlines()
+
+
+def describe_ring_buffer():
+    def it_keeps_the_last_bytes():
+        buffer = RingBuffer(10)
+        for chunk in (b'abc', b'defgh', b'ijklmn', b'op'):
+            buffer.write(chunk)
+        assert buffer.getvalue() == b'ghijklmnop'
+        assert buffer.length < 10 + 6
+
+    def it_handles_large_chunks():
+        buffer = RingBuffer(4)
+        buffer.write(b'a')
+        buffer.write(b'0123456789')
+        assert buffer.getvalue() == b'6789'
+
+    def it_is_empty_initially():
+        assert RingBuffer(4).getvalue() == b''
+
+
+def describe_build_log():
+    def it_writes_timestamped_lines(tmpdir):
+        log = BuildLog(str(tmpdir.join('docs', 'build.log.gz')))
+        timings = TimingReport('docs', log=log)
+        code = ('import sys; print("first"); '
+                'sys.stderr.write("warning\\n"); sys.stdout.write("last")')
+        with timings.stage('html'):
+            assert run([sys.executable, '-c', code], label='sphinx') == 0
+        log.close()
+        lines = read_log(tmpdir.join('docs', 'build.log.gz'))
+        assert sorted(line.split(' ', 1)[1] for line in lines) == [
+            '[sphinx:stderr] warning',
+            '[sphinx:stdout] first',
+            '[sphinx:stdout] last',
+        ]
+        assert re.match(
+            r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}Z ', lines[0])
+
+    def it_replaces_the_log_of_previous_builds(tmpdir):
+        path = str(tmpdir.join('build.log.gz'))
+        for text in ('one', 'two'):
+            log = BuildLog(path)
+            log.write_line('pip', 'stdout', text.encode('utf-8'))
+            log.close()
+        assert [line.split()[-1] for line in read_log(path)] == ['two']
+
+    def it_appends_after_reopening(tmpdir):
+        path = str(tmpdir.join('build.log.gz'))
+        log = BuildLog(path)
+        for text in ('one', 'two'):
+            log.write_line('pip', 'stdout', text.encode('utf-8'))
+            log.close()
+        assert [line.split()[-1] for line in read_log(path)] == [
+            'one', 'two']
+
+    def it_does_not_deadlock_on_full_pipes(tmpdir):
+        log = BuildLog(str(tmpdir.join('build.log.gz')), tail_size=100)
+        timings = TimingReport('docs', log=log)
+        # Much more than fits into a pipe, on both streams.
+        code = ('import sys\n'
+                'for i in range(20000):\n'
+                '    sys.stderr.write("err %d\\n" % i)\n'
+                '    sys.stdout.write("out %d\\n" % i)\n')
+        with timings.stage('html'):
+            assert run([sys.executable, '-c', code]) == 0
+        log.close()
+        assert len(read_log(tmpdir.join('build.log.gz'))) == 40000
+
+    def it_reports_the_tail_of_failed_processes(tmpdir, capsys):
+        log = BuildLog(str(tmpdir.join('build.log.gz')), tail_size=20)
+        timings = TimingReport('docs', log=log)
+        code = ('import sys\n'
+                'for i in range(1000):\n'
+                '    print(i)\n'
+                'sys.exit(3)\n')
+        with timings.stage('html') as stage:
+            assert run([sys.executable, '-c', code], label='sphinx') == 3
+        record = stage['subprocesses'][0]
+        assert record['output_tail'].endswith('997\n998\n999\n')
+        assert len(record['output_tail']) == 20
+        out, err = capsys.readouterr()
+        assert 'sphinx failed with exit code 3' in err
+        assert '999' in err
+
+    def it_does_not_report_expected_failures(tmpdir, capsys):
+        log = BuildLog(str(tmpdir.join('build.log.gz')))
+        timings = TimingReport('docs', log=log)
+        code = 'import sys; print("miss"); sys.exit(1)'
+        with timings.stage('html') as stage:
+            assert run([sys.executable, '-c', code], report=False) == 1
+        assert stage['subprocesses'][0]['output_tail'] == 'miss\n'
+        out, err = capsys.readouterr()
+        assert err == ''
+
+    def it_keeps_no_tail_of_successful_processes(tmpdir):
+        log = BuildLog(str(tmpdir.join('build.log.gz')))
+        timings = TimingReport('docs', log=log)
+        with timings.stage('html') as stage:
+            run([sys.executable, '-c', 'print(1)'])
+        assert 'output_tail' not in stage['subprocesses'][0]
+
+    def it_works_without_selectors(tmpdir):
+        log = BuildLog(str(tmpdir.join('build.log.gz')))
+        timings = TimingReport('docs', log=log)
+        with patch('readthedocs_build.builder.logs.selectors', None):
+            with timings.stage('html'):
+                run([sys.executable, '-c', 'print(1)'])
+        log.close()
+        assert read_log(tmpdir.join('build.log.gz'))[0].endswith(
+            '[python:stdout] 1')
@@ -0,0 +1,182 @@
+from mock import Mock
+from mock import patch
+import fcntl
+import os
+import subprocess
+import sys
+
+from .pool import VirtualEnvPool
+from .pool import fill_in_background
+from .pool import get_fill_command
+from .pool import remove_orphans
+from .virtualenv import VirtualEnv
+
+
+def fake_virtualenv(python_config, base_path, persistent, wheelhouse=None):
+    os.makedirs(os.path.join(base_path, 'bin'))
+    with open(os.path.join(base_path, 'bin', 'python'), 'w') as f:
+        f.write('')
+    return VirtualEnv(python_config, base_path=base_path, persistent=True)
+
+
+def create_pool(path, **kwargs):
+    kwargs.setdefault('versions', [2.7, 3])
+    kwargs.setdefault('dependencies', ('Sphinx',))
+    with patch('readthedocs_build.builder.pool.VirtualEnv',
+               side_effect=fake_virtualenv):
+        with patch.object(VirtualEnv, 'install'):
+            pool = VirtualEnvPool(str(path), **kwargs)
+            pool.fill()
+    return pool
+
+
+def describe_pool():
+    def it_fills_pool(tmpdir):
+        pool = create_pool(tmpdir, size=2)
+        assert len(tmpdir.join('ready', '2.7').listdir()) == 2
+        assert len(tmpdir.join('ready', '3').listdir()) == 2
+        assert pool.get_stats()['ready'] == {'2.7': 2, '3': 2}
+
+    def it_installs_dependencies(tmpdir):
+        with patch('readthedocs_build.builder.pool.VirtualEnv',
+                   side_effect=fake_virtualenv):
+            with patch.object(VirtualEnv, 'install') as install:
+                pool = VirtualEnvPool(
+                    str(tmpdir), versions=[3], dependencies=('Sphinx',),
+                    size=1)
+                pool.fill()
+                install.assert_called_with('Sphinx')
+
+    def it_leases_ready_virtualenv(tmpdir):
+        pool = create_pool(tmpdir, size=1)
+        path = pool.lease({'version': 3})
+        assert path.startswith(str(tmpdir.join('leased')))
+        assert os.path.exists(os.path.join(path, 'bin', 'python'))
+        assert tmpdir.join('ready', '3').listdir() == []
+        assert pool.get_stats()['hits'] == 1
+
+    def it_counts_misses(tmpdir):
+        pool = create_pool(tmpdir, size=0)
+        assert pool.lease({'version': 3}) is None
+        assert pool.lease({'version': 3.6}) is None
+        assert pool.lease({
+            'version': 2.7,
+            'use_system_site_packages': True,
+        }) is None
+        assert pool.get_stats()['misses'] == 3
+
+    def it_refills_only_when_asked_to(tmpdir):
+        pool = create_pool(tmpdir, size=1)
+        with patch('readthedocs_build.builder.pool.VirtualEnv',
+                   side_effect=fake_virtualenv):
+            with patch.object(VirtualEnv, 'install'):
+                pool.lease({'version': 3})
+                assert tmpdir.join('ready', '3').listdir() == []
+                pool.fill()
+        assert len(tmpdir.join('ready', '3').listdir()) == 1
+
+    def it_refills_virtualenvs_leased_by_other_processes(tmpdir):
+        pool = create_pool(tmpdir, size=1)
+        other = create_pool(tmpdir, size=1)
+        other.lease({'version': 3})
+        with patch('readthedocs_build.builder.pool.VirtualEnv',
+                   side_effect=fake_virtualenv):
+            with patch.object(VirtualEnv, 'install'):
+                pool.fill()
+        assert len(tmpdir.join('ready', '3').listdir()) == 1
+
+    def it_skips_fill_while_another_process_fills(tmpdir):
+        pool = create_pool(tmpdir, size=1)
+        pool.lease({'version': 3})
+        with open(str(tmpdir.join('fill.lock')), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            assert not pool.fill()
+        assert tmpdir.join('ready', '3').listdir() == []
+
+    def it_adopts_ready_virtualenvs(tmpdir):
+        pool = create_pool(tmpdir, size=1)
+        pool = create_pool(tmpdir, size=1)
+        assert len(tmpdir.join('ready', '3').listdir()) == 1
+        assert pool.lease({'version': 3}) is not None
+
+    def it_reuses_released_virtualenv(tmpdir):
+        pool = create_pool(tmpdir, size=1)
+        path = pool.lease({'version': 3})
+        pool.release(path, reuse=True)
+        assert not os.path.exists(path)
+        assert len(tmpdir.join('ready', '3').listdir()) == 1
+        assert pool.lease({'version': 3}) is not None
+
+    def it_discards_released_virtualenv(tmpdir):
+        pool = create_pool(tmpdir, size=1)
+        path = pool.lease({'version': 3})
+        pool.release(path)
+        assert not os.path.exists(path)
+        assert tmpdir.join('ready', '3').listdir() == []
+
+    def it_moves_released_virtualenv_into_trash(tmpdir):
+        trash = Mock()
+        pool = create_pool(tmpdir, size=1, trash=trash)
+        path = pool.lease({'version': 3})
+        pool.release(path)
+        trash.discard.assert_called_once_with(path)
+
+
+def describe_fill_in_background():
+    def it_runs_the_fill_command(tmpdir):
+        pool_config = {'path': str(tmpdir), 'versions': [2.7, 3], 'size': 3}
+        wheelhouse_config = {'path': '/wheels', 'offline': True}
+        assert get_fill_command(pool_config, 'sphinx', wheelhouse_config) == [
+            sys.executable, '-m', 'readthedocs_build.cli', 'pool', 'fill',
+            str(tmpdir), '--type', 'sphinx', '--size', '3',
+            '--version', '2.7', '--version', '3',
+            '--wheelhouse', '/wheels', '--offline',
+        ]
+
+    def it_detaches_the_process(tmpdir):
+        pool_config = {'path': str(tmpdir.join('pool')), 'versions': [3]}
+        popen = patch('readthedocs_build.builder.pool.subprocess.Popen')
+        with popen as popen:
+            fill_in_background(pool_config, 'sphinx')
+        args, kwargs = popen.call_args
+        assert args[0] == get_fill_command(pool_config, 'sphinx')
+        assert kwargs['stderr'] == subprocess.STDOUT
+        assert kwargs['stdout'].name == str(tmpdir.join('pool', 'fill.log'))
+        assert kwargs.get('start_new_session') or kwargs.get('preexec_fn')
+
+
+def test_remove_orphans(tmpdir):
+    orphan = tmpdir.mkdir('999999999-abc')
+    alive = tmpdir.mkdir('{}-abc'.format(os.getpid()))
+    remove_orphans(str(tmpdir))
+    assert not orphan.exists()
+    assert alive.exists()
+
+
+def describe_virtualenv_with_pool():
+    def it_gives_back_unmodified_virtualenv(tmpdir):
+        pool = create_pool(tmpdir, size=1)
+        venv = VirtualEnv({'version': 3}, pool=pool)
+        assert venv.provided_dependencies == ('Sphinx',)
+        venv.cleanup()
+        assert len(tmpdir.join('ready', '3').listdir()) == 1
+
+    def it_discards_modified_virtualenv(tmpdir):
+        pool = create_pool(tmpdir, size=1)
+        venv = VirtualEnv({'version': 3}, pool=pool)
+        with patch('readthedocs_build.builder.virtualenv.run') as run:
+            run.return_value = 0
+            venv.install('foo')
+        venv.cleanup()
+        assert tmpdir.join('ready', '3').listdir() == []
+        assert tmpdir.join('leased').listdir() == []
+
+    def it_creates_fresh_virtualenv_on_miss(tmpdir):
+        pool = create_pool(tmpdir.mkdir('pool'), size=0)
+        with patch('readthedocs_build.builder.virtualenv.run') as run:
+            run.return_value = 0
+            venv = VirtualEnv({'version': 3}, pool=pool)
+            assert run.called
+        assert venv.pool is None
+        assert venv.provided_dependencies == ()
+        venv.cleanup()
@@ -0,0 +1,82 @@
+from .requirements import get_requirements_files
+from .requirements import has_only_named_requirements
+from .requirements import is_named_requirement
+from .requirements import iter_requirements
+
+
+def test_is_named_requirement():
+    for requirement in (
+            'Sphinx', 'sphinx-rtd-theme', 'zope.interface', 'requests[socks]',
+            'Sphinx>=1.5.2', 'six==1.*', 'foo>=1.0, <2', 'foo ~= 1.4.2',
+            'foo; python_version < "3"', 'foo[a,b]==1.0+local'):
+        assert is_named_requirement(requirement), requirement
+    for requirement in (
+            '.', './src', '/project[docs]', 'src/', 'file:///project',
+            'git+https://host/repo#egg=foo', 'https://host/foo-1.0.tar.gz',
+            'foo @ https://host/foo-1.0.tar.gz', 'foo.whl/', 'C:\\project'):
+        assert not is_named_requirement(requirement), requirement
+
+
+def describe_iter_requirements():
+    def it_expands_requirements_files(tmpdir):
+        tmpdir.join('requirements.txt').write(
+            '# comment\n'
+            'Sphinx  # comment\n'
+            '-r docs/nested.txt\n'
+            'six==1.10.0 \\\n'
+            '    --hash=sha256:abc\n')
+        tmpdir.join('docs', 'nested.txt').write(
+            '-e ..\n--requirement=other.txt\n', ensure=True)
+        tmpdir.join('docs', 'other.txt').write(
+            '-r nested.txt\n--index-url https://host/simple\n-c c.txt\n')
+        tmpdir.join('docs', 'c.txt').write('docutils<0.18\n')
+        with tmpdir.as_cwd():
+            items = list(iter_requirements(['-rrequirements.txt', '-U']))
+        assert items == [
+            ('requirements_file', str(tmpdir.join('requirements.txt'))),
+            ('requirement', 'Sphinx'),
+            ('requirements_file', str(tmpdir.join('docs', 'nested.txt'))),
+            ('editable', '..'),
+            ('requirements_file', str(tmpdir.join('docs', 'other.txt'))),
+            ('requirements_file', str(tmpdir.join('docs', 'nested.txt'))),
+            ('index_option', '--index-url'),
+            ('constraints_file', str(tmpdir.join('docs', 'c.txt'))),
+            ('constraint', 'docutils<0.18'),
+            ('requirement', 'six==1.10.0'),
+            ('option', '-U'),
+        ]
+
+    def it_reports_unreadable_files(tmpdir):
+        path = str(tmpdir.join('missing.txt'))
+        assert list(iter_requirements(['-r', path])) == [
+            ('requirements_file', path),
+            ('unreadable', path),
+        ]
+
+
+def test_get_requirements_files(tmpdir):
+    tmpdir.join('requirements.txt').write('-r nested.txt\n')
+    tmpdir.join('nested.txt').write('Sphinx\n')
+    assert get_requirements_files(['-rrequirements.txt'], str(tmpdir)) == [
+        str(tmpdir.join('requirements.txt')),
+        str(tmpdir.join('nested.txt')),
+    ]
+
+
+def describe_has_only_named_requirements():
+    def it_accepts_named_requirements(tmpdir):
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write(
+            '--index-url https://host/simple\nSphinx>=1.5\n-c c.txt\n')
+        tmpdir.join('c.txt').write('six==1.10.0\n')
+        assert has_only_named_requirements([
+            'Sphinx', '-r{}'.format(requirements)])
+
+    def it_rejects_local_editable_and_vcs_requirements(tmpdir):
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('Sphinx\n-r nested.txt\n')
+        for line in ('-e .', '.', 'git+https://host/repo#egg=foo',
+                     '--find-links wheels', '-r missing.txt'):
+            tmpdir.join('nested.txt').write(line + '\n')
+            assert not has_only_named_requirements(
+                ['-r{}'.format(requirements)]), line
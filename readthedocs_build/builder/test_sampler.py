@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+import sys
+
+from .sampler import Sampler
+from .sampler import format_timeline
+from .sampler import get_process_tree
+from .sampler import read_process
+from .sampler import sparkline
+from .timing import TimingReport
+from .utils import run
+
+
+linux = pytest.mark.skipif(
+    not os.path.exists('/proc/self/stat'), reason='requires /proc')
+
+
+ALLOCATE = 'import time; b = bytearray(32 * 1024 * 1024); time.sleep(0.3)'
+
+SPAWN = (
+    'import subprocess, sys; '
+    'subprocess.call([sys.executable, "-c", {!r}])'.format(ALLOCATE))
+
+
+@linux
+def describe_sampler():
+    def it_reads_the_current_process():
+        rss, cpu, read_bytes, write_bytes = read_process(os.getpid())
+        assert rss > 0
+        assert cpu > 0
+
+    def it_ignores_missing_processes():
+        assert read_process(2 ** 22 + 1) is None
+
+    def it_samples_descendants():
+        timings = TimingReport('docs', sample_interval=0.05)
+        with timings.stage('html'):
+            run([sys.executable, '-c', SPAWN])
+        series = timings.get_timeline()['series']
+        assert [entry['label'] for entry in series] == [
+            os.path.basename(sys.executable)]
+        samples = series[0]['samples']
+        assert len(samples) > 2
+        # The grandchild allocates 32 MB.
+        assert max(sample[1] for sample in samples) > 32 * 1024
+        times = [sample[0] for sample in samples]
+        assert times == sorted(times)
+
+    def it_finds_the_process_tree():
+        assert get_process_tree(os.getpid())[0] == os.getpid()
+
+    def it_stops():
+        sampler = Sampler(os.getpid(), 10)
+        sampler.start()
+        samples = sampler.stop()
+        assert len(samples) == 1
+        assert not sampler.is_alive()
+
+
+def test_no_samples_without_interval():
+    timings = TimingReport('docs')
+    with timings.stage('html'):
+        run([sys.executable, '-c', 'pass'])
+    assert timings.get_timeline()['series'] == []
+
+
+def describe_sparkline():
+    def it_scales_to_the_maximum():
+        assert sparkline([0, 4, 8]) == u'▁▅█'
+
+    def it_handles_zeros():
+        assert sparkline([0, 0]) == u'▁▁'
+        assert sparkline([]) == u''
+
+    def it_merges_values_to_fit_the_width():
+        line = sparkline([1] * 10 + [8] + [1] * 9, width=4)
+        assert line == u'▂▂█▂'
+
+
+def test_format_timeline():
+    timeline = {
+        'name': 'docs',
+        'interval': 1,
+        'fields': ['time', 'rss', 'cpu', 'read_bytes', 'write_bytes'],
+        'series': [
+            {'stage': 'html', 'label': 'sphinx-build', 'started': 10,
+             'samples': [[0, 1024, 0, 0, 0], [1, 2048, 0, 0, 0]]},
+            # Runs at the same time as the first one.
+            {'stage': 'html', 'label': 'sphinx-build', 'started': 11,
+             'samples': [[0, 2048, 0, 0, 0]]},
+            {'stage': 'pdf', 'label': 'latexmk', 'started': 20,
+             'samples': []},
+        ],
+    }
+    lines = format_timeline(timeline)
+    assert lines[1].split() == ['html', '4.0', u'▃█']
+    assert lines[2].split() == ['pdf', '0.0']
@@ -1,5 +1,9 @@
+from mock import Mock
 from mock import patch
+from pytest import raises
+import json
 import os
+import zipfile
 
 from .sphinx import SphinxBuilder
 from .test_base import get_config
@@ -22,34 +26,462 @@ def test_build_html_calls_sphinx_build(tmpdir):
         'output_base': str(tmpdir.join('out')),
     })
     builder = SphinxBuilder(build_config=build_config)
-    with patch('readthedocs_build.builder.base.VirtualEnv'):
-        builder.build()
+    with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+        VirtualEnv.return_value.python_run.return_value = 0
+        with patch.object(SphinxBuilder, 'cleanup'):
+            builder.build()
         source_dir = str(tmpdir)
         out_dir = str(tmpdir.join('out', 'docs', 'html'))
         builder.venv.python_run.assert_any_call(
             'sphinx-build', [
                 '-b',
                 'html',
+                '-d',
+                builder.get_doctree_directory(),
                 source_dir,
                 out_dir,
             ])
+        # Do real cleanup.
+        builder.cleanup()
 
 
-def test_build_creates_search_data(tmpdir):
+def test_build_creates_search_data_from_html(tmpdir):
     build_config = get_config({
         'name': 'docs',
         'base': str(tmpdir),
         'output_base': str(tmpdir.join('out')),
     })
     builder = SphinxBuilder(build_config=build_config)
+
+    def write_html(command, args):
+        with open(os.path.join(args[-1], 'index.html'), 'w') as f:
+            f.write('<div class="body"><h1>Welcome</h1><p>Hello</p></div>')
+        return 0
+
     with patch('readthedocs_build.builder.base.VirtualEnv'):
-        builder.build()
-        source_dir = str(tmpdir)
-        out_dir = str(tmpdir.join('out', 'docs', 'search_data'))
-        builder.venv.python_run.assert_any_call(
-            'sphinx-build', [
-                '-b',
-                'json',
-                source_dir,
-                out_dir,
-            ])
+        with patch.object(SphinxBuilder, 'cleanup'):
+            builder.setup()
+            builder.venv.python_run.side_effect = write_html
+            builder.build_formats()
+        assert [
+            args[1][1]
+            for args, kwargs in builder.venv.python_run.call_args_list
+        ] == ['html']
+        # Do real cleanup.
+        builder.cleanup()
+    record = json.loads(
+        tmpdir.join('out', 'docs', 'search_data', 'index.fjson').read())
+    assert record['title'] == 'Welcome'
+    assert record['body'] == 'Welcome Hello'
+
+
+def describe_search_manifest():
+    def it_reports_changed_pages(tmpdir):
+        builder = create_formats_builder(tmpdir, [])
+        builder.build_config['search_state'] = {
+            'path': str(tmpdir.join('state')),
+        }
+        html = tmpdir.join('out', 'docs', 'html')
+        search_data = tmpdir.join('out', 'docs', 'search_data')
+        for name in ('index', 'install', 'usage'):
+            html.join(name + '.html').write(
+                '<div class="body">{}</div>'.format(name), ensure=True)
+        builder.build_search_data()
+        changes = json.loads(search_data.join('changes.json').read())
+        assert changes['added'] == ['index', 'install', 'usage']
+
+        html.join('install.html').write('<div class="body">changed</div>')
+        html.join('usage.html').remove()
+        # Without the output directory the state is used.
+        search_data.remove()
+        builder.build_search_data()
+        changes = json.loads(search_data.join('changes.json').read())
+        assert changes == {
+            'added': [],
+            'changed': ['install'],
+            'removed': ['usage'],
+        }
+        assert not search_data.join('usage.fjson').exists()
+        assert json.loads(tmpdir.join('state', 'docs.json').read()) == (
+            json.loads(search_data.join('manifest.json').read()))
+
+
+def get_doctree_args(builder):
+    return [
+        args[1][args[1].index('-d') + 1]
+        for args, kwargs in builder.venv.python_run.call_args_list
+        if args[0] == 'sphinx-build']
+
+
+def write_sphinx_output(command, args):
+    if command == 'sphinx-build' and args[args.index('-b') + 1] == 'epub':
+        with open(os.path.join(args[-1], 'docs.epub'), 'w'):
+            pass
+    return 0
+
+
+def describe_doctrees():
+    def it_shares_doctrees_between_formats(tmpdir):
+        build_config = get_config({
+            'base': str(tmpdir),
+            'output_base': str(tmpdir.join('out')),
+            'formats': ['epub'],
+        })
+        builder = SphinxBuilder(build_config=build_config)
+        with patch('readthedocs_build.builder.base.VirtualEnv') as VirtualEnv:
+            VirtualEnv.return_value.python_run.side_effect = (
+                write_sphinx_output)
+            with patch.object(SphinxBuilder, 'cleanup'):
+                builder.build()
+        doctree_dirs = get_doctree_args(builder)
+        assert len(doctree_dirs) == 2
+        assert len(set(doctree_dirs)) == 1
+        assert not doctree_dirs[0].startswith(str(tmpdir.join('out')))
+        # Do real cleanup.
+        builder.cleanup()
+
+    def it_builds_first_format_before_the_others(tmpdir):
+        build_config = get_config({
+            'base': str(tmpdir),
+            'output_base': str(tmpdir.join('out')),
+            'format_concurrency': 2,
+        })
+        builder = SphinxBuilder(build_config=build_config)
+        calls = []
+        builder.get_format_builds = lambda: [
+            lambda: calls.append('html'),
+            lambda: calls.append('json'),
+            lambda: calls.append('epub'),
+        ]
+        builder.build_formats()
+        assert calls[0] == 'html'
+        assert sorted(calls[1:]) == ['epub', 'json']
+
+    def it_removes_doctrees_on_cleanup(tmpdir):
+        builder = SphinxBuilder(build_config=get_config())
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            builder.setup()
+            doctree_dir = builder.get_doctree_directory()
+            assert os.path.exists(doctree_dir)
+            builder.cleanup()
+            assert not os.path.exists(doctree_dir)
+
+
+def create_cached_builder(tmpdir, packages=('Sphinx==1.6',)):
+    build_config = get_config({
+        'base': str(tmpdir.join('docs')),
+        'doctree_cache': {'path': str(tmpdir.join('cache'))},
+    })
+    builder = SphinxBuilder(build_config=build_config)
+    with patch('readthedocs_build.builder.base.VirtualEnv'):
+        builder.setup()
+    builder.venv.freeze.return_value = list(packages)
+    return builder
+
+
+def describe_doctree_cache():
+    def it_keeps_doctrees_between_builds(tmpdir):
+        tmpdir.mkdir('docs').join('conf.py').write('project = "docs"')
+        builder = create_cached_builder(tmpdir)
+        doctree_dir = builder.get_doctree_directory()
+        assert doctree_dir.startswith(str(tmpdir.join('cache', 'docs-')))
+        with open(os.path.join(doctree_dir, 'environment.pickle'), 'w'):
+            pass
+        builder.cleanup()
+
+        builder = create_cached_builder(tmpdir)
+        assert builder.get_doctree_directory() == doctree_dir
+        assert os.path.exists(
+            os.path.join(doctree_dir, 'environment.pickle'))
+
+    def it_invalidates_on_conf_py_change(tmpdir):
+        conf_py = tmpdir.mkdir('docs').join('conf.py')
+        conf_py.write('project = "docs"')
+        doctree_dir = create_cached_builder(tmpdir).get_doctree_directory()
+        with open(os.path.join(doctree_dir, 'environment.pickle'), 'w'):
+            pass
+
+        conf_py.write('project = "changed"')
+        builder = create_cached_builder(tmpdir)
+        assert builder.get_doctree_directory() == doctree_dir
+        assert not os.path.exists(
+            os.path.join(doctree_dir, 'environment.pickle'))
+
+    def it_invalidates_on_package_change(tmpdir):
+        tmpdir.mkdir('docs').join('conf.py').write('')
+        doctree_dir = create_cached_builder(tmpdir).get_doctree_directory()
+        with open(os.path.join(doctree_dir, 'environment.pickle'), 'w'):
+            pass
+
+        builder = create_cached_builder(
+            tmpdir, packages=['Sphinx==1.6', 'docutils==0.14'])
+        assert builder.get_doctree_directory() == doctree_dir
+        assert not os.path.exists(
+            os.path.join(doctree_dir, 'environment.pickle'))
+
+    def it_depends_on_sphinx_version(tmpdir):
+        tmpdir.mkdir('docs').join('conf.py').write('')
+        builder = create_cached_builder(tmpdir)
+        other = create_cached_builder(tmpdir, packages=['Sphinx==1.7'])
+        assert (
+            builder.get_doctree_directory() !=
+            other.get_doctree_directory())
+
+    def it_depends_on_python_version(tmpdir):
+        tmpdir.mkdir('docs').join('conf.py').write('')
+        builder = create_cached_builder(tmpdir)
+        other = create_cached_builder(tmpdir)
+        other.build_config['python']['version'] = 3
+        assert builder.get_cache_name() != other.get_cache_name()
+
+    def it_ignores_unrelated_options(tmpdir):
+        tmpdir.mkdir('docs').join('conf.py').write('')
+        builder = create_cached_builder(tmpdir)
+        other = create_cached_builder(tmpdir)
+        other.build_config.update({
+            'output_base': str(tmpdir.join('elsewhere')),
+            'format_concurrency': 4,
+            'search_index': True,
+            'sphinx_worker': True,
+        })
+        assert builder.get_cache_name() == other.get_cache_name()
+
+    def it_depends_on_build_config(tmpdir):
+        tmpdir.mkdir('docs').join('conf.py').write('')
+        builder = create_cached_builder(tmpdir)
+        other = create_cached_builder(tmpdir)
+        other.build_config['name'] = 'other'
+        assert (
+            builder.get_doctree_directory() !=
+            other.get_doctree_directory())
+
+
+def create_formats_builder(tmpdir, formats):
+    build_config = get_config({
+        'name': 'docs',
+        'base': str(tmpdir),
+        'output_base': str(tmpdir.join('out')),
+        'formats': formats,
+    })
+    builder = SphinxBuilder(build_config=build_config)
+    builder.venv = Mock()
+    builder.venv.freeze.return_value = ['Sphinx==1.6']
+    builder.doctree_dir = str(tmpdir.mkdir('doctrees'))
+    return builder
+
+
+def describe_formats():
+    def it_builds_configured_formats_after_html(tmpdir):
+        builder = create_formats_builder(tmpdir, ['epub', 'htmlzip'])
+        assert builder.get_format_builds() == [
+            builder.build_html,
+            builder.build_search_data,
+            builder.build_epub,
+            builder.build_htmlzip,
+        ]
+
+    def it_writes_html_into_zip(tmpdir):
+        builder = create_formats_builder(tmpdir, ['htmlzip'])
+        html = tmpdir.join('out', 'docs', 'html')
+        html.join('index.html').write('index', ensure=True)
+        html.join('_static', 'style.css').write('css', ensure=True)
+        html.join('.buildinfo').write('')
+        builder.build_htmlzip()
+        zip_path = str(tmpdir.join('out', 'docs', 'htmlzip', 'docs.zip'))
+        with zipfile.ZipFile(zip_path) as archive:
+            assert archive.namelist() == [
+                'docs/index.html',
+                'docs/_static/style.css',
+            ]
+            assert archive.read('docs/index.html') == b'index'
+
+    def it_runs_latexmk_on_latex_output(tmpdir):
+        builder = create_formats_builder(tmpdir, ['pdf'])
+
+        def write_latex(command, args):
+            latex_dir = args[-1]
+            with open(os.path.join(latex_dir, 'docs.tex'), 'w'):
+                pass
+            return 0
+
+        def write_pdf(args, cwd, env):
+            with open(os.path.join(cwd, 'docs.pdf'), 'w'):
+                pass
+            return 0
+
+        builder.venv.python_run.side_effect = write_latex
+        with patch('readthedocs_build.builder.sphinx.run',
+                   side_effect=write_pdf) as run:
+            builder.build_pdf()
+        args, kwargs = builder.venv.python_run.call_args
+        assert args[1][:2] == ['-b', 'latex']
+        assert run.call_args[0][0][-1] == 'docs.tex'
+        assert tmpdir.join('out', 'docs', 'pdf', 'docs.pdf').exists()
+        assert not os.path.exists(args[1][-1])
+
+    def it_keeps_latex_files_in_cache(tmpdir):
+        builder = create_formats_builder(tmpdir, ['pdf'])
+        builder.build_config['latex_cache'] = {
+            'path': str(tmpdir.join('latex')),
+        }
+        latex_dir = tmpdir.join('latex', builder.get_cache_name())
+        latex_dir.join('removed.tex').write('', ensure=True)
+        latex_dir.join('docs.aux').write('')
+
+        def write_latex(command, args):
+            for filename in ('docs.tex', 'api.tex'):
+                with open(os.path.join(args[-1], filename), 'w'):
+                    pass
+            return 0
+
+        builder.venv.python_run.side_effect = write_latex
+
+        def write_pdf(args, cwd, env):
+            pdf_file = os.path.splitext(args[-1])[0] + '.pdf'
+            with open(os.path.join(cwd, pdf_file), 'w'):
+                pass
+            return 0
+
+        with patch('readthedocs_build.builder.sphinx.run') as run:
+            run.side_effect = write_pdf
+            builder.build_pdf()
+        assert sorted(
+            args[0][-1] for args, kwargs in run.call_args_list
+        ) == ['api.tex', 'docs.tex']
+        for args, kwargs in run.call_args_list:
+            assert kwargs['cwd'] == str(latex_dir)
+            assert kwargs['env']['TEXMFVAR'] == str(
+                tmpdir.join('latex', 'texmf-var'))
+        assert latex_dir.join('docs.aux').exists()
+
+    def it_keeps_only_epub_file(tmpdir):
+        builder = create_formats_builder(tmpdir, ['epub'])
+
+        def write_epub(command, args):
+            epub_dir = args[-1]
+            for filename in ('docs.epub', 'content.opf'):
+                with open(os.path.join(epub_dir, filename), 'w'):
+                    pass
+            return 0
+
+        builder.venv.python_run.side_effect = write_epub
+        builder.build_epub()
+        assert tmpdir.join('out', 'docs', 'epub').listdir() == [
+            tmpdir.join('out', 'docs', 'epub', 'docs.epub')]
+
+    def it_replaces_epub_of_previous_build(tmpdir):
+        builder = create_formats_builder(tmpdir, ['epub'])
+        tmpdir.join('out', 'docs', 'epub', 'docs.epub').write(
+            'old', ensure=True)
+
+        def write_epub(command, args):
+            with open(os.path.join(args[-1], 'docs.epub'), 'w') as f:
+                f.write('new')
+            return 0
+
+        builder.venv.python_run.side_effect = write_epub
+        builder.build_epub()
+        assert tmpdir.join('out', 'docs', 'epub', 'docs.epub').read() == 'new'
+
+    def it_fails_if_html_build_fails(tmpdir):
+        builder = create_formats_builder(tmpdir, [])
+        builder.venv.python_run.return_value = 1
+        with raises(AssertionError):
+            builder.build_html()
+
+    def it_fails_if_epub_build_fails(tmpdir):
+        builder = create_formats_builder(tmpdir, ['epub'])
+        builder.venv.python_run.return_value = 1
+        with raises(AssertionError):
+            builder.build_epub()
+
+    def it_fails_if_latexmk_writes_no_pdf(tmpdir):
+        builder = create_formats_builder(tmpdir, ['pdf'])
+
+        def write_latex(command, args):
+            with open(os.path.join(args[-1], 'docs.tex'), 'w'):
+                pass
+            return 0
+
+        builder.venv.python_run.side_effect = write_latex
+        with patch('readthedocs_build.builder.sphinx.run') as run:
+            run.return_value = 12
+            with raises(AssertionError):
+                builder.build_pdf()
+            run.return_value = 0
+            with raises(AssertionError):
+                builder.build_pdf()
+
+    def it_fails_if_latex_build_fails(tmpdir):
+        builder = create_formats_builder(tmpdir, ['pdf'])
+        builder.venv.python_run.return_value = 2
+        with patch('readthedocs_build.builder.sphinx.run') as run:
+            with raises(AssertionError):
+                builder.build_pdf()
+            assert not run.called
+
+
+def describe_sphinx_jobs():
+    def it_passes_jobs_to_sphinx_build(tmpdir):
+        build_config = get_config({
+            'base': str(tmpdir),
+            'output_base': str(tmpdir.join('out')),
+            'sphinx': {'jobs': 'auto', 'max_jobs': 3},
+        })
+        builder = SphinxBuilder(build_config=build_config)
+        venv_patch = patch('readthedocs_build.builder.base.VirtualEnv')
+        with patch('readthedocs_build.builder.host.get_cpu_count',
+                   return_value=8):
+            with venv_patch as VirtualEnv:
+                VirtualEnv.return_value.python_run.return_value = 0
+                with patch.object(SphinxBuilder, 'cleanup'):
+                    builder.build()
+        for args, kwargs in builder.venv.python_run.call_args_list:
+            if args[0] == 'sphinx-build':
+                assert args[1][args[1].index('-j') + 1] == '3'
+        # Do real cleanup.
+        builder.cleanup()
+
+    def it_shares_cpus_with_running_builds(tmpdir):
+        build_config = get_config({
+            'base': str(tmpdir),
+            'output_base': str(tmpdir.join('out')),
+            'sphinx': {'jobs': 'auto', 'max_jobs': None},
+            'format_concurrency': 2,
+        })
+        builder = SphinxBuilder(build_config=build_config)
+        with patch('readthedocs_build.builder.host.get_cpu_count',
+                   return_value=8):
+            with patch('readthedocs_build.builder.sphinx.RunningBuilds') as (
+                    RunningBuilds):
+                RunningBuilds.return_value.count.return_value = 2
+                assert builder.get_sphinx_jobs() == 2
+
+
+def describe_sphinx_worker():
+    def it_runs_formats_in_worker(tmpdir):
+        build_config = get_config({
+            'base': str(tmpdir),
+            'output_base': str(tmpdir.join('out')),
+            'formats': ['epub'],
+            'sphinx_worker': True,
+        })
+        builder = SphinxBuilder(build_config=build_config)
+        worker = patch('readthedocs_build.builder.sphinx.SphinxWorker')
+        with patch('readthedocs_build.builder.base.VirtualEnv'):
+            with worker as SphinxWorker:
+                SphinxWorker.return_value.build.side_effect = (
+                    lambda format, source_dir, out_dir, *args, **kwargs:
+                    write_sphinx_output(
+                        'sphinx-build', ['-b', format, out_dir]))
+                builder.build()
+                SphinxWorker.assert_called_once_with(builder.venv)
+                worker = SphinxWorker.return_value
+                assert [
+                    args[0] for args, kwargs in worker.build.call_args_list
+                ] == ['html', 'epub']
+                worker.close.assert_called_with()
+                assert not any(
+                    args[0] == 'sphinx-build'
+                    for args, kwargs in
+                    builder.venv.python_run.call_args_list)
@@ -0,0 +1,152 @@
+from mock import Mock
+from pytest import raises
+import sys
+
+from ..testing.utils import apply_fs
+from .logs import BuildLog
+from .sphinx_runner import SphinxWorker
+from .sphinx_runner import SphinxWorkerError
+from .test_logs import read_log
+from .timing import TimingReport
+
+
+fake_sphinx = {
+    'sphinx': {
+        '__init__.py': '',
+        'application.py': '''
+import os
+import sys
+
+IMPORTS = os.environ['FAKE_SPHINX_IMPORTS']
+with open(IMPORTS, 'a') as f:
+    f.write('imported\\n')
+
+
+class Sphinx(object):
+    def __init__(self, srcdir, confdir, outdir, doctreedir, buildername,
+                 status, warning, freshenv, parallel):
+        self.outdir = outdir
+        self.buildername = buildername
+        self.parallel = parallel
+        self.statuscode = 0
+        if buildername == 'broken':
+            raise ValueError('broken builder')
+
+    def build(self):
+        sys.stdout.write('building {}\\n'.format(self.buildername))
+        with open(os.path.join(self.outdir, 'built'), 'w') as f:
+            f.write('{} {}'.format(self.buildername, self.parallel))
+        if self.buildername == 'failing':
+            self.statuscode = 2
+''',
+        'util': {
+            '__init__.py': '',
+            'docutils.py': '''
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def record(event):
+    with open(os.environ['FAKE_SPHINX_IMPORTS'], 'a') as f:
+        f.write('enter {}\\n'.format(event))
+    yield
+    with open(os.environ['FAKE_SPHINX_IMPORTS'], 'a') as f:
+        f.write('exit {}\\n'.format(event))
+
+
+def docutils_namespace():
+    return record('namespace')
+
+
+def patch_docutils(confdir=None):
+    return record('patch {}'.format(os.path.basename(confdir)))
+''',
+        },
+    },
+}
+
+
+def create_worker(tmpdir, monkeypatch):
+    apply_fs(tmpdir, fake_sphinx)
+    venv_dir = tmpdir.mkdir('venv')
+    venv_dir.mkdir('bin').join('python').mksymlinkto(sys.executable)
+    monkeypatch.setenv('PYTHONPATH', str(tmpdir))
+    monkeypatch.setenv('FAKE_SPHINX_IMPORTS', str(tmpdir.join('imports')))
+    return SphinxWorker(Mock(base_path=str(venv_dir)))
+
+
+def describe_sphinx_worker():
+    def it_runs_builds_in_one_process(tmpdir, monkeypatch):
+        worker = create_worker(tmpdir, monkeypatch)
+        html = tmpdir.mkdir('html')
+        json = tmpdir.mkdir('json')
+        try:
+            assert worker.build(
+                'html', str(tmpdir), str(html), 'doctrees') == 0
+            assert worker.build(
+                'json', str(tmpdir), str(json), 'doctrees', jobs=4) == 0
+        finally:
+            assert worker.close() == 0
+        assert html.join('built').read() == 'html 1'
+        assert json.join('built').read() == 'json 4'
+        assert tmpdir.join('imports').read().count('imported') == 1
+
+    def it_returns_sphinx_status_code(tmpdir, monkeypatch):
+        worker = create_worker(tmpdir, monkeypatch)
+        try:
+            assert worker.build(
+                'failing', str(tmpdir), str(tmpdir), 'doctrees') == 2
+            assert worker.build(
+                'broken', str(tmpdir), str(tmpdir), 'doctrees') == 1
+        finally:
+            worker.close()
+
+    def it_raises_if_worker_dies(tmpdir, monkeypatch):
+        worker = create_worker(tmpdir, monkeypatch)
+        worker.process.kill()
+        worker.process.wait()
+        with raises(SphinxWorkerError):
+            worker.build('html', str(tmpdir), str(tmpdir), 'doctrees')
+
+    def it_isolates_docutils_state_of_every_build(tmpdir, monkeypatch):
+        worker = create_worker(tmpdir, monkeypatch)
+        try:
+            for builder in ('html', 'json'):
+                worker.build(builder, str(tmpdir), str(tmpdir), 'doctrees',
+                             conf_dir=str(tmpdir.mkdir(builder)))
+        finally:
+            worker.close()
+        assert tmpdir.join('imports').read().splitlines() == [
+            'imported',
+            'enter patch html', 'enter namespace',
+            'exit namespace', 'exit patch html',
+            'enter patch json', 'enter namespace',
+            'exit namespace', 'exit patch json',
+        ]
+
+    def it_records_builds_in_current_stage(tmpdir, monkeypatch):
+        log = BuildLog(str(tmpdir.join('build.log.gz')))
+        timings = TimingReport('docs', log=log)
+        with timings.stage('html') as stage:
+            worker = create_worker(tmpdir, monkeypatch)
+            try:
+                assert worker.build(
+                    'html', str(tmpdir), str(tmpdir), 'doctrees') == 0
+                assert worker.build(
+                    'failing', str(tmpdir), str(tmpdir), 'doctrees') == 2
+            finally:
+                worker.close()
+        log.close()
+        html, failing = stage['subprocesses']
+        assert html['label'] == 'sphinx-build'
+        assert html['args'][:3] == ['sphinx-build', '-b', 'html']
+        assert html['exit_code'] == 0
+        assert 'user_time' in html['rusage']
+        assert failing['exit_code'] == 2
+        assert failing['output_tail'] == 'building failing\n'
+        assert [line.split(' ', 1)[1] for line in read_log(
+            tmpdir.join('build.log.gz'))] == [
+            '[sphinx-build:stderr] building html',
+            '[sphinx-build:stderr] building failing',
+        ]
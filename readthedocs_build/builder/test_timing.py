@@ -0,0 +1,150 @@
+from multiprocessing.pool import ThreadPool
+from pytest import raises
+import subprocess
+import sys
+
+from .timing import TimingReport
+from .timing import format_reports
+from .timing import in_current_stage
+from .utils import run
+from .utils import run_output
+
+
+def describe_timing_report():
+    def it_records_stages():
+        timings = TimingReport('docs')
+        with timings.stage('html') as stage:
+            pass
+        report = timings.as_dict()
+        assert report['name'] == 'docs'
+        assert report['exit_code'] == 0
+        assert report['stages'] == [stage]
+        assert stage['exit_code'] == 0
+        assert stage['duration'] == stage['finished'] - stage['started']
+        assert report['duration'] >= stage['duration']
+
+    def it_records_subprocesses_of_the_stage():
+        timings = TimingReport('docs')
+        with timings.stage('html') as stage:
+            run([sys.executable, '-c', 'pass'])
+            run([sys.executable, '-c', 'exit(3)'], label='failing')
+        run([sys.executable, '-c', 'pass'])
+        assert [record['exit_code'] for record in stage['subprocesses']] == [
+            0, 3]
+        record = stage['subprocesses'][1]
+        assert record['label'] == 'failing'
+        assert record['args'][-1] == 'exit(3)'
+        assert record['started'] <= record['finished']
+
+    def it_records_run_output():
+        timings = TimingReport('docs')
+        with timings.stage('freeze') as stage:
+            run_output([sys.executable, '-c', 'print(1)'])
+        assert stage['subprocesses'][0]['exit_code'] == 0
+
+    def it_reports_the_exit_code_of_failed_stages():
+        timings = TimingReport('docs')
+        with raises(AssertionError):
+            with timings.stage('virtualenv'):
+                exit_code = run([sys.executable, '-c', 'exit(2)'])
+                assert exit_code == 0
+        with raises(ValueError):
+            timings.timed('html', raise_value_error)()
+        report = timings.as_dict()
+        assert [stage['exit_code'] for stage in report['stages']] == [2, 1]
+        assert report['exit_code'] == 2
+
+    def it_records_subprocesses_in_other_threads():
+        timings = TimingReport('docs')
+        pool = ThreadPool(processes=2)
+        with timings.stage('pdf') as stage:
+            pool.map(
+                in_current_stage(
+                    lambda code: run([sys.executable, '-c', code])),
+                ['pass', 'pass'])
+        pool.close()
+        pool.join()
+        assert len(stage['subprocesses']) == 2
+
+
+def raise_value_error():
+    raise ValueError
+
+
+def test_format_reports():
+    timings = TimingReport('docs')
+    with timings.stage('html'):
+        run([sys.executable, '-c', 'pass'])
+    lines = format_reports([timings.as_dict()])
+    assert lines[0].split() == [
+        'config', 'stage', 'seconds', 'exit', 'processes', 'cpu', 'max_rss']
+    assert lines[1].split()[:2] == ['docs', 'html']
+    assert lines[1].split()[3:5] == ['0', '1']
+    assert float(lines[1].split()[6]) > 0
+    assert lines[2].split()[:2] == ['docs', 'total']
+    assert len(lines) == 3
+
+
+def test_format_reports_with_venv_pool():
+    reports = []
+    for venv_pool in ('hit', 'miss', 'hit', None):
+        timings = TimingReport('docs')
+        timings.venv_pool = venv_pool
+        reports.append(timings.as_dict())
+    lines = format_reports(reports)
+    assert lines[-1] == 'virtualenv pool: 2 hits, 1 misses'
+
+
+def describe_rusage():
+    def it_is_recorded_for_every_subprocess():
+        timings = TimingReport('docs')
+        with timings.stage('html') as stage:
+            run([sys.executable, '-c', 'sum(range(10 ** 6))'])
+        rusage = stage['subprocesses'][0]['rusage']
+        assert set(rusage) == set([
+            'user_time',
+            'system_time',
+            'max_rss',
+            'block_input',
+            'block_output',
+            'voluntary_context_switches',
+            'involuntary_context_switches',
+        ])
+        assert rusage['user_time'] + rusage['system_time'] > 0
+        assert rusage['max_rss'] > 0
+
+    def it_is_summed_per_stage_and_build():
+        timings = TimingReport('docs')
+        with timings.stage('html') as html:
+            run([sys.executable, '-c', 'pass'])
+            run([sys.executable, '-c', 'b = bytearray(64 * 1024 * 1024)'])
+        with timings.stage('pdf') as pdf:
+            run([sys.executable, '-c', 'pass'])
+        first, second = [
+            record['rusage'] for record in html['subprocesses']]
+        assert html['rusage']['user_time'] == (
+            first['user_time'] + second['user_time'])
+        assert html['rusage']['max_rss'] == second['max_rss']
+        report = timings.as_dict()
+        assert report['rusage']['max_rss'] == second['max_rss']
+        assert report['rusage']['voluntary_context_switches'] == (
+            html['rusage']['voluntary_context_switches'] +
+            pdf['rusage']['voluntary_context_switches'])
+
+    def it_is_empty_without_subprocesses():
+        timings = TimingReport('docs')
+        with timings.stage('html') as stage:
+            pass
+        assert stage['rusage'] == {}
+        assert timings.as_dict()['rusage'] == {}
+
+
+def describe_run():
+    def it_returns_negative_exit_codes_of_signals():
+        code = 'import os, signal; os.kill(os.getpid(), signal.SIGTERM)'
+        assert run([sys.executable, '-c', code]) == -15
+
+    def it_raises_if_run_output_fails():
+        with raises(subprocess.CalledProcessError) as info:
+            run_output([sys.executable, '-c', 'print(1); exit(4)'])
+        assert info.value.returncode == 4
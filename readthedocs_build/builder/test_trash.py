@@ -0,0 +1,76 @@
+from mock import patch
+import pytest
+import six
+
+from .trash import Trash
+from .virtualenv import VirtualEnv
+
+
+def describe_trash():
+    def it_moves_directory_into_trash(tmpdir):
+        venv = tmpdir.mkdir('venv')
+        venv.join('file').write('')
+        trash = Trash(str(tmpdir.join('trash')))
+        with patch.object(Trash, 'delete') as delete:
+            trash.discard(str(venv))
+            trash.wait()
+            assert not venv.exists()
+            args, kwargs = delete.call_args
+            assert args[0].startswith(str(tmpdir.join('trash')))
+
+    def it_deletes_in_background(tmpdir):
+        venv = tmpdir.mkdir('venv')
+        venv.mkdir('lib').join('file').write('')
+        trash = Trash(str(tmpdir.join('trash')))
+        trash.discard(str(venv))
+        trash.wait()
+        assert not venv.exists()
+        assert tmpdir.join('trash').listdir() == []
+
+    def it_falls_back_to_rmtree(tmpdir):
+        venv = tmpdir.mkdir('venv')
+        trash = Trash(str(tmpdir.join('trash')))
+        with patch.object(Trash, 'delete_command', ('does-not-exist',)):
+            trash.discard(str(venv))
+            trash.wait()
+        assert tmpdir.join('trash').listdir() == []
+
+    def it_deletes_in_place_if_rename_fails(tmpdir):
+        venv = tmpdir.mkdir('venv')
+        trash = Trash(str(tmpdir.join('trash')))
+        with patch('readthedocs_build.builder.trash.os.rename') as rename:
+            rename.side_effect = OSError
+            trash.discard(str(venv))
+            trash.wait()
+        assert not venv.exists()
+
+    @pytest.mark.skipif(six.PY2, reason='Only for python3')
+    def it_deletes_in_a_new_session(tmpdir):
+        venv = tmpdir.mkdir('venv')
+        trash = Trash(str(tmpdir.join('trash')))
+        popen = patch('readthedocs_build.builder.trash.subprocess.Popen')
+        with popen as popen:
+            trash.discard(str(venv))
+            trash.wait()
+        args, kwargs = popen.call_args
+        assert 'preexec_fn' not in kwargs
+        assert kwargs['start_new_session']
+
+    def it_sweeps_leftovers_on_start(tmpdir):
+        leftover = tmpdir.mkdir('trash').mkdir('leftover')
+        trash = Trash(str(tmpdir.join('trash')))
+        trash.wait()
+        assert not leftover.exists()
+
+
+def test_virtualenv_cleanup_uses_trash(tmpdir):
+    venv_dir = tmpdir.mkdir('venv')
+    venv_dir.mkdir('bin').join('python').write('')
+    trash = Trash(str(tmpdir.join('trash')))
+    venv = VirtualEnv(base_path=str(venv_dir), trash=trash)
+    with patch.object(Trash, 'delete'):
+        venv.cleanup()
+        assert not venv_dir.exists()
+        # Running cleanup again, e.g. from __del__, does nothing.
+        venv.cleanup()
+        trash.wait()
@@ -1,5 +1,8 @@
+from mock import Mock
 from mock import patch
 import os
+import subprocess
+import sys
 
 from .virtualenv import VirtualEnv
 
@@ -55,7 +58,7 @@ def describe_python_run():
                     os.path.join(venv.base_path, 'bin', 'python'),
                     os.path.join(venv.base_path, 'bin', 'pip'),
                     'freeze',
-                ])
+                ], label='pip', report=True)
 
     def it_takes_absolute_path_to_script(tmpdir):
         with patch('readthedocs_build.builder.virtualenv.run') as run:
@@ -66,7 +69,7 @@ def describe_python_run():
                 run.assert_called_with([
                     os.path.join(venv.base_path, 'bin', 'python'),
                     setup_py,
-                ])
+                ], label='setup.py', report=True)
 
 
 def test_install(tmpdir):
@@ -83,3 +86,152 @@ def test_install(tmpdir):
             venv.install('-rrequirements.txt')
             python_run.assert_called_with(
                 'pip', ['install', '-rrequirements.txt'])
+
+
+def test_reuses_existing_virtualenv(tmpdir):
+    tmpdir.mkdir('bin').join('python').write('')
+    with patch('readthedocs_build.builder.virtualenv.run') as run:
+        venv = VirtualEnv(base_path=str(tmpdir))
+        assert not run.called
+        assert venv.base_path == str(tmpdir)
+
+
+def test_cleanup_keeps_persistent_virtualenv(tmpdir):
+    tmpdir.mkdir('bin').join('python').write('')
+    venv = VirtualEnv(base_path=str(tmpdir), persistent=True)
+    venv.cleanup()
+    assert tmpdir.join('bin', 'python').exists()
+
+
+def describe_install_all():
+    def it_installs_everything_with_one_pip_call():
+        with patch.object(VirtualEnv, 'setup'):
+            with patch.object(VirtualEnv, 'python_run') as python_run:
+                python_run.return_value = 0
+                venv = VirtualEnv()
+                venv.install_all(
+                    packages=['Sphinx', 'foo>=1.0'],
+                    requirements_files=['/docs/requirements.txt'],
+                    project_path='/project',
+                    extras=['docs', 'tests'])
+                python_run.assert_called_once_with('pip', [
+                    'install',
+                    'Sphinx',
+                    'foo>=1.0',
+                    '-r/docs/requirements.txt',
+                    '/project[docs,tests]',
+                ])
+
+    def it_installs_project_without_extras():
+        with patch.object(VirtualEnv, 'setup'):
+            with patch.object(VirtualEnv, 'python_run') as python_run:
+                python_run.return_value = 0
+                venv = VirtualEnv()
+                venv.install_all(project_path='/project')
+                python_run.assert_called_once_with(
+                    'pip', ['install', '/project'])
+
+    def it_does_nothing_without_packages():
+        with patch.object(VirtualEnv, 'setup'):
+            with patch.object(VirtualEnv, 'python_run') as python_run:
+                venv = VirtualEnv()
+                venv.install_all()
+                assert not python_run.called
+                assert not venv.modified
+
+
+def test_install_uses_wheelhouse():
+    wheelhouse = Mock()
+    wheelhouse.install.return_value = 0
+    with patch.object(VirtualEnv, 'setup'):
+        with patch.object(VirtualEnv, 'python_run') as python_run:
+            venv = VirtualEnv(wheelhouse=wheelhouse)
+            venv.install('FooBar')
+            args, kwargs = wheelhouse.install.call_args
+            pip_run, pip_args = args
+            assert pip_args == ['FooBar']
+            pip_run(['wheel', 'FooBar'])
+            python_run.assert_called_with(
+                'pip', ['wheel', 'FooBar'], report=True)
+            pip_run(['install', 'FooBar'], report=False)
+            python_run.assert_called_with(
+                'pip', ['install', 'FooBar'], report=False)
+
+
+def create_fake_venv(path):
+    path.mkdir('bin').join('python').write('')
+    return path.mkdir('lib').mkdir('python2.7').mkdir('site-packages')
+
+
+def describe_base_layer():
+    def it_links_base_layer_site_packages(tmpdir):
+        base_site_packages = create_fake_venv(tmpdir.mkdir('base'))
+        site_packages = create_fake_venv(tmpdir.mkdir('overlay'))
+        base_layer = VirtualEnv(base_path=str(tmpdir.join('base')))
+        base_layer.provided_dependencies = ('Sphinx',)
+        venv = VirtualEnv(
+            base_path=str(tmpdir.join('overlay')),
+            base_layer=base_layer)
+        pth = site_packages.join(VirtualEnv.base_layer_pth)
+        assert str(base_site_packages) in pth.read()
+        assert venv.provided_dependencies == ('Sphinx',)
+
+    def it_processes_pth_files_of_base_layer(tmpdir):
+        base_site_packages = create_fake_venv(tmpdir.mkdir('base'))
+        site_packages = create_fake_venv(tmpdir.mkdir('overlay'))
+        namespace_dir = tmpdir.mkdir('namespace')
+        base_site_packages.join('nspkg.pth').write(str(namespace_dir) + '\n')
+        base_layer = VirtualEnv(base_path=str(tmpdir.join('base')))
+        venv = VirtualEnv(
+            base_path=str(tmpdir.join('overlay')),
+            base_layer=base_layer)
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import site, sys; site.addsitedir(sys.argv[1]); print(sys.path)',
+            str(site_packages)])
+        assert str(base_site_packages) in output.decode('utf-8')
+        assert str(namespace_dir) in output.decode('utf-8')
+        venv.cleanup()
+
+    def it_runs_executables_from_base_layer(tmpdir):
+        create_fake_venv(tmpdir.mkdir('base'))
+        create_fake_venv(tmpdir.mkdir('overlay'))
+        tmpdir.join('overlay', 'bin', 'pip').write('')
+        base_layer = VirtualEnv(base_path=str(tmpdir.join('base')))
+        venv = VirtualEnv(
+            base_path=str(tmpdir.join('overlay')),
+            base_layer=base_layer)
+        with patch('readthedocs_build.builder.virtualenv.run') as run:
+            python_bin = str(tmpdir.join('overlay', 'bin', 'python'))
+            venv.python_run('sphinx-build', [])
+            run.assert_called_with([
+                python_bin,
+                str(tmpdir.join('base', 'bin', 'sphinx-build')),
+            ], label='sphinx-build', report=True)
+            venv.python_run('pip', [])
+            run.assert_called_with([
+                python_bin,
+                str(tmpdir.join('overlay', 'bin', 'pip')),
+            ], label='pip', report=True)
+
+
+def test_make_read_only(tmpdir):
+    site_packages = create_fake_venv(tmpdir)
+    module = site_packages.join('module.py')
+    module.write('')
+    venv = VirtualEnv(base_path=str(tmpdir), persistent=True)
+    venv.make_read_only()
+    assert not os.stat(str(module)).st_mode & 0o222
+    assert os.stat(str(site_packages)).st_mode & 0o200
+
+
+def test_freeze_returns_sorted_packages():
+    with patch.object(VirtualEnv, 'setup'):
+        with patch('readthedocs_build.builder.virtualenv.run_output') as run:
+            run.return_value = 'Sphinx==1.6.1\ndocutils==0.14\n\n'
+            venv = VirtualEnv()
+            assert venv.freeze() == ['Sphinx==1.6.1', 'docutils==0.14']
+            run.assert_called_with([
+                os.path.join(venv.base_path, 'bin', 'python'),
+                '-m', 'pip', 'freeze', '--all',
+            ], label='pip')
@@ -0,0 +1,133 @@
+from mock import Mock
+from mock import patch
+import os
+import sys
+
+from .wheelhouse import Wheelhouse
+
+
+def add_wheel(tmpdir, filename, size, last_used):
+    wheel = tmpdir.join(filename)
+    wheel.write('x' * size)
+    os.utime(str(wheel), (last_used, last_used))
+
+
+def describe_install():
+    def it_installs_from_wheelhouse_only(tmpdir):
+        wheelhouse = Wheelhouse(str(tmpdir))
+        pip_run = Mock(return_value=0)
+        assert wheelhouse.install(pip_run, ['Sphinx']) == 0
+        pip_run.assert_called_once_with([
+            'install',
+            '--disable-pip-version-check',
+            '--no-index',
+            '--find-links={}'.format(tmpdir),
+            'Sphinx',
+        ], report=False)
+
+    def it_builds_missing_wheels(tmpdir):
+        wheelhouse = Wheelhouse(str(tmpdir))
+        pip_run = Mock(side_effect=[1, 0, 0])
+        assert wheelhouse.install(pip_run, ['Sphinx']) == 0
+        assert pip_run.call_count == 3
+        args, kwargs = pip_run.call_args_list[1]
+        assert args[0] == [
+            'wheel',
+            '--disable-pip-version-check',
+            '--wheel-dir={}'.format(tmpdir),
+            '--find-links={}'.format(tmpdir),
+            'Sphinx',
+        ]
+        args, kwargs = pip_run.call_args_list[2]
+        assert '--no-index' in args[0]
+
+    def it_builds_no_wheels_of_local_projects(tmpdir):
+        wheels = tmpdir.mkdir('wheels')
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('Sphinx\n-r nested.txt\n')
+        tmpdir.join('nested.txt').write('-e .\nalabaster==0.7\n./src\n')
+        tmpdir.join('constraints.txt').write('docutils<0.18\n')
+        wheelhouse = Wheelhouse(str(wheels))
+        pip_run = Mock(side_effect=[1, 0, 0])
+        args = [
+            'six', '-r{}'.format(requirements),
+            '-c', str(tmpdir.join('constraints.txt')), '.',
+            '/project[docs]', '-e', 'src',
+            '--editable=git+https://host/repo#egg=foo',
+            'git+https://host/requests#egg=requests',
+            'https://host/requests-99.tar.gz',
+        ]
+        assert wheelhouse.install(pip_run, args) == 0
+        args, kwargs = pip_run.call_args_list[1]
+        assert args[0][4:] == [
+            'six', 'Sphinx', 'alabaster==0.7',
+            '-c', str(tmpdir.join('constraints.txt'))]
+        args, kwargs = pip_run.call_args_list[2]
+        assert '--no-index' not in args[0]
+        assert args[0][-1] == 'https://host/requests-99.tar.gz'
+
+    def it_builds_no_wheels_with_other_indexes(tmpdir):
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('--extra-index-url https://host/simple\nfoo\n')
+        wheelhouse = Wheelhouse(str(tmpdir.mkdir('wheels')))
+        pip_run = Mock(side_effect=[1, 0])
+        assert wheelhouse.install(pip_run, [
+            'Sphinx', '-r{}'.format(requirements)]) == 0
+        assert pip_run.call_count == 2
+        args, kwargs = pip_run.call_args
+        assert args[0][0] == 'install'
+        assert '--no-index' not in args[0]
+
+    def it_only_installs_local_projects(tmpdir):
+        wheelhouse = Wheelhouse(str(tmpdir))
+        pip_run = Mock(side_effect=[1, 0])
+        assert wheelhouse.install(pip_run, ['/project']) == 0
+        assert pip_run.call_count == 2
+        args, kwargs = pip_run.call_args
+        assert args[0][0] == 'install'
+        assert '--no-index' not in args[0]
+
+    def it_fails_if_wheels_cannot_be_built(tmpdir):
+        wheelhouse = Wheelhouse(str(tmpdir))
+        pip_run = Mock(side_effect=[1, 1])
+        assert wheelhouse.install(pip_run, ['Sphinx']) == 1
+        assert pip_run.call_count == 2
+
+    def it_never_uses_the_index_when_offline(tmpdir):
+        wheelhouse = Wheelhouse(str(tmpdir), offline=True)
+        pip_run = Mock(return_value=1)
+        assert wheelhouse.install(pip_run, ['Sphinx']) == 1
+        assert pip_run.call_count == 1
+        args, kwargs = pip_run.call_args
+        assert kwargs == {}
+
+
+def test_fill_uses_python_interpreter(tmpdir):
+    wheelhouse = Wheelhouse(str(tmpdir))
+    with patch('readthedocs_build.builder.wheelhouse.run') as run:
+        run.return_value = 0
+        wheelhouse.fill(['Sphinx'])
+        args, kwargs = run.call_args
+        assert args[0][:4] == [sys.executable, '-m', 'pip', 'wheel']
+        assert args[0][-1] == 'Sphinx'
+
+
+def describe_evict():
+    def it_does_nothing_without_max_size(tmpdir):
+        add_wheel(tmpdir, 'a-1.0-py2.py3-none-any.whl', 100, 1000)
+        wheelhouse = Wheelhouse(str(tmpdir))
+        wheelhouse.evict()
+        assert wheelhouse.get_size() == 100
+
+    def it_removes_least_recently_used_wheels(tmpdir):
+        add_wheel(tmpdir, 'a-1.0-py2.py3-none-any.whl', 100, 3000)
+        add_wheel(tmpdir, 'b-1.0-py2.py3-none-any.whl', 100, 1000)
+        add_wheel(tmpdir, 'c-1.0-py2.py3-none-any.whl', 100, 2000)
+        tmpdir.join('not-a-wheel.txt').write('x' * 1000)
+        wheelhouse = Wheelhouse(str(tmpdir), max_size=200)
+        wheelhouse.evict()
+        assert [filename for _, _, filename in wheelhouse.get_wheels()] == [
+            'c-1.0-py2.py3-none-any.whl',
+            'a-1.0-py2.py3-none-any.whl',
+        ]
+        assert tmpdir.join('not-a-wheel.txt').exists()
@@ -0,0 +1,313 @@
+"""
+Timing reports of builds.
+
+A :class:`TimingReport` records the stages of one build, like setting up
+the virtualenv or building a format. While a stage runs, every subprocess
+started by :func:`~readthedocs_build.builder.utils.run` in the same thread
+is recorded in the stage as well, including its resource usage. The usage
+of all subprocesses is summed up per stage and per build.
+
+With a ``sample_interval``, the resource usage of every subprocess is also
+sampled while it runs, see :mod:`~readthedocs_build.builder.sampler`. With
+a ``log``, the output of every subprocess is captured in it, see
+:mod:`~readthedocs_build.builder.logs`.
+"""
+
+import contextlib
+import functools
+import threading
+import time
+
+from .sampler import FIELDS
+
+
+__all__ = ('TimingReport', 'format_reports', 'in_current_stage')
+
+
+_local = threading.local()
+
+
+def get_current():
+    """
+    Return the current ``(report, stage)`` of this thread.
+    """
+    return getattr(_local, 'current', (None, None))
+
+
+def get_current_stage():
+    return get_current()[1]
+
+
+def get_sample_interval():
+    """
+    Return the interval in which subprocesses of the current stage are
+    sampled, or ``None`` if they are not sampled.
+    """
+    report = get_current()[0]
+    if report is None:
+        return None
+    return report.sample_interval
+
+
+def get_build_log():
+    """
+    Return the :class:`~readthedocs_build.builder.logs.BuildLog` that
+    captures the output of subprocesses of the current stage, or ``None``.
+    """
+    report = get_current()[0]
+    if report is None:
+        return None
+    return report.log
+
+
+@contextlib.contextmanager
+def current_stage(report, stage):
+    previous = get_current()
+    _local.current = (report, stage)
+    try:
+        yield stage
+    finally:
+        _local.current = previous
+
+
+def in_current_stage(function):
+    """
+    Wrap ``function`` so that its subprocesses are recorded in the current
+    stage, also if it is called in another thread, e.g. of a ``ThreadPool``.
+    """
+    report, stage = get_current()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with current_stage(report, stage):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+# Resource usage fields of which the maximum is reported instead of the sum.
+MAX_RUSAGE_FIELDS = ('max_rss',)
+
+
+def add_rusage(total, rusage):
+    """
+    Add the resource usage ``rusage`` of a subprocess to ``total``.
+    """
+    for field, value in rusage.items():
+        if field in MAX_RUSAGE_FIELDS:
+            total[field] = max(total.get(field, 0), value)
+        else:
+            total[field] = total.get(field, 0) + value
+    return total
+
+
+def sum_rusage(rusages):
+    total = {}
+    for rusage in rusages:
+        if rusage is not None:
+            add_rusage(total, rusage)
+    return total
+
+
+def record_subprocess(args, label, started, finished, exit_code,
+                      rusage=None, output_tail=None):
+    """
+    Record a finished subprocess in the current stage. Returns the record,
+    or ``None`` if no stage is running.
+    """
+    stage = get_current_stage()
+    if stage is None:
+        return None
+    record = {
+        'label': label,
+        'args': list(args),
+        'started': started,
+        'finished': finished,
+        'duration': finished - started,
+        'exit_code': exit_code,
+        'rusage': rusage,
+    }
+    if output_tail is not None:
+        record['output_tail'] = output_tail
+    stage['subprocesses'].append(record)
+    return record
+
+
+def record_samples(label, started, samples):
+    """
+    Record the resource ``samples`` of a subprocess in the current report.
+    """
+    report, stage = get_current()
+    if report is None:
+        return
+    with report.lock:
+        report.series.append({
+            'stage': stage['name'],
+            'label': label,
+            'started': started,
+            'samples': samples,
+        })
+
+
+def get_exit_code(stage):
+    """
+    Exit code of a failed stage: the one of its last failed subprocess, or
+    1 if the failure was no subprocess.
+    """
+    for record in reversed(stage['subprocesses']):
+        if record['exit_code']:
+            return record['exit_code']
+    return 1
+
+
+class TimingReport(object):
+    """
+    Timings of the stages of the build ``name``. Stages may run at the same
+    time in different threads. Subprocesses are sampled every
+    ``sample_interval`` seconds if it is given, and their output is
+    captured in ``log`` if it is given.
+
+    ``venv_pool`` is ``'hit'`` or ``'miss'`` if the build tried to lease its
+    virtualenv from the pool.
+    """
+
+    def __init__(self, name, sample_interval=None, log=None):
+        self.name = name
+        self.sample_interval = sample_interval
+        self.log = log
+        self.venv_pool = None
+        self.stages = []
+        self.series = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Record the stage ``name`` while the ``with`` block runs.
+        """
+        stage = {
+            'name': name,
+            'started': time.time(),
+            'finished': None,
+            'duration': None,
+            'exit_code': None,
+            'rusage': {},
+            'subprocesses': [],
+        }
+        with self.lock:
+            self.stages.append(stage)
+        try:
+            with current_stage(self, stage):
+                yield stage
+        except Exception:
+            stage['exit_code'] = get_exit_code(stage)
+            raise
+        else:
+            stage['exit_code'] = 0
+        finally:
+            stage['finished'] = time.time()
+            stage['duration'] = stage['finished'] - stage['started']
+            stage['rusage'] = sum_rusage(
+                record['rusage'] for record in stage['subprocesses'])
+
+    def timed(self, name, function):
+        """
+        Wrap ``function`` to run as the stage ``name``.
+        """
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def as_dict(self):
+        with self.lock:
+            stages = sorted(self.stages, key=lambda stage: stage['started'])
+        finished = [stage['finished'] for stage in stages
+                    if stage['finished'] is not None]
+        report = {
+            'name': self.name,
+            'started': stages[0]['started'] if stages else None,
+            'finished': max(finished) if finished else None,
+            'duration': None,
+            'exit_code': 0,
+            'rusage': sum_rusage(stage['rusage'] for stage in stages),
+            'venv_pool': self.venv_pool,
+            'stages': stages,
+        }
+        if report['started'] is not None and report['finished'] is not None:
+            report['duration'] = report['finished'] - report['started']
+        for stage in stages:
+            if stage['exit_code']:
+                report['exit_code'] = stage['exit_code']
+                break
+        return report
+
+    def get_timeline(self):
+        """
+        Return the resource samples of all subprocesses, see
+        :mod:`~readthedocs_build.builder.sampler`.
+        """
+        with self.lock:
+            series = sorted(self.series, key=lambda entry: entry['started'])
+        return {
+            'name': self.name,
+            'interval': self.sample_interval,
+            'fields': list(FIELDS),
+            'series': series,
+        }
+
+
+def format_exit_code(exit_code):
+    return '-' if exit_code is None else exit_code
+
+
+def format_cpu_time(rusage):
+    return '{:.2f}'.format(
+        rusage.get('user_time', 0) + rusage.get('system_time', 0))
+
+
+def format_max_rss(rusage):
+    return '{:.1f}'.format(rusage.get('max_rss', 0) / 1024.0)
+
+
+def format_reports(reports):
+    """
+    Return the lines of a table summarizing the timing ``reports``. CPU time
+    is in seconds and the maximum resident set size in megabytes. The hits
+    and misses of the virtualenv pool follow the table.
+    """
+    row = (u'{config:<16} {stage:<20} {seconds:>9} {exit:>5} '
+           u'{processes:>10} {cpu:>9} {rss:>9}')
+    lines = [row.format(
+        config='config',
+        stage='stage',
+        seconds='seconds',
+        exit='exit',
+        processes='processes',
+        cpu='cpu',
+        rss='max_rss')]
+    for report in reports:
+        for stage in report['stages']:
+            rusage = stage.get('rusage') or {}
+            lines.append(row.format(
+                config=report['name'],
+                stage=stage['name'],
+                seconds='{:.2f}'.format(stage['duration'] or 0),
+                exit=format_exit_code(stage['exit_code']),
+                processes=len(stage['subprocesses']),
+                cpu=format_cpu_time(rusage),
+                rss=format_max_rss(rusage)))
+        rusage = report.get('rusage') or {}
+        lines.append(row.format(
+            config=report['name'],
+            stage='total',
+            seconds='{:.2f}'.format(report['duration'] or 0),
+            exit=format_exit_code(report['exit_code']),
+            processes=sum(
+                len(stage['subprocesses']) for stage in report['stages']),
+            cpu=format_cpu_time(rusage),
+            rss=format_max_rss(rusage)))
+    venv_pool = [report.get('venv_pool') for report in reports]
+    if any(venv_pool):
+        lines.append(u'virtualenv pool: {hits} hits, {misses} misses'.format(
+            hits=venv_pool.count('hit'), misses=venv_pool.count('miss')))
+    return lines
@@ -0,0 +1,91 @@
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+
+from six.moves import queue
+
+from .utils import get_new_session_options
+
+
+class Trash(object):
+    """
+    Directory that discarded virtualenvs are moved into.
+
+    Discarding is a single rename, the actual deletion happens on a
+    background thread with the lowest I/O and CPU priority. Deletions run in
+    separate processes, so they finish even if the build process exits
+    first. Leftovers from crashed builds are removed when the trash is
+    created.
+
+    The trash must be on the same filesystem as the discarded directories,
+    otherwise they are deleted in place in the background.
+    """
+
+    delete_command = ('ionice', '-c2', '-n7', 'nice', '-n19', 'rm', '-rf')
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self.delete_worker)
+        self.worker.daemon = True
+        self.worker.start()
+        self.sweep()
+
+    def discard(self, path):
+        """
+        Move ``path`` out of the way and schedule its deletion.
+        """
+        trash_path = os.path.join(self.path, uuid.uuid4().hex)
+        try:
+            os.rename(path, trash_path)
+        except OSError:
+            trash_path = path
+        self.queue.put(trash_path)
+
+    def sweep(self):
+        for filename in os.listdir(self.path):
+            self.queue.put(os.path.join(self.path, filename))
+
+    def delete(self, path):
+        try:
+            process = subprocess.Popen(
+                list(self.delete_command) + [path],
+                **get_new_session_options())
+        except OSError:
+            # ionice or nice are not available.
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        process.wait()
+
+    def delete_worker(self):
+        while True:
+            path = self.queue.get()
+            try:
+                self.delete(path)
+            finally:
+                self.queue.task_done()
+
+    def wait(self):
+        """
+        Block until all scheduled deletions are done.
+        """
+        self.queue.join()
+
+
+_trashes = {}
+_trashes_lock = threading.Lock()
+
+
+def get_trash(path):
+    """
+    Return the shared trash for ``path``. It is created on first use.
+    """
+    path = os.path.abspath(path)
+    with _trashes_lock:
+        if path not in _trashes:
+            _trashes[path] = Trash(path)
+        return _trashes[path]
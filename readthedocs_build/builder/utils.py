@@ -1,6 +1,159 @@
+import errno
+import os
 import subprocess
+import sys
+import time
 
+import six
 
-def run(args):
-    popen = subprocess.Popen(args)
-    return popen.wait()
+from .sampler import Sampler
+from .timing import get_build_log
+from .timing import get_sample_interval
+from .timing import record_samples
+from .timing import record_subprocess
+
+
+# ``ru_maxrss`` is in bytes on macOS and in kilobytes everywhere else.
+MAX_RSS_UNIT = 1024 if sys.platform == 'darwin' else 1
+
+
+def get_label(args):
+    return os.path.basename(args[0])
+
+
+def get_new_session_options():
+    """
+    Return the ``Popen`` keyword arguments that start the subprocess in a
+    new session, so it survives the exit of our process group.
+    ``preexec_fn`` is not safe while other threads run, it is only used on
+    Python 2, which lacks ``start_new_session``.
+    """
+    if six.PY2:
+        return {'preexec_fn': os.setsid}
+    return {'start_new_session': True}
+
+
+def get_rusage(usage):
+    """
+    Return the interesting fields of a ``resource.struct_rusage`` as dict.
+    ``max_rss`` is in kilobytes.
+    """
+    return {
+        'user_time': usage.ru_utime,
+        'system_time': usage.ru_stime,
+        'max_rss': usage.ru_maxrss // MAX_RSS_UNIT,
+        'block_input': usage.ru_inblock,
+        'block_output': usage.ru_oublock,
+        'voluntary_context_switches': usage.ru_nvcsw,
+        'involuntary_context_switches': usage.ru_nivcsw,
+    }
+
+
+def wait(popen):
+    """
+    Wait for ``popen`` and return its exit code and resource usage. The
+    usage is ``None`` if the platform has no ``os.wait4``.
+    """
+    if not hasattr(os, 'wait4'):
+        return popen.wait(), None
+    while True:
+        try:
+            pid, status, usage = os.wait4(popen.pid, 0)
+            break
+        except OSError as error:
+            if error.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        exit_code = -os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+    # The child is reaped, Popen must not wait for it again.
+    popen.returncode = exit_code
+    return exit_code, get_rusage(usage)
+
+
+def start_sampler(popen, started):
+    interval = get_sample_interval()
+    if not interval:
+        return None
+    sampler = Sampler(popen.pid, interval, started=started)
+    sampler.start()
+    return sampler
+
+
+def report_failure(label, exit_code, output_tail):
+    message = u'{label} failed with exit code {exit_code}:\n{output}\n'
+    message = message.format(
+        label=label, exit_code=exit_code, output=output_tail)
+    if six.PY2:
+        message = message.encode('utf-8')
+    sys.stderr.write(message)
+
+
+def run(args, cwd=None, env=None, label=None, report=True):
+    """
+    Run ``args`` and return its exit code. The subprocess is recorded in the
+    timings of the current stage as ``label``, by default the name of the
+    executable, together with its resource usage. If the current timing
+    report has a sample interval, the usage is also sampled while the
+    subprocess runs.
+
+    If the current timing report has a log, the output of the subprocess is
+    captured in it instead of going to our stdout and stderr. If the
+    subprocess fails, the end of its output is recorded and, if ``report``
+    is true, written to stderr.
+    """
+    label = label or get_label(args)
+    log = get_build_log()
+    started = time.time()
+    if log is None:
+        popen = subprocess.Popen(args, cwd=cwd, env=env)
+    else:
+        popen = subprocess.Popen(
+            args, cwd=cwd, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    sampler = start_sampler(popen, started)
+    output_tail = None
+    try:
+        if log is not None:
+            output_tail = log.capture(popen, label)
+        exit_code, rusage = wait(popen)
+    finally:
+        if sampler is not None:
+            record_samples(label, started, sampler.stop())
+    if exit_code != 0 and output_tail is not None:
+        output_tail = output_tail.decode('utf-8', 'replace')
+        if report:
+            report_failure(label, exit_code, output_tail)
+    else:
+        output_tail = None
+    record_subprocess(
+        args, label, started, time.time(), exit_code, rusage=rusage,
+        output_tail=output_tail)
+    return exit_code
+
+
+def run_output(args, label=None):
+    """
+    Run ``args`` and return its stdout. Raises ``CalledProcessError`` if the
+    command fails.
+    """
+    started = time.time()
+    popen = subprocess.Popen(args, stdout=subprocess.PIPE)
+    with popen.stdout:
+        output = popen.stdout.read()
+    exit_code, rusage = wait(popen)
+    record_subprocess(
+        args, label or get_label(args), started, time.time(), exit_code,
+        rusage=rusage)
+    if exit_code != 0:
+        raise subprocess.CalledProcessError(exit_code, args, output=output)
+    return output.decode('utf-8')
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno != errno.ESRCH
+    return True
@@ -1,40 +1,134 @@
+import glob
 import os
 import shutil
+import stat
 import tempfile
 
 from .utils import run
+from .utils import run_output
 
 
 class VirtualEnv(object):
     """
     Light abstraction of a virtualenv.
+
+    By default a fresh virtualenv is created in a temporary directory and
+    removed on ``cleanup``. If ``base_path`` points to an existing virtualenv,
+    it is reused instead. ``persistent`` virtualenvs are never removed.
+
+    If a ``pool`` is given, a pre-warmed virtualenv is leased from it when
+    possible. It is given back to the pool on ``cleanup`` if nothing was
+    installed into it, and discarded otherwise.
+
+    If a ``wheelhouse`` is given, packages are installed from it first.
+
+    A ``base_layer`` is another virtualenv whose packages and executables are
+    made available in this one through a ``.pth`` file. It adds the base
+    layer as site directory, so the ``.pth`` files of the base layer are
+    processed as well. Only packages that
+    are missing from the base layer get installed into this virtualenv.
+
+    If a ``trash`` is given, ``cleanup`` moves the virtualenv into it instead
+    of deleting it right away.
     """
 
-    def __init__(self, python_config=None):
-        self.base_path = tempfile.mkdtemp()
+    base_layer_pth = '_rtd_base_layer.pth'
+
+    persistent = False
+    pool = None
+    base_layer = None
+    trash = None
 
+    def __init__(self, python_config=None, base_path=None, persistent=False,
+                 pool=None, wheelhouse=None, base_layer=None, trash=None):
         if python_config is None:
             python_config = {}
+        self.trash = trash
+        self.wheelhouse = wheelhouse
+        self.base_layer = base_layer
+
+        self.provided_dependencies = ()
+        self.modified = False
+        if base_path is None and pool is not None:
+            base_path = pool.lease(python_config)
+            if base_path is not None:
+                self.pool = pool
+                self.provided_dependencies = pool.dependencies
+        if base_path is None:
+            base_path = tempfile.mkdtemp()
+        self.base_path = base_path
+        self.persistent = persistent
         self.system_site_packages = python_config.get('use_system_site_packages', False)
         self.python_version = python_config.get('version', '2.7')
 
-        self.setup()
+        if not self.exists():
+            self.setup()
+        if base_layer is not None:
+            self.provided_dependencies = base_layer.provided_dependencies
+            self.link_base_layer()
 
-    def python_run(self, command_bin, args):
+    def exists(self):
+        return os.path.exists(os.path.join(self.base_path, 'bin', 'python'))
+
+    def get_site_packages(self):
+        paths = glob.glob(
+            os.path.join(self.base_path, 'lib', 'python*', 'site-packages'))
+        assert paths, 'no site-packages in {}'.format(self.base_path)
+        return paths[0]
+
+    def link_base_layer(self):
+        pth_path = os.path.join(self.get_site_packages(), self.base_layer_pth)
+        with open(pth_path, 'w') as f:
+            f.write('import site; site.addsitedir({!r})\n'.format(
+                self.base_layer.get_site_packages()))
+
+    def compile(self):
+        """
+        Byte-compile all installed packages.
+        """
+        python_bin = os.path.join(self.base_path, 'bin', 'python')
+        return run([
+            python_bin, '-m', 'compileall', '-q', self.get_site_packages()],
+            label='compileall')
+
+    def make_read_only(self):
+        """
+        Remove the write permission from all files in the virtualenv.
+        Directories stay writable so the virtualenv can still be removed.
+        """
+        write_bits = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+        for root, dirs, files in os.walk(self.base_path):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if os.path.islink(path):
+                    continue
+                mode = os.stat(path).st_mode
+                os.chmod(path, mode & ~write_bits)
+
+    def python_run(self, command_bin, args, report=True):
         """
         Execute a script from the virtualenv by using the bin/python from the
         virtualenv. That prevents an issue with too long shbangs. See
         https://github.com/rtfd/readthedocs.org/issues/994 for details.
 
         ``command_bin`` can be the name of an executable installed in the
-        virtualenv or an absolute path to a python script.
+        virtualenv or an absolute path to a python script. A failure is only
+        written to stderr if ``report`` is true, see
+        :func:`~readthedocs_build.builder.utils.run`.
         """
         python_bin = os.path.join(self.base_path, 'bin', 'python')
-        command_bin = os.path.join(self.base_path, 'bin', command_bin)
+        if os.path.isabs(command_bin):
+            # Scripts from outside, like setup.py, might change the
+            # virtualenv.
+            self.modified = True
+        command_path = os.path.join(self.base_path, 'bin', command_bin)
+        if self.base_layer is not None and not os.path.exists(command_path):
+            command_path = os.path.join(
+                self.base_layer.base_path, 'bin', command_bin)
         return run([
             python_bin,
-            command_bin,
-        ] + list(args))
+            command_path,
+        ] + list(args), label=os.path.basename(command_bin), report=report)
 
     def setup(self):
         params = [
@@ -49,12 +143,62 @@ class VirtualEnv(object):
         assert exit_code == 0, 'virtualenv setup failed'
 
     def cleanup(self):
+        if self.persistent:
+            return
+        if self.pool is not None:
+            pool = self.pool
+            self.pool = None
+            pool.release(self.base_path, reuse=not self.modified)
+            return
         if os.path.exists(self.base_path):
-            shutil.rmtree(self.base_path)
+            if self.trash is not None:
+                self.trash.discard(self.base_path)
+            else:
+                shutil.rmtree(self.base_path)
 
     def __del__(self):
         self.cleanup()
 
+    def pip_install(self, args):
+        if self.wheelhouse is not None:
+            return self.wheelhouse.install(
+                lambda pip_args, report=True: self.python_run(
+                    'pip', pip_args, report=report),
+                args)
+        return self.python_run('pip', ['install'] + list(args))
+
+    def freeze(self):
+        """
+        Return a sorted list of all installed packages with their versions.
+        """
+        python_bin = os.path.join(self.base_path, 'bin', 'python')
+        output = run_output(
+            [python_bin, '-m', 'pip', 'freeze', '--all'], label='pip')
+        return sorted(line for line in output.splitlines() if line.strip())
+
     def install(self, package):
-        exit_code = self.python_run('pip', ['install', package])
+        self.modified = True
+        exit_code = self.pip_install([package])
+        assert exit_code == 0
+
+    def install_all(self, packages=(), requirements_files=(),
+                    project_path=None, extras=()):
+        """
+        Install ``packages``, all ``requirements_files`` and the project in
+        ``project_path`` with its ``extras`` with a single pip call. That way
+        pip resolves all requirements only once.
+        """
+        args = list(packages)
+        for requirements_file in requirements_files:
+            args.append('-r{}'.format(requirements_file))
+        if project_path is not None:
+            if extras:
+                project_path = '{path}[{extras}]'.format(
+                    path=project_path,
+                    extras=','.join(extras))
+            args.append(project_path)
+        if not args:
+            return
+        self.modified = True
+        exit_code = self.pip_install(args)
         assert exit_code == 0
@@ -0,0 +1,139 @@
+import os
+import sys
+
+from .requirements import is_named_requirement
+from .requirements import iter_requirements
+from .utils import run
+
+
+def get_wheel_requirements(args):
+    """
+    Return the pip arguments that build wheels for the requirements in
+    ``args``, and whether they cover all of them.
+
+    Only requirements that are installed from the package index by name get
+    wheels, also the ones in included requirements files. Wheels of local
+    projects, URLs or version control checkouts must not end up in the
+    shared wheelhouse, other builds would install them instead of the
+    released packages of the same name. If the requirements change where
+    pip finds packages, no wheels are built at all.
+    """
+    wheel_args = []
+    complete = True
+    for kind, value in iter_requirements(args):
+        if kind in ('index_option', 'unreadable'):
+            return [], False
+        if kind == 'constraints_file':
+            wheel_args += ['-c', value]
+        elif kind == 'requirement' and is_named_requirement(value):
+            wheel_args.append(value)
+        elif kind in ('requirement', 'editable'):
+            complete = False
+    return wheel_args, complete
+
+
+class Wheelhouse(object):
+    """
+    Local directory of wheels shared by all builds.
+
+    pip first tries to install everything from the wheelhouse without
+    touching the package index. Only if that fails, the missing wheels are
+    built (or downloaded) into the wheelhouse and the install is retried from
+    there. Wheels are only built for requirements given by name, everything
+    else is installed from its source with the package index in the retry.
+    In ``offline`` mode the package index is never used.
+
+    The least recently used wheels are removed when the wheelhouse grows over
+    ``max_size`` bytes.
+    """
+
+    def __init__(self, path, max_size=None, offline=False):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.offline = offline
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def get_install_args(self, index=False):
+        args = ['install', '--disable-pip-version-check']
+        if not index:
+            args.append('--no-index')
+        args.append('--find-links={}'.format(self.path))
+        return args
+
+    def get_wheel_args(self):
+        return [
+            'wheel',
+            '--disable-pip-version-check',
+            '--wheel-dir={}'.format(self.path),
+            '--find-links={}'.format(self.path),
+        ]
+
+    def install(self, pip_run, args):
+        """
+        Install ``args`` with ``pip_run``, which is called with the arguments
+        for pip and returns its exit code. It takes a ``report`` keyword
+        argument that is false for pip runs that are expected to fail.
+        """
+        if self.offline:
+            return pip_run(self.get_install_args() + list(args))
+        # Missing wheels are built below, the failure is no error.
+        exit_code = pip_run(self.get_install_args() + list(args), report=False)
+        if exit_code == 0:
+            return exit_code
+        wheel_args, complete = get_wheel_requirements(args)
+        if any(not arg.startswith('-') for arg in wheel_args):
+            exit_code = pip_run(self.get_wheel_args() + wheel_args)
+            if exit_code != 0:
+                return exit_code
+        # Requirements without wheels are installed from their source.
+        exit_code = pip_run(
+            self.get_install_args(index=not complete) + list(args))
+        self.evict()
+        return exit_code
+
+    def fill(self, args, python=None):
+        """
+        Put wheels for ``args`` into the wheelhouse, using pip from the
+        ``python`` interpreter.
+        """
+        if python is None:
+            python = sys.executable
+        exit_code = run([python, '-m', 'pip'] + self.get_wheel_args() +
+                        list(args))
+        self.evict()
+        return exit_code
+
+    def get_wheels(self):
+        """
+        Return a list of ``(last_used, size, filename)`` tuples, least
+        recently used first.
+        """
+        wheels = []
+        for filename in os.listdir(self.path):
+            if not filename.endswith('.whl'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, filename))
+            except OSError:
+                continue
+            last_used = max(stat.st_atime, stat.st_mtime)
+            wheels.append((last_used, stat.st_size, filename))
+        return sorted(wheels)
+
+    def get_size(self):
+        return sum(size for last_used, size, filename in self.get_wheels())
+
+    def evict(self):
+        if self.max_size is None:
+            return
+        wheels = self.get_wheels()
+        total_size = sum(size for last_used, size, filename in wheels)
+        for last_used, size, filename in wheels:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                continue
+            total_size -= size
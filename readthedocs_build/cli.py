@@ -1,14 +1,47 @@
 import click
+import json
 import os
+import re
 import sys
 
 from .build import build
+from .builder import builder_types
+from .builder.pool import VirtualEnvPool
+from .builder.sampler import format_timeline
+from .builder.timing import format_reports
+from .builder.wheelhouse import Wheelhouse
 from .config import load
+from .config import BuildConfig
 from .config import ConfigError
+from .search.global_index import GlobalIndex
+from .search.global_index import find_projects
 from .utils import cd
 
 
-@click.command()
+class DefaultGroup(click.Group):
+    """
+    Group of commands that runs the ``build`` command if no other command is
+    given. That keeps ``rtd-build [PATH]`` working.
+    """
+
+    default_command = 'build'
+
+    def parse_args(self, ctx, args):
+        if not args or args[0] not in self.commands:
+            if not args or args[0] not in ('--help', '-h'):
+                args = [self.default_command] + list(args)
+        return super(DefaultGroup, self).parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup)
+def main():
+    """
+    Build the documentation of a project. ``rtd-build [PATH]`` is the same as
+    ``rtd-build build [PATH]``.
+    """
+
+
+@main.command('build')
 @click.argument('path',
                 required=False,
                 type=click.Path(exists=True, file_okay=False, readable=True),
@@ -17,7 +50,111 @@ from .utils import cd
               type=click.Path(file_okay=False, writable=True),
               default='_readthedocs_build',
               help='build output directory')
-def main(path, outdir):
+@click.option('--jobs', '-j',
+              type=click.IntRange(min=1),
+              default=1,
+              help='number of build configs to build in parallel')
+@click.option('--stages',
+              is_flag=True,
+              help='schedule the setup, format and search stages of all '
+                   'build configs as one dependency graph')
+@click.option('--io-jobs',
+              type=click.IntRange(min=1),
+              default=None,
+              help='number of I/O bound stages to run in parallel with '
+                   '--stages, defaults to --jobs')
+@click.option('--timings',
+              is_flag=True,
+              help='print how long each stage of the builds took')
+@click.option('--resource-sampler',
+              type=click.FloatRange(min=0.01),
+              default=None,
+              metavar='SECONDS',
+              help='sample memory, CPU and I/O of all build processes in '
+                   'this interval, see the resources command')
+@click.option('--capture-logs',
+              is_flag=True,
+              help='write the output of all build processes with timestamps '
+                   'to build.log.gz in the output directory')
+@click.option('--log-tail',
+              type=click.IntRange(min=1),
+              default=64,
+              metavar='KB',
+              help='with --capture-logs, how much of the output of a failed '
+                   'process to report')
+@click.option('--format-concurrency',
+              type=click.IntRange(min=1),
+              default=1,
+              help='number of output formats to build at the same time')
+@click.option('--venv-cache',
+              type=click.Path(file_okay=False, writable=True),
+              default=None,
+              help='reuse virtualenvs from this cache directory')
+@click.option('--venv-pool',
+              type=click.Path(file_okay=False, writable=True),
+              default=None,
+              help='lease pre-warmed virtualenvs from this pool directory')
+@click.option('--venv-layers',
+              type=click.Path(file_okay=False, writable=True),
+              default=None,
+              help='share builder dependencies from base layers in this '
+                   'directory')
+@click.option('--doctree-cache',
+              type=click.Path(file_okay=False, writable=True),
+              default=None,
+              help='keep Sphinx doctrees in this directory between builds')
+@click.option('--latex-cache',
+              type=click.Path(file_okay=False, writable=True),
+              default=None,
+              help='keep LaTeX auxiliary files and font caches in this '
+                   'directory between builds')
+@click.option('--sphinx-worker',
+              is_flag=True,
+              help='run all Sphinx builds in one long-lived process')
+@click.option('--sphinx-max-jobs',
+              type=click.IntRange(min=1),
+              default=None,
+              help='maximum number of parallel Sphinx processes per build')
+@click.option('--search-index',
+              is_flag=True,
+              help='also write the search data as inverted index')
+@click.option('--search-shards',
+              is_flag=True,
+              help='split searchindex.js into shards loaded on demand')
+@click.option('--search-export',
+              default=None,
+              help='export the search records as bulk NDJSON files into '
+                   'this directory, or post them to this http(s) URL')
+@click.option('--search-export-gzip',
+              is_flag=True,
+              help='compress the exported bulk files with gzip')
+@click.option('--search-state',
+              type=click.Path(file_okay=False, writable=True),
+              default=None,
+              help='keep the search manifests of all projects in this '
+                   'directory to report changed pages')
+@click.option('--trash',
+              type=click.Path(file_okay=False, writable=True),
+              default=None,
+              help='move virtualenvs into this directory and delete them in '
+                   'the background')
+@click.option('--batch-install',
+              is_flag=True,
+              help='install all dependencies with a single pip call')
+@click.option('--wheelhouse',
+              type=click.Path(file_okay=False, writable=True),
+              default=None,
+              help='install packages from this wheelhouse directory first')
+@click.option('--offline',
+              is_flag=True,
+              help='never use the package index, requires --wheelhouse')
+def build_command(path, outdir, jobs, stages, io_jobs, timings,
+                  resource_sampler, capture_logs, log_tail,
+                  format_concurrency, venv_cache, venv_pool, venv_layers,
+                  doctree_cache, latex_cache, sphinx_worker, sphinx_max_jobs,
+                  search_index, search_shards, search_export,
+                  search_export_gzip, search_state, trash, batch_install,
+                  wheelhouse, offline):
     """
     Exit codes:
 
@@ -30,7 +167,40 @@ def main(path, outdir):
 
     env_config = {
         'output_base': outdir,
+        'batch_install': batch_install,
+        'format_concurrency': format_concurrency,
+        'sphinx_worker': sphinx_worker,
+        'search_index': search_index,
+        'search_shards': search_shards,
     }
+    if venv_cache is not None:
+        env_config['venv_cache'] = {'path': venv_cache}
+    if venv_pool is not None:
+        env_config['venv_pool'] = {'path': venv_pool}
+    if venv_layers is not None:
+        env_config['venv_layers'] = {'path': venv_layers}
+    if doctree_cache is not None:
+        env_config['doctree_cache'] = {'path': doctree_cache}
+    if latex_cache is not None:
+        env_config['latex_cache'] = {'path': latex_cache}
+    if sphinx_max_jobs is not None:
+        env_config['sphinx_max_jobs'] = sphinx_max_jobs
+    if search_export is not None:
+        key = 'url' if re.match(r'https?://', search_export) else 'path'
+        env_config['search_export'] = {
+            key: search_export,
+            'compress': search_export_gzip,
+        }
+    if search_state is not None:
+        env_config['search_state'] = {'path': search_state}
+    if resource_sampler is not None:
+        env_config['resource_sampler'] = {'interval': resource_sampler}
+    if capture_logs:
+        env_config['log_capture'] = {'tail_size': log_tail * 1024}
+    if trash is not None:
+        env_config['trash'] = {'path': trash}
+    if wheelhouse is not None:
+        env_config['wheelhouse'] = {'path': wheelhouse, 'offline': offline}
 
     with cd(path):
         try:
@@ -38,4 +208,167 @@ def main(path, outdir):
         except ConfigError as error:
             sys.stderr.write('Error: {error}'.format(error=error))
             sys.exit(1)
-        build(project_config)
+        reports = build(
+            project_config, jobs=jobs, io_jobs=io_jobs, stages=stages)
+    if timings:
+        for line in format_reports(reports):
+            click.echo(line)
+
+
+@main.command('wheelhouse')
+@click.argument('path',
+                type=click.Path(file_okay=False, writable=True))
+@click.argument('packages', nargs=-1)
+@click.option('-r', '--requirement',
+              multiple=True,
+              type=click.Path(exists=True, dir_okay=False, readable=True),
+              help='also add the packages from this requirements file')
+@click.option('--python',
+              default=None,
+              help='python interpreter to build the wheels with')
+@click.option('--max-size',
+              type=int,
+              default=None,
+              help='maximum size of the wheelhouse in MB')
+def wheelhouse_command(path, packages, requirement, python, max_size):
+    """
+    Prefill the wheelhouse in PATH with wheels for PACKAGES and list its
+    content.
+
+    Exit codes:
+
+        0 -- success
+        1 -- building the wheels failed
+    """
+    if max_size is not None:
+        max_size = max_size * 1024 * 1024
+    wheelhouse = Wheelhouse(path, max_size=max_size)
+    args = list(packages)
+    for requirements_file in requirement:
+        args.append('-r{}'.format(requirements_file))
+    if args and wheelhouse.fill(args, python=python) != 0:
+        sys.stderr.write('Error: building wheels failed')
+        sys.exit(1)
+
+    for last_used, size, filename in reversed(wheelhouse.get_wheels()):
+        click.echo('{size:>10} {filename}'.format(
+            size=size, filename=filename))
+    click.echo('{count} wheels, {size} bytes'.format(
+        count=len(wheelhouse.get_wheels()),
+        size=wheelhouse.get_size()))
+
+
+@main.group('pool')
+def pool_group():
+    """
+    Manage the pool of pre-warmed virtualenvs used by ``--venv-pool``.
+    """
+
+
+@pool_group.command('fill')
+@click.argument('path',
+                type=click.Path(file_okay=False, writable=True))
+@click.option('--type', 'builder_type',
+              type=click.Choice(sorted(builder_types)),
+              default='sphinx',
+              help='builder whose dependencies are installed')
+@click.option('--version', 'versions',
+              multiple=True,
+              help='python version of the virtualenvs, can be given more '
+                   'than once, defaults to all supported versions')
+@click.option('--size',
+              type=click.IntRange(min=0),
+              default=2,
+              help='number of ready virtualenvs per python version')
+@click.option('--wheelhouse',
+              type=click.Path(file_okay=False, writable=True),
+              default=None,
+              help='install packages from this wheelhouse directory first')
+@click.option('--offline',
+              is_flag=True,
+              help='never use the package index, requires --wheelhouse')
+def pool_fill_command(path, builder_type, versions, size, wheelhouse,
+                      offline):
+    """
+    Create virtualenvs in the pool in PATH until every python version has
+    SIZE ready ones, and list how many are ready. Builds start this in the
+    background when they are done.
+    """
+    if wheelhouse is not None:
+        wheelhouse = Wheelhouse(wheelhouse, offline=offline)
+    pool = VirtualEnvPool(
+        path,
+        versions=versions or BuildConfig.PYTHON_SUPPORTED_VERSIONS,
+        dependencies=builder_types[builder_type].python_dependencies,
+        size=size,
+        wheelhouse=wheelhouse)
+    if not pool.fill():
+        click.echo('the pool is being filled by another process')
+    ready = pool.get_stats()['ready']
+    for version in sorted(ready):
+        click.echo('{version}: {count} ready'.format(
+            version=version, count=ready[version]))
+
+
+@main.command('search-merge')
+@click.argument('path',
+                type=click.Path(file_okay=False, writable=True))
+@click.argument('output_bases',
+                nargs=-1,
+                required=True,
+                type=click.Path(exists=True, file_okay=False, readable=True))
+@click.option('--remove',
+              multiple=True,
+              help='remove this project from the index')
+@click.option('--max-segments',
+              type=click.IntRange(min=1),
+              default=8,
+              help='compact the index once it has more segments')
+def search_merge_command(path, output_bases, remove, max_segments):
+    """
+    Add the search data of all projects in OUTPUT_BASES to the global search
+    index in PATH. Only new and changed projects are indexed.
+    """
+    index = GlobalIndex(path, max_segments=max_segments)
+    for project in remove:
+        index.remove_project(project)
+        click.echo('removed {}'.format(project))
+    for output_base in output_bases:
+        projects = find_projects(output_base)
+        for project in sorted(projects):
+            if index.add_project(project, projects[project]):
+                click.echo('indexed {}'.format(project))
+            else:
+                click.echo('unchanged {}'.format(project))
+    compaction = index.compact_in_background()
+    if compaction is not None:
+        compaction.join()
+        click.echo('compacted')
+
+
+@main.command('resources')
+@click.argument('outdir',
+                type=click.Path(exists=True, file_okay=False, readable=True),
+                default='_readthedocs_build')
+@click.option('--width',
+              type=click.IntRange(min=1),
+              default=40,
+              help='maximum width of the sparklines')
+def resources_command(outdir, width):
+    """
+    Show the peak memory and a memory sparkline per stage of all builds in
+    OUTDIR that were run with --resource-sampler.
+    """
+    for root, dirs, files in os.walk(outdir):
+        dirs.sort()
+        if 'resources.json' not in files:
+            continue
+        with open(os.path.join(root, 'resources.json')) as f:
+            timeline = json.load(f)
+        click.echo(timeline['name'])
+        for line in format_timeline(timeline, width=width):
+            click.echo(u'  ' + line)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ from .parser import ParseError
 from .parser import parse
 from .validation import (ValidationError, validate_bool, validate_choice,
                          validate_directory, validate_file, validate_list,
-                         validate_string)
+                         validate_positive_integer, validate_string)
 
 
 __all__ = (
@@ -26,6 +26,7 @@ NAME_INVALID = 'name-invalid'
 CONF_FILE_REQUIRED = 'conf-file-required'
 TYPE_REQUIRED = 'type-required'
 PYTHON_INVALID = 'python-invalid'
+SPHINX_INVALID = 'sphinx-invalid'
 
 DOCKER_DEFAULT_IMAGE = 'readthedocs/build'
 DOCKER_DEFAULT_VERSION = '2.0'
@@ -91,6 +92,7 @@ class BuildConfig(dict):
     PYTHON_INVALID_MESSAGE = '"python" section must be a mapping.'
     PYTHON_EXTRA_REQUIREMENTS_INVALID_MESSAGE = (
         '"python.extra_requirements" section must be a list.')
+    SPHINX_INVALID_MESSAGE = '"sphinx" section must be a mapping.'
 
     PYTHON_SUPPORTED_VERSIONS = [2, 2.7, 3, 3.5]
     DOCKER_SUPPORTED_VERSIONS = ['1.0', '2.0', 'latest']
@@ -158,15 +160,32 @@ class BuildConfig(dict):
 
         # Validate env_config.
         self.validate_output_base()
+        self.validate_venv_cache()
+        self.validate_batch_install()
+        self.validate_wheelhouse()
+        self.validate_venv_layers()
+        self.validate_trash()
+        self.validate_format_concurrency()
+        self.validate_doctree_cache()
+        self.validate_latex_cache()
+        self.validate_sphinx_worker()
+        self.validate_search_index()
+        self.validate_search_shards()
+        self.validate_search_export()
+        self.validate_search_state()
+        self.validate_resource_sampler()
+        self.validate_log_capture()
 
         # Validate the build environment first
         self.validate_build()  # Must happen before `validate_python`!
+        self.validate_venv_pool()
 
         # Validate raw_config. Order matters.
         self.validate_name()
         self.validate_type()
         self.validate_base()
         self.validate_python()
+        self.validate_sphinx()
         self.validate_formats()
 
         self.validate_conda()
@@ -183,6 +202,300 @@ class BuildConfig(dict):
             )
         )
 
+    def validate_venv_cache(self):
+        """
+        Operators can enable the persistent virtualenv cache by passing
+        something like this in the ``env_config``::
+
+            {
+                'venv_cache': {
+                    'path': '/var/cache/rtd-build/venvs',
+                    'max_size': 10 * 1024 ** 3,
+                    'max_entries': 50,
+                }
+            }
+        """
+        venv_cache = self.env_config.get('venv_cache')
+        if not venv_cache:
+            return None
+        assert 'path' in venv_cache, '"path" required in "venv_cache"'
+        venv_cache = dict(venv_cache)
+        venv_cache['path'] = os.path.abspath(venv_cache['path'])
+        self['venv_cache'] = venv_cache
+        return True
+
+    def validate_batch_install(self):
+        """
+        If ``batch_install`` is true in the ``env_config``, all dependencies
+        and the project are installed with a single pip call. The project is
+        then installed with pip even if ``python.setup_py_install`` is used.
+        """
+        self['batch_install'] = bool(self.env_config.get('batch_install'))
+
+    def validate_wheelhouse(self):
+        """
+        Operators can share a local wheelhouse between all builds by passing
+        something like this in the ``env_config``::
+
+            {
+                'wheelhouse': {
+                    'path': '/var/cache/rtd-build/wheels',
+                    'max_size': 5 * 1024 ** 3,
+                    'offline': False,
+                }
+            }
+        """
+        wheelhouse = self.env_config.get('wheelhouse')
+        if not wheelhouse:
+            return None
+        assert 'path' in wheelhouse, '"path" required in "wheelhouse"'
+        wheelhouse = dict(wheelhouse)
+        wheelhouse['path'] = os.path.abspath(wheelhouse['path'])
+        self['wheelhouse'] = wheelhouse
+        return True
+
+    def validate_venv_layers(self):
+        """
+        Operators can enable layered virtualenvs by passing something like
+        this in the ``env_config``::
+
+            {
+                'venv_layers': {
+                    'path': '/var/cache/rtd-build/layers',
+                    'max_entries': 10,
+                }
+            }
+
+        The builder dependencies are then installed once per python version
+        into a shared read-only base layer, and each build only installs the
+        project's own requirements on top of it.
+        """
+        venv_layers = self.env_config.get('venv_layers')
+        if not venv_layers:
+            return None
+        assert 'path' in venv_layers, '"path" required in "venv_layers"'
+        venv_layers = dict(venv_layers)
+        venv_layers['path'] = os.path.abspath(venv_layers['path'])
+        self['venv_layers'] = venv_layers
+        return True
+
+    def validate_trash(self):
+        """
+        Operators can let virtualenvs be deleted in the background by passing
+        something like this in the ``env_config``::
+
+            {
+                'trash': {
+                    'path': '/tmp/rtd-build-trash',
+                }
+            }
+
+        The path should be on the same filesystem as the virtualenvs.
+        """
+        trash = self.env_config.get('trash')
+        if not trash:
+            return None
+        assert 'path' in trash, '"path" required in "trash"'
+        trash = dict(trash)
+        trash['path'] = os.path.abspath(trash['path'])
+        self['trash'] = trash
+        return True
+
+    def validate_format_concurrency(self):
+        """
+        ``format_concurrency`` in the ``env_config`` is the number of output
+        formats that are built at the same time. Defaults to 1.
+        """
+        self['format_concurrency'] = max(
+            1, int(self.env_config.get('format_concurrency', 1)))
+
+    def validate_doctree_cache(self):
+        """
+        Operators can keep Sphinx's doctrees between builds of a project by
+        passing something like this in the ``env_config``::
+
+            {
+                'doctree_cache': {
+                    'path': '/var/cache/rtd-build/doctrees',
+                }
+            }
+        """
+        doctree_cache = self.env_config.get('doctree_cache')
+        if not doctree_cache:
+            return None
+        assert 'path' in doctree_cache, '"path" required in "doctree_cache"'
+        doctree_cache = dict(doctree_cache)
+        doctree_cache['path'] = os.path.abspath(doctree_cache['path'])
+        self['doctree_cache'] = doctree_cache
+        return True
+
+    def validate_latex_cache(self):
+        """
+        Operators can keep LaTeX's auxiliary files and font caches between
+        builds of a project by passing something like this in the
+        ``env_config``::
+
+            {
+                'latex_cache': {
+                    'path': '/var/cache/rtd-build/latex',
+                }
+            }
+        """
+        latex_cache = self.env_config.get('latex_cache')
+        if not latex_cache:
+            return None
+        assert 'path' in latex_cache, '"path" required in "latex_cache"'
+        latex_cache = dict(latex_cache)
+        latex_cache['path'] = os.path.abspath(latex_cache['path'])
+        self['latex_cache'] = latex_cache
+        return True
+
+    def validate_sphinx_worker(self):
+        """
+        If ``sphinx_worker`` is true in the ``env_config``, all Sphinx builds
+        of a build config run in one long-lived python process instead of a
+        ``sphinx-build`` process per format.
+        """
+        self['sphinx_worker'] = bool(self.env_config.get('sphinx_worker'))
+
+    def validate_search_index(self):
+        """
+        If ``search_index`` is true in the ``env_config``, the search data is
+        also written as memory-mappable inverted index.
+        """
+        self['search_index'] = bool(self.env_config.get('search_index'))
+
+    def validate_search_shards(self):
+        """
+        If ``search_shards`` is true in the ``env_config``, Sphinx's
+        ``searchindex.js`` is split into shards that the search page loads
+        on demand.
+        """
+        self['search_shards'] = bool(self.env_config.get('search_shards'))
+
+    def validate_search_export(self):
+        """
+        Operators can export the search records as bulk NDJSON files by
+        passing something like this in the ``env_config``::
+
+            {
+                'search_export': {
+                    'path': '/var/lib/rtd-build/search-export',
+                    'max_bytes': 10485760,
+                    'compress': True,
+                }
+            }
+
+        Instead of ``path``, a ``url`` of a bulk endpoint can be given to post
+        the files to.
+        """
+        search_export = self.env_config.get('search_export')
+        if not search_export:
+            return None
+        assert 'path' in search_export or 'url' in search_export, (
+            '"path" or "url" required in "search_export"')
+        search_export = dict(search_export)
+        if search_export.get('path'):
+            search_export['path'] = os.path.abspath(search_export['path'])
+        self['search_export'] = search_export
+        return True
+
+    def validate_search_state(self):
+        """
+        The search data contains a manifest of the content hashes of all
+        pages, and the pages that changed since the previous build. To compare
+        with the previous build even if the output directory is not kept,
+        operators can keep the manifests by passing something like this in
+        the ``env_config``::
+
+            {
+                'search_state': {
+                    'path': '/var/lib/rtd-build/search-state',
+                }
+            }
+        """
+        search_state = self.env_config.get('search_state')
+        if not search_state:
+            return None
+        assert 'path' in search_state, '"path" required in "search_state"'
+        search_state = dict(search_state)
+        search_state['path'] = os.path.abspath(search_state['path'])
+        self['search_state'] = search_state
+        return True
+
+    def validate_resource_sampler(self):
+        """
+        Operators can sample the memory, CPU and I/O of all build
+        subprocesses from ``/proc`` while they run by passing something like
+        this in the ``env_config``::
+
+            {
+                'resource_sampler': {
+                    'interval': 0.5,
+                }
+            }
+
+        ``interval`` is in seconds and defaults to 1. The samples are written
+        to ``resources.json`` in the output directory.
+        """
+        resource_sampler = self.env_config.get('resource_sampler')
+        if resource_sampler is None:
+            return None
+        interval = float(resource_sampler.get('interval', 1))
+        assert interval > 0, (
+            '"interval" of "resource_sampler" must be positive')
+        self['resource_sampler'] = {'interval': interval}
+        return True
+
+    def validate_log_capture(self):
+        """
+        Operators can capture the output of all build subprocesses in a gzip
+        compressed ``build.log.gz`` in the output directory, instead of
+        letting them write to stdout, by passing something like this in the
+        ``env_config``::
+
+            {
+                'log_capture': {
+                    'tail_size': 65536,
+                }
+            }
+
+        The last ``tail_size`` bytes of the output of every subprocess are
+        kept to report them if it fails. Defaults to 64 KB.
+        """
+        log_capture = self.env_config.get('log_capture')
+        if log_capture is None:
+            return None
+        tail_size = int(log_capture.get('tail_size', 64 * 1024))
+        assert tail_size > 0, '"tail_size" of "log_capture" must be positive'
+        self['log_capture'] = {'tail_size': tail_size}
+        return True
+
+    def validate_venv_pool(self):
+        """
+        Operators can keep pre-warmed virtualenvs for all python versions
+        supported by the build image by passing something like this in the
+        ``env_config``::
+
+            {
+                'venv_pool': {
+                    'path': '/var/cache/rtd-build/pool',
+                    'size': 2,
+                }
+            }
+
+        Must be called after ``validate_build``.
+        """
+        venv_pool = self.env_config.get('venv_pool')
+        if not venv_pool:
+            return None
+        assert 'path' in venv_pool, '"path" required in "venv_pool"'
+        venv_pool = dict(venv_pool)
+        venv_pool['path'] = os.path.abspath(venv_pool['path'])
+        venv_pool.setdefault('versions', self.get_valid_python_versions())
+        self['venv_pool'] = venv_pool
+        return True
+
     def validate_name(self):
         name = self.raw_config.get('name', None)
         if not name:
@@ -352,6 +665,34 @@ class BuildConfig(dict):
 
         self['python'] = python
 
+    def validate_sphinx(self):
+        """
+        ``sphinx.jobs`` is the number of parallel Sphinx processes, either an
+        integer or ``auto`` for the number of CPUs. Operators can cap it with
+        ``sphinx_max_jobs`` in the ``env_config``.
+        """
+        sphinx = {
+            'jobs': 1,
+            'max_jobs': self.env_config.get('sphinx_max_jobs'),
+        }
+
+        if 'sphinx' in self.raw_config:
+            raw_sphinx = self.raw_config['sphinx']
+            if not isinstance(raw_sphinx, dict):
+                self.error(
+                    'sphinx',
+                    self.SPHINX_INVALID_MESSAGE,
+                    code=SPHINX_INVALID)
+
+            if 'jobs' in raw_sphinx:
+                with self.catch_validation_error('sphinx.jobs'):
+                    jobs = raw_sphinx['jobs']
+                    if jobs != 'auto':
+                        jobs = validate_positive_integer(jobs)
+                    sphinx['jobs'] = jobs
+
+        self['sphinx'] = sphinx
+
     def validate_conda(self):
         conda = {}
 
@@ -378,7 +719,7 @@ class BuildConfig(dict):
         requirements_file = self.raw_config['requirements_file']
         base_path = os.path.dirname(self.source_file)
         with self.catch_validation_error('requirements_file'):
-            validate_file(requirements_file, base_path)
+            requirements_file = validate_file(requirements_file, base_path)
         self['requirements_file'] = requirements_file
 
         return True
@@ -391,7 +732,7 @@ class BuildConfig(dict):
         conf_file = self.raw_config['conf_file']
         base_path = os.path.dirname(self.source_file)
         with self.catch_validation_error('conf_file'):
-            validate_file(conf_file, base_path)
+            conf_file = validate_file(conf_file, base_path)
         self['conf_file'] = conf_file
 
         return True
@@ -405,7 +746,10 @@ class BuildConfig(dict):
             validate_list(_formats)
             for _format in _formats:
                 validate_choice(_format, self.get_valid_formats())
-        self['formats'] = _formats
+        # Every format is built once, in the order it is first listed.
+        self['formats'] = [
+            _format for index, _format in enumerate(_formats)
+            if _format not in _formats[:index]]
 
         return True
 
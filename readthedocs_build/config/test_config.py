@@ -13,11 +13,13 @@ from .config import TYPE_REQUIRED
 from .config import NAME_REQUIRED
 from .config import NAME_INVALID
 from .config import PYTHON_INVALID
+from .config import SPHINX_INVALID
 from .validation import INVALID_BOOL
 from .validation import INVALID_CHOICE
 from .validation import INVALID_DIRECTORY
 from .validation import INVALID_LIST
 from .validation import INVALID_PATH
+from .validation import INVALID_POSITIVE_INTEGER
 from .validation import INVALID_STRING
 
 
@@ -338,6 +340,11 @@ def describe_validate_formats():
         build.validate_formats()
         assert build['formats'] == ['pdf', 'htmlzip', 'epub']
 
+    def duplicate_formats_are_removed():
+        build = get_build_config({'formats': ['pdf', 'epub', 'pdf']})
+        build.validate_formats()
+        assert build['formats'] == ['pdf', 'epub']
+
     def cant_have_none_as_format():
         build = get_build_config({'formats': ['htmlzip', None]})
         with raises(InvalidConfig) as excinfo:
@@ -407,6 +414,322 @@ def test_valid_build_config():
     assert build['output_base']
 
 
+def describe_validate_venv_cache():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_venv_cache()
+        assert 'venv_cache' not in build
+
+    def it_uses_absolute_path(tmpdir):
+        with tmpdir.as_cwd():
+            build = get_build_config({}, {
+                'venv_cache': {'path': 'cache', 'max_entries': 10},
+            })
+            build.validate_venv_cache()
+        assert build['venv_cache'] == {
+            'path': str(tmpdir.join('cache')),
+            'max_entries': 10,
+        }
+
+
+def describe_validate_batch_install():
+
+    def it_defaults_to_false():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_batch_install()
+        assert build['batch_install'] is False
+
+    def it_uses_env_config():
+        build = get_build_config({}, {'batch_install': True})
+        build.validate_batch_install()
+        assert build['batch_install'] is True
+
+
+def describe_validate_wheelhouse():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_wheelhouse()
+        assert 'wheelhouse' not in build
+
+    def it_uses_absolute_path(tmpdir):
+        with tmpdir.as_cwd():
+            build = get_build_config({}, {
+                'wheelhouse': {'path': 'wheels', 'offline': True},
+            })
+            build.validate_wheelhouse()
+        assert build['wheelhouse'] == {
+            'path': str(tmpdir.join('wheels')),
+            'offline': True,
+        }
+
+
+def describe_validate_trash():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_trash()
+        assert 'trash' not in build
+
+    def it_uses_absolute_path(tmpdir):
+        with tmpdir.as_cwd():
+            build = get_build_config({}, {'trash': {'path': 'trash'}})
+            build.validate_trash()
+        assert build['trash'] == {'path': str(tmpdir.join('trash'))}
+
+
+def describe_validate_format_concurrency():
+
+    def it_defaults_to_one():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_format_concurrency()
+        assert build['format_concurrency'] == 1
+
+    def it_uses_env_config():
+        build = get_build_config({}, {'format_concurrency': 3})
+        build.validate_format_concurrency()
+        assert build['format_concurrency'] == 3
+
+
+def describe_validate_doctree_cache():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_doctree_cache()
+        assert 'doctree_cache' not in build
+
+    def it_uses_absolute_path(tmpdir):
+        with tmpdir.as_cwd():
+            build = get_build_config({}, {
+                'doctree_cache': {'path': 'doctrees'},
+            })
+            build.validate_doctree_cache()
+        assert build['doctree_cache'] == {
+            'path': str(tmpdir.join('doctrees')),
+        }
+
+
+def describe_validate_latex_cache():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_latex_cache()
+        assert 'latex_cache' not in build
+
+    def it_uses_absolute_path(tmpdir):
+        with tmpdir.as_cwd():
+            build = get_build_config({}, {
+                'latex_cache': {'path': 'latex'},
+            })
+            build.validate_latex_cache()
+        assert build['latex_cache'] == {
+            'path': str(tmpdir.join('latex')),
+        }
+
+
+def describe_validate_conf_file():
+
+    def it_validates_to_abspath(tmpdir):
+        apply_fs(tmpdir, {'docs': {'conf.py': ''}})
+        build = get_build_config(
+            {'conf_file': 'docs/conf.py'},
+            source_file=str(tmpdir.join('readthedocs.yml')))
+        build.validate_conf_file()
+        assert build['conf_file'] == str(tmpdir.join('docs', 'conf.py'))
+
+
+def describe_validate_sphinx_worker():
+
+    def it_defaults_to_false():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_sphinx_worker()
+        assert build['sphinx_worker'] is False
+
+    def it_uses_env_config():
+        build = get_build_config({}, {'sphinx_worker': True})
+        build.validate_sphinx_worker()
+        assert build['sphinx_worker'] is True
+
+
+def describe_validate_search_index():
+
+    def it_defaults_to_false():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_search_index()
+        assert build['search_index'] is False
+
+    def it_uses_env_config():
+        build = get_build_config({}, {'search_index': True})
+        build.validate_search_index()
+        assert build['search_index'] is True
+
+
+def describe_validate_search_shards():
+
+    def it_defaults_to_false():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_search_shards()
+        assert build['search_shards'] is False
+
+    def it_uses_env_config():
+        build = get_build_config({}, {'search_shards': True})
+        build.validate_search_shards()
+        assert build['search_shards'] is True
+
+
+def describe_validate_search_export():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_search_export()
+        assert 'search_export' not in build
+
+    def it_uses_absolute_path(tmpdir):
+        with tmpdir.as_cwd():
+            build = get_build_config({}, {
+                'search_export': {'path': 'export', 'compress': True},
+            })
+            build.validate_search_export()
+        assert build['search_export'] == {
+            'path': str(tmpdir.join('export')),
+            'compress': True,
+        }
+
+    def it_accepts_url():
+        build = get_build_config({}, {
+            'search_export': {'url': 'http://localhost:9200/_bulk'},
+        })
+        build.validate_search_export()
+        assert build['search_export'] == {
+            'url': 'http://localhost:9200/_bulk',
+        }
+
+
+def describe_validate_search_state():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_search_state()
+        assert 'search_state' not in build
+
+    def it_uses_absolute_path(tmpdir):
+        with tmpdir.as_cwd():
+            build = get_build_config({}, {
+                'search_state': {'path': 'state'},
+            })
+            build.validate_search_state()
+        assert build['search_state'] == {
+            'path': str(tmpdir.join('state')),
+        }
+
+
+def describe_validate_resource_sampler():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_resource_sampler()
+        assert 'resource_sampler' not in build
+
+    def it_defaults_to_one_second():
+        build = get_build_config({}, {'resource_sampler': {}})
+        build.validate_resource_sampler()
+        assert build['resource_sampler'] == {'interval': 1.0}
+
+    def it_rejects_invalid_interval():
+        build = get_build_config({}, {'resource_sampler': {'interval': 0}})
+        with raises(AssertionError):
+            build.validate_resource_sampler()
+
+
+def describe_validate_log_capture():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_log_capture()
+        assert 'log_capture' not in build
+
+    def it_keeps_64_kb_by_default():
+        build = get_build_config({}, {'log_capture': {}})
+        build.validate_log_capture()
+        assert build['log_capture'] == {'tail_size': 65536}
+
+    def it_rejects_invalid_tail_size():
+        build = get_build_config({}, {'log_capture': {'tail_size': 0}})
+        with raises(AssertionError):
+            build.validate_log_capture()
+
+
+def describe_validate_sphinx():
+
+    def it_defaults_to_one_job():
+        build = get_build_config({})
+        build.validate_sphinx()
+        assert build['sphinx'] == {'jobs': 1, 'max_jobs': None}
+
+    def it_accepts_number_of_jobs():
+        build = get_build_config({'sphinx': {'jobs': 4}})
+        build.validate_sphinx()
+        assert build['sphinx']['jobs'] == 4
+
+    def it_accepts_auto():
+        build = get_build_config({'sphinx': {'jobs': 'auto'}})
+        build.validate_sphinx()
+        assert build['sphinx']['jobs'] == 'auto'
+
+    def it_rejects_invalid_jobs():
+        build = get_build_config({'sphinx': {'jobs': 0}})
+        with raises(InvalidConfig) as excinfo:
+            build.validate_sphinx()
+        assert excinfo.value.key == 'sphinx.jobs'
+        assert excinfo.value.code == INVALID_POSITIVE_INTEGER
+
+    def it_rejects_non_dict():
+        build = get_build_config({'sphinx': 4})
+        with raises(InvalidConfig) as excinfo:
+            build.validate_sphinx()
+        assert excinfo.value.key == 'sphinx'
+        assert excinfo.value.code == SPHINX_INVALID
+
+    def it_uses_max_jobs_from_env_config():
+        build = get_build_config({}, {'sphinx_max_jobs': 2})
+        build.validate_sphinx()
+        assert build['sphinx']['max_jobs'] == 2
+
+
+def describe_validate_venv_pool():
+
+    def it_is_disabled_by_default():
+        build = get_build_config({}, {'output_base': '/tmp'})
+        build.validate_venv_pool()
+        assert 'venv_pool' not in build
+
+    def it_defaults_to_supported_versions(tmpdir):
+        build = get_build_config({}, {
+            'venv_pool': {'path': str(tmpdir)},
+            'python': {'supported_versions': [2.7, 3.6]},
+        })
+        build.validate_venv_pool()
+        assert build['venv_pool']['versions'] == [2.7, 3.6]
+
+
+def describe_validate_requirements_file():
+
+    def it_is_not_set_by_default():
+        build = get_build_config({})
+        build.validate_requirements_file()
+        assert 'requirements_file' not in build
+
+    def it_validates_to_abspath(tmpdir):
+        apply_fs(tmpdir, {'requirements.txt': ''})
+        build = get_build_config(
+            {'requirements_file': 'requirements.txt'},
+            source_file=str(tmpdir.join('readthedocs.yml')))
+        build.validate_requirements_file()
+        assert build['requirements_file'] == str(
+            tmpdir.join('requirements.txt'))
+
+
 def describe_validate_base():
 
     def it_validates_to_abspath(tmpdir):
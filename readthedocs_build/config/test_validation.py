@@ -10,6 +10,7 @@ from .validation import validate_list
 from .validation import validate_directory
 from .validation import validate_file
 from .validation import validate_path
+from .validation import validate_positive_integer
 from .validation import validate_string
 from .validation import ValidationError
 from .validation import INVALID_BOOL
@@ -18,6 +19,7 @@ from .validation import INVALID_LIST
 from .validation import INVALID_DIRECTORY
 from .validation import INVALID_FILE
 from .validation import INVALID_PATH
+from .validation import INVALID_POSITIVE_INTEGER
 from .validation import INVALID_STRING
 
 
@@ -166,3 +168,21 @@ def describe_validate_string():
         with raises(ValidationError) as excinfo:
             validate_string(None)
         assert excinfo.value.code == INVALID_STRING
+
+
+def describe_validate_positive_integer():
+    def it_accepts_positive_integers():
+        assert validate_positive_integer(1) == 1
+        assert validate_positive_integer(32) == 32
+
+    def it_fails_on_zero_and_negative_numbers():
+        for value in (0, -1):
+            with raises(ValidationError) as excinfo:
+                validate_positive_integer(value)
+            assert excinfo.value.code == INVALID_POSITIVE_INTEGER
+
+    def it_fails_on_other_types():
+        for value in ('4', 4.0, True, None):
+            with raises(ValidationError) as excinfo:
+                validate_positive_integer(value)
+            assert excinfo.value.code == INVALID_POSITIVE_INTEGER
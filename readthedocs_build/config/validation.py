@@ -1,5 +1,5 @@
 import os
-from six import string_types, text_type
+from six import integer_types, string_types, text_type
 
 
 INVALID_BOOL = 'invalid-bool'
@@ -7,6 +7,7 @@ INVALID_CHOICE = 'invalid-choice'
 INVALID_LIST = 'invalid-list'
 INVALID_DIRECTORY = 'invalid-directory'
 INVALID_FILE = 'invalid-file'
+INVALID_POSITIVE_INTEGER = 'invalid-positive-integer'
 INVALID_PATH = 'invalid-path'
 INVALID_STRING = 'invalid-string'
 
@@ -17,6 +18,7 @@ class ValidationError(Exception):
         INVALID_CHOICE: 'expected one of ({choices}), got {value}',
         INVALID_DIRECTORY: '{value} is not a directory',
         INVALID_FILE: '{value} is not a file',
+        INVALID_POSITIVE_INTEGER: 'expected positive integer, got {value}',
         INVALID_PATH: 'path {value} does not exist',
         INVALID_STRING: 'expected string',
         INVALID_LIST: 'expected list',
@@ -51,6 +53,14 @@ def validate_choice(value, choices):
     return value
 
 
+def validate_positive_integer(value):
+    if isinstance(value, bool) or not isinstance(value, integer_types):
+        raise ValidationError(value, INVALID_POSITIVE_INTEGER)
+    if value < 1:
+        raise ValidationError(value, INVALID_POSITIVE_INTEGER)
+    return value
+
+
 def validate_bool(value):
     if value not in (0, 1, False, True):
         raise ValidationError(value, INVALID_BOOL)
@@ -0,0 +1,154 @@
+"""
+Runs build stages as soon as the stages they depend on are done.
+
+Every stage uses one unit of a resource, like ``cpu`` or ``io``. The
+scheduler never runs more stages of a resource at the same time than its
+limit allows.
+"""
+
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+import six
+
+
+__all__ = ('Scheduler', 'SchedulerError', 'Stage')
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class Stage(object):
+    """
+    A unit of build work. ``function`` is called without arguments once all
+    ``dependencies`` succeeded. Stages that are ``always`` run are also run
+    after a dependency failed, e.g. to clean up.
+    """
+
+    def __init__(self, name, function, dependencies=(), resource='cpu',
+                 always=False):
+        self.name = name
+        self.function = function
+        self.dependencies = tuple(dependencies)
+        self.resource = resource
+        self.always = always
+        self.started = None
+        self.finished = None
+        self.exc_info = None
+        self.skipped = False
+
+    def __repr__(self):
+        return '<Stage {}>'.format(self.name)
+
+    @property
+    def failed(self):
+        return self.skipped or self.exc_info is not None
+
+    def run(self):
+        self.started = time.time()
+        try:
+            self.function()
+        except Exception:  # pylint: disable=broad-except
+            self.exc_info = sys.exc_info()
+        finally:
+            self.finished = time.time()
+
+
+class Scheduler(object):
+    """
+    Runs the added stages in threads. ``limits`` maps resources to the
+    number of stages that may use them at the same time, resources without
+    a limit are not limited.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(limits or {})
+        self.stages = OrderedDict()
+        self.condition = threading.Condition()
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise SchedulerError('Duplicate stage {}'.format(stage.name))
+        self.stages[stage.name] = stage
+        return stage
+
+    def get_ready_stages(self, pending, done, running):
+        ready = []
+        usage = {}
+        for stage in running:
+            usage[stage.resource] = usage.get(stage.resource, 0) + 1
+        for stage in pending:
+            if not all(name in done for name in stage.dependencies):
+                continue
+            limit = self.limits.get(stage.resource)
+            used = usage.get(stage.resource, 0)
+            if limit is not None and used >= limit:
+                continue
+            usage[stage.resource] = used + 1
+            ready.append(stage)
+        return ready
+
+    def skip_failed_dependents(self, pending, done):
+        skipped = True
+        while skipped:
+            skipped = False
+            for stage in list(pending):
+                if stage.always:
+                    continue
+                if any(self.stages[name].failed
+                       for name in stage.dependencies if name in done):
+                    stage.skipped = True
+                    pending.remove(stage)
+                    done.add(stage.name)
+                    skipped = True
+
+    def run_stage(self, stage, done, running):
+        stage.run()
+        with self.condition:
+            running.remove(stage)
+            done.add(stage.name)
+            self.condition.notify()
+
+    def run(self):
+        """
+        Run all stages and wait until they are done. The first error of a
+        stage is raised again after all other stages finished. Stages that
+        depend on a failed stage are skipped.
+        """
+        for stage in self.stages.values():
+            for dependency in stage.dependencies:
+                if dependency not in self.stages:
+                    raise SchedulerError(
+                        '{} depends on unknown stage {}'.format(
+                            stage.name, dependency))
+        pending = list(self.stages.values())
+        done = set()
+        running = []
+        threads = []
+        with self.condition:
+            while pending or running:
+                self.skip_failed_dependents(pending, done)
+                for stage in self.get_ready_stages(pending, done, running):
+                    pending.remove(stage)
+                    running.append(stage)
+                    thread = threading.Thread(
+                        target=self.run_stage,
+                        args=(stage, done, running))
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+                if not running:
+                    if pending:
+                        raise SchedulerError(
+                            'Dependency cycle between {}'.format(
+                                ', '.join(stage.name for stage in pending)))
+                    break
+                self.condition.wait()
+        for thread in threads:
+            thread.join()
+        for stage in self.stages.values():
+            if stage.exc_info is not None:
+                six.reraise(*stage.exc_info)
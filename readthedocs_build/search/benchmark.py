@@ -0,0 +1,150 @@
+"""
+Benchmarks of the search data formats::
+
+    python -m readthedocs_build.search.benchmark index SEARCH_DATA_DIR QUERY...
+    python -m readthedocs_build.search.benchmark shards HTML_DIR QUERY...
+"""
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import timeit
+
+import click
+
+from .index import SearchIndex
+from .index import build_index
+from .index import iter_records
+from .index import tokenize
+from .shards import get_shard_key
+from .shards import load_searchindex
+from .shards import shard_searchindex
+
+
+def scan_records(search_data_dir, query):
+    """
+    Search by reading and tokenizing all ``.fjson`` files, like the
+    ingestion did before there was an index.
+    """
+    terms = set(tokenize(query))
+    matches = []
+    for record in iter_records(search_data_dir):
+        tokens = tokenize(record.get('title', '') + ' ' + record['body'])
+        if terms.intersection(tokens):
+            matches.append(record['path'])
+    return matches
+
+
+def measure(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command('index')
+@click.argument('search_data_dir',
+                type=click.Path(exists=True, file_okay=False))
+@click.argument('queries', nargs=-1, required=True)
+@click.option('--repeat', type=click.IntRange(min=1), default=5)
+def index_command(search_data_dir, queries, repeat):
+    """
+    Compare queries on the inverted index with scanning the fjson files.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='rtd-benchmark-')
+    try:
+        index_path = os.path.join(tmp_dir, 'search.idx')
+        build_time = measure(
+            lambda: build_index(search_data_dir, index_path), 1)
+        click.echo('build index: {:.4f}s, {} bytes'.format(
+            build_time, os.path.getsize(index_path)))
+        for query in queries:
+            scan_time = measure(
+                lambda: scan_records(search_data_dir, query), repeat)
+
+            def query_index():
+                index = SearchIndex(index_path)
+                try:
+                    return index.search(query)
+                finally:
+                    index.close()
+
+            index_time = measure(query_index, repeat)
+            click.echo(
+                '{query!r}: scan {scan:.4f}s, index {index:.6f}s '
+                '({speedup:.0f}x)'.format(
+                    query=query,
+                    scan=scan_time,
+                    index=index_time,
+                    speedup=scan_time / max(index_time, 1e-9)))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_file(path):
+    with io.open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+@main.command('shards')
+@click.argument('html_dir', type=click.Path(exists=True, file_okay=False))
+@click.argument('queries', nargs=-1, required=True)
+@click.option('--prefix-length', type=click.IntRange(min=1), default=2)
+@click.option('--repeat', type=click.IntRange(min=1), default=5)
+def shards_command(html_dir, queries, prefix_length, repeat):
+    """
+    Compare the bytes a search page downloads and parses for a query with
+    the sharded and the monolithic search index, and the size of the
+    manifest that is loaded with the page. Parsing is measured with
+    Python's JSON parser as a stand-in for the browser's.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='rtd-benchmark-')
+    try:
+        os.makedirs(os.path.join(tmp_dir, '_static'))
+        searchindex = os.path.join(html_dir, 'searchindex.js')
+        shutil.copy(searchindex, tmp_dir)
+        shard_searchindex(tmp_dir, prefix_length=prefix_length)
+        shard_dir = os.path.join(tmp_dir, '_static', 'searchindex')
+        manifest_path = os.path.join(shard_dir, 'manifest.json')
+        manifest = json.loads(read_file(manifest_path))
+
+        monolithic = json.dumps(load_searchindex(searchindex))
+        monolithic_time = measure(lambda: json.loads(monolithic), repeat)
+        click.echo('monolithic: {} bytes, parse {:.4f}s'.format(
+            os.path.getsize(searchindex), monolithic_time))
+        manifest_content = read_file(manifest_path)
+        manifest_time = measure(lambda: json.loads(manifest_content), repeat)
+        click.echo('manifest: {} bytes, parse {:.4f}s'.format(
+            os.path.getsize(manifest_path), manifest_time))
+        objects_paths = []
+        if manifest.get('objects_file'):
+            objects_paths.append(
+                os.path.join(shard_dir, manifest['objects_file']))
+        for query in queries:
+            paths = [manifest_path] + objects_paths + sorted(set(
+                os.path.join(shard_dir, manifest['shards'][key])
+                for key in (
+                    get_shard_key(word, prefix_length)
+                    for word in tokenize(query))
+                if key in manifest['shards']))
+            contents = [read_file(path) for path in paths]
+            sharded_time = measure(
+                lambda: [json.loads(content) for content in contents],
+                repeat)
+            click.echo(
+                '{query!r}: {files} files, {size} bytes, parse {time:.4f}s'
+                .format(
+                    query=query,
+                    files=len(paths),
+                    size=sum(os.path.getsize(path) for path in paths),
+                    time=sharded_time))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Export the search records as NDJSON files for the bulk API of the search
+cluster. Every record becomes an action line and a document line::
+
+    {"index": {"_id": "docs/guide/install"}}
+    {"project": "docs", "path": "guide/install", "title": "...", ...}
+
+Records are read and written one at a time, and the output is split into
+chunks of at most ``max_bytes`` uncompressed bytes, so memory use does not
+depend on the size of the project.
+"""
+
+import glob
+import gzip
+import json
+import os
+import tempfile
+
+from six.moves.urllib.request import Request
+from six.moves.urllib.request import urlopen
+
+from .index import iter_records
+
+
+__all__ = (
+    'BulkWriter', 'DirectorySink', 'HttpSink', 'export_search_data',
+    'get_sink')
+
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+
+class DirectorySink(object):
+    """
+    Writes the chunks as ``bulk-00001.ndjson`` files into ``path``. Chunks of
+    an earlier export are removed.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        for chunk in glob.glob(os.path.join(self.path, 'bulk-*.ndjson*')):
+            os.remove(chunk)
+
+    def open(self, name):
+        return open(os.path.join(self.path, '.tmp-' + name), 'wb')
+
+    def commit(self, name, chunk):
+        chunk.close()
+        os.rename(
+            os.path.join(self.path, '.tmp-' + name),
+            os.path.join(self.path, name))
+
+
+class HttpSink(object):
+    """
+    Posts every chunk to the bulk endpoint at ``url``. Chunks are spooled to
+    a temporary file until they are complete.
+    """
+
+    def __init__(self, url, timeout=60):
+        self.url = url
+        self.timeout = timeout
+
+    def open(self, name):
+        return tempfile.TemporaryFile()
+
+    def commit(self, name, chunk):
+        chunk.seek(0)
+        headers = {'Content-Type': 'application/x-ndjson'}
+        if name.endswith('.gz'):
+            headers['Content-Encoding'] = 'gzip'
+        try:
+            request = Request(self.url, data=chunk.read(), headers=headers)
+            urlopen(request, timeout=self.timeout).close()
+        finally:
+            chunk.close()
+
+
+def get_sink(export_config, project):
+    if export_config.get('url'):
+        return HttpSink(export_config['url'])
+    return DirectorySink(os.path.join(
+        export_config['path'], project.replace(os.sep, '-')))
+
+
+class BulkWriter(object):
+    """
+    Writes bulk lines into chunks of ``sink``. A new chunk is started once
+    the current one would exceed ``max_bytes``.
+    """
+
+    def __init__(self, sink, max_bytes=DEFAULT_MAX_BYTES, compress=False):
+        self.sink = sink
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.chunks = []
+        self.chunk = None
+        self.stream = None
+        self.size = 0
+
+    def start_chunk(self):
+        name = 'bulk-{:05d}.ndjson'.format(len(self.chunks) + 1)
+        if self.compress:
+            name += '.gz'
+        self.chunks.append(name)
+        self.chunk = self.sink.open(name)
+        if self.compress:
+            self.stream = gzip.GzipFile(
+                filename='', mode='wb', fileobj=self.chunk)
+        else:
+            self.stream = self.chunk
+        self.size = 0
+
+    def finish_chunk(self):
+        if self.chunk is None:
+            return
+        if self.stream is not self.chunk:
+            self.stream.close()
+        self.sink.commit(self.chunks[-1], self.chunk)
+        self.chunk = None
+        self.stream = None
+
+    def write(self, doc_id, document):
+        lines = (
+            json.dumps({'index': {'_id': doc_id}}) + '\n' +
+            json.dumps(document, sort_keys=True) + '\n').encode('utf-8')
+        if self.chunk is not None and self.size + len(lines) > self.max_bytes:
+            self.finish_chunk()
+        if self.chunk is None:
+            self.start_chunk()
+        self.stream.write(lines)
+        self.size += len(lines)
+
+    def close(self):
+        """
+        Finish the last chunk and return the names of all chunks.
+        """
+        self.finish_chunk()
+        return self.chunks
+
+
+def export_search_data(search_data_dir, sink, project,
+                       max_bytes=DEFAULT_MAX_BYTES, compress=False):
+    """
+    Stream all records in ``search_data_dir`` into ``sink``. Returns the
+    names of the written chunks.
+    """
+    writer = BulkWriter(sink, max_bytes=max_bytes, compress=compress)
+    for record in iter_records(search_data_dir):
+        document = dict(record, project=project)
+        writer.write('{}/{}'.format(project, record['path']), document)
+    return writer.close()
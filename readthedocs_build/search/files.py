@@ -0,0 +1,36 @@
+"""
+Helpers for writing files that are read by other processes while they are
+replaced.
+"""
+
+import contextlib
+import os
+import tempfile
+
+
+__all__ = ('atomic_write',)
+
+
+def get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Return a context manager with a temporary file that replaces ``path``
+    atomically when the block is left without error. The file gets the
+    permissions of any newly created file, not the 0600 of ``mkstemp``.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.chmod(tmp_path, 0o666 & ~get_umask())
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
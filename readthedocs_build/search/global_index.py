@@ -0,0 +1,335 @@
+"""
+Search index over many projects, built from their ``search_data``.
+
+The index is a directory of segments, index files as written by
+:class:`~readthedocs_build.search.index.IndexWriter`, and ``state.json``
+listing the live segments::
+
+    {
+        "segments": [
+            {"file": "<id>.idx", "projects": {"docs": "<fingerprint>"},
+             "deleted": []}
+        ]
+    }
+
+Adding a project writes a new segment with only that project. The
+project's documents in older segments are marked as deleted, nothing else
+is rewritten. Compaction merges all segments into one and drops the
+deleted documents.
+
+Readers open the segments of the state under a shared lock. Segments that
+are not used anymore are only removed under the exclusive lock, so readers
+never see a state whose segments are gone. Once open, a segment stays
+readable after its file is removed.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import math
+import os
+import threading
+import uuid
+
+from .index import IndexWriter
+from .index import SearchIndex
+from .index import iter_records
+from .index import tokenize
+from .manifest import load_manifest
+from .manifest import write_json
+
+
+__all__ = ('GlobalIndex', 'find_projects')
+
+
+DEFAULT_MAX_SEGMENTS = 8
+
+# Lock file that readers hold shared while they open segments.
+READERS_LOCK = '.readers'
+
+
+def find_projects(output_base):
+    """
+    Return a dict mapping the names of all projects in ``output_base`` to
+    their ``search_data`` directories.
+    """
+    projects = {}
+    for root, dirs, files in os.walk(output_base):
+        if 'search_data' in dirs:
+            name = os.path.relpath(root, output_base).replace(os.sep, '/')
+            projects[name] = os.path.join(root, 'search_data')
+            dirs.remove('search_data')
+    return projects
+
+
+def get_fingerprint(search_data_dir):
+    """
+    Fingerprint of the search data, from its manifest of page hashes.
+    Returns ``None`` if there is no manifest.
+    """
+    manifest = load_manifest(os.path.join(search_data_dir, 'manifest.json'))
+    if not manifest:
+        return None
+    sha = hashlib.sha256()
+    for path in sorted(manifest):
+        sha.update(u'{}\0{}\n'.format(path, manifest[path]).encode('utf-8'))
+    return sha.hexdigest()
+
+
+# Separates the project from the page path in the document paths.
+PROJECT_SEPARATOR = u'\x1f'
+
+
+def get_files(state):
+    return [segment['file'] for segment in state['segments']]
+
+
+def split_document_path(doc_path):
+    """
+    Return the project and the page path of a document.
+    """
+    return tuple(doc_path.split(PROJECT_SEPARATOR, 1))
+
+
+class GlobalIndex(object):
+    """
+    Search index of many projects in the directory ``path``. It can be
+    updated by several processes, changes of the state are serialized by a
+    lock file.
+    """
+
+    def __init__(self, path, max_segments=DEFAULT_MAX_SEGMENTS):
+        self.path = os.path.abspath(path)
+        self.segment_dir = os.path.join(self.path, 'segments')
+        self.state_path = os.path.join(self.path, 'state.json')
+        self.max_segments = max_segments
+        if not os.path.exists(self.segment_dir):
+            os.makedirs(self.segment_dir)
+        self.compaction = None
+
+    @contextlib.contextmanager
+    def lock(self, name='.lock', operation=fcntl.LOCK_EX):
+        with open(os.path.join(self.path, name), 'w') as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load_state(self):
+        state = load_manifest(self.state_path)
+        state.setdefault('segments', [])
+        return state
+
+    def save_state(self, state, old_files):
+        """
+        Save ``state`` and remove the segments in ``old_files`` that are not
+        used anymore. Must be called with the lock held.
+        """
+        write_json(self.state_path, state)
+        unused_files = set(old_files) - set(get_files(state))
+        if not unused_files:
+            return
+        # Wait for readers of the old state to open its segments.
+        with self.lock(READERS_LOCK):
+            for filename in unused_files:
+                os.remove(os.path.join(self.segment_dir, filename))
+
+    def open_segments(self):
+        """
+        Return the current state and the opened
+        :class:`~readthedocs_build.search.index.SearchIndex` of every
+        segment in it. They have to be closed by the caller.
+        """
+        with self.lock(READERS_LOCK, fcntl.LOCK_SH):
+            state = self.load_state()
+            indexes = []
+            try:
+                for segment in state['segments']:
+                    indexes.append(
+                        SearchIndex(self.get_segment_path(segment)))
+            except Exception:
+                for index in indexes:
+                    index.close()
+                raise
+        return state, indexes
+
+    def get_segment_path(self, segment):
+        return os.path.join(self.segment_dir, segment['file'])
+
+    def get_fingerprints(self):
+        """
+        Return a dict mapping the indexed projects to their fingerprints.
+        """
+        fingerprints = {}
+        for segment in self.load_state()['segments']:
+            for project, fingerprint in segment['projects'].items():
+                if project not in segment['deleted']:
+                    fingerprints[project] = fingerprint
+        return fingerprints
+
+    def write_segment(self, writer):
+        filename = '{}.idx'.format(uuid.uuid4().hex)
+        writer.write(os.path.join(self.segment_dir, filename))
+        return filename
+
+    def delete_project(self, state, project):
+        for segment in list(state['segments']):
+            if project not in segment['projects']:
+                continue
+            if project in segment['deleted']:
+                continue
+            segment['deleted'].append(project)
+            if set(segment['deleted']) >= set(segment['projects']):
+                state['segments'].remove(segment)
+
+    def add_project(self, project, search_data_dir):
+        """
+        Index the ``search_data_dir`` of ``project`` as new segment. Returns
+        ``False`` if the project is indexed already and did not change.
+        """
+        fingerprint = get_fingerprint(search_data_dir)
+        if fingerprint is not None and (
+                self.get_fingerprints().get(project) == fingerprint):
+            return False
+        writer = IndexWriter()
+        for record in iter_records(search_data_dir):
+            writer.add_document(
+                project + PROJECT_SEPARATOR + record['path'],
+                record.get('title', ''),
+                record.get('body', ''))
+        filename = self.write_segment(writer)
+        with self.lock():
+            state = self.load_state()
+            old_files = get_files(state)
+            self.delete_project(state, project)
+            state['segments'].append({
+                'file': filename,
+                'projects': {project: fingerprint},
+                'deleted': [],
+            })
+            self.save_state(state, old_files)
+        return True
+
+    def remove_project(self, project):
+        with self.lock():
+            state = self.load_state()
+            old_files = get_files(state)
+            self.delete_project(state, project)
+            self.save_state(state, old_files)
+
+    def compact(self):
+        """
+        Merge all current segments into one. Projects that are added while
+        the segments are merged stay in their own segments.
+        """
+        state, indexes = self.open_segments()
+        try:
+            if len(state['segments']) <= 1 and not any(
+                    segment['deleted'] for segment in state['segments']):
+                return False
+            writer = IndexWriter()
+            projects = {}
+            for segment, index in zip(state['segments'], indexes):
+                deleted = set(segment['deleted'])
+                for project, fingerprint in segment['projects'].items():
+                    if project not in deleted:
+                        projects[project] = fingerprint
+                doc_ids = {}
+                for doc_id in range(len(index)):
+                    doc_path, title = index.get_document(doc_id)
+                    project = split_document_path(doc_path)[0]
+                    if project not in deleted:
+                        doc_ids[doc_id] = writer.add_document(
+                            doc_path, title, '', frequencies={})
+                for term_id, term in enumerate(index.terms()):
+                    postings = [
+                        (doc_ids[doc_id], frequency)
+                        for doc_id, frequency in index.get_postings(term_id)
+                        if doc_id in doc_ids]
+                    if postings:
+                        writer.add_postings(term, postings)
+        finally:
+            for index in indexes:
+                index.close()
+        filename = self.write_segment(writer)
+
+        compacted = dict(
+            (segment['file'], segment) for segment in state['segments'])
+        with self.lock():
+            current_state = self.load_state()
+            old_files = get_files(current_state) + [filename]
+            # Projects deleted while merging are deleted in the new segment.
+            deleted = set()
+            segments = []
+            current_files = set(get_files(current_state))
+            for segment in current_state['segments']:
+                if segment['file'] in compacted:
+                    deleted.update(set(segment['deleted']) - set(
+                        compacted[segment['file']]['deleted']))
+                else:
+                    segments.append(segment)
+            for segment in compacted.values():
+                if segment['file'] not in current_files:
+                    deleted.update(segment['projects'])
+            if set(projects) - deleted:
+                segments.insert(0, {
+                    'file': filename,
+                    'projects': projects,
+                    'deleted': sorted(deleted & set(projects)),
+                })
+            current_state['segments'] = segments
+            self.save_state(current_state, old_files)
+        return True
+
+    def compact_in_background(self):
+        """
+        Start a compaction in a background thread if there are more than
+        ``max_segments`` segments. Returns the thread or ``None``.
+        """
+        if len(self.load_state()['segments']) <= self.max_segments:
+            return None
+        if self.compaction is not None and self.compaction.is_alive():
+            return self.compaction
+        self.compaction = threading.Thread(target=self.compact)
+        self.compaction.start()
+        return self.compaction
+
+    def search(self, query, limit=10):
+        """
+        Return up to ``limit`` ``(project, path, title, score)`` of the best
+        matching documents of all projects.
+        """
+        state, indexes = self.open_segments()
+        segments = [
+            (index, set(segment['deleted']))
+            for segment, index in zip(state['segments'], indexes)]
+        try:
+            terms = set(tokenize(query))
+            document_count = sum(len(index) for index, deleted in segments)
+            postings = [
+                dict((term, index.lookup(term)) for term in terms)
+                for index, deleted in segments]
+            scores = {}
+            for term in terms:
+                frequency = sum(
+                    len(term_postings[term]) for term_postings in postings)
+                if not frequency:
+                    continue
+                idf = math.log(1 + float(document_count) / frequency)
+                for position, term_postings in enumerate(postings):
+                    for doc_id, count in term_postings[term]:
+                        key = (position, doc_id)
+                        scores[key] = scores.get(key, 0) + count * idf
+            matches = []
+            for (position, doc_id), score in scores.items():
+                index, deleted = segments[position]
+                doc_path, title = index.get_document(doc_id)
+                project, path = split_document_path(doc_path)
+                if project not in deleted:
+                    matches.append((project, path, title, score))
+            matches.sort(key=lambda match: (-match[3], match[0], match[1]))
+            return matches[:limit]
+        finally:
+            for index, deleted in segments:
+                index.close()
@@ -0,0 +1,275 @@
+"""
+Extract the search records of pages from Sphinx's HTML output.
+
+A record has the same fields that the search ingestion reads from the
+``.fjson`` files of Sphinx's JSON builder::
+
+    {
+        "path": "guide/install",
+        "title": "Installation",
+        "sections": [
+            {"id": "installation", "title": "Installation", "content": "..."},
+        ],
+        "body": "..."
+    }
+"""
+
+from multiprocessing import Pool
+import io
+import multiprocessing
+import json
+import os
+import re
+
+from six import text_type
+from six.moves.html_parser import HTMLParser
+
+try:
+    from html import unescape
+except ImportError:
+    unescape = HTMLParser().unescape
+
+
+__all__ = ('PageParser', 'parse_page', 'iter_pages', 'write_search_data')
+
+
+# Directories of the HTML output that contain no pages.
+IGNORED_DIRECTORIES = ('_static', '_sources', '_images', '_downloads')
+
+# Generated pages without content.
+IGNORED_PAGES = ('genindex', 'search', 'py-modindex')
+
+HEADINGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+SKIPPED_TAGS = ('script', 'style')
+
+# Tags that separate words, the text of other tags is joined as is.
+BLOCK_TAGS = HEADINGS + (
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl',
+    'dt', 'figcaption', 'figure', 'footer', 'header', 'hr', 'li', 'main',
+    'nav', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul')
+
+VOID_TAGS = (
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr')
+
+WHITESPACE_RE = re.compile(r'\s+', re.UNICODE)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def is_main_content(tag, attrs):
+    """
+    The themes put the page content into different elements: the default
+    themes use ``<div class="body" role="main">``, the Read the Docs theme
+    ``<div itemprop="articleBody">``.
+    """
+    if attrs.get('role') == 'main' or attrs.get('itemprop') == 'articleBody':
+        return True
+    return tag == 'div' and 'body' in attrs.get('class', '').split()
+
+
+def is_section(tag, attrs):
+    if tag == 'section':
+        return True
+    return tag == 'div' and 'section' in attrs.get('class', '').split()
+
+
+def normalize(text):
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+
+class PageParser(HTMLParser):
+    """
+    Incremental parser for one HTML page. Feed it the page in chunks and
+    call ``get_record`` at the end.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.title = []
+        self.sections = []
+        self.body = []
+        # Element depths at which the main content and sections started.
+        self.depth = 0
+        self.main_depth = None
+        # [depth, id, content] of the open sections, the content is set by
+        # the heading of the section.
+        self.section_stack = []
+        self.skip_depth = None
+        self.in_title = False
+        self.heading = None
+        self.section_content = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.handle_data(' ')
+        if tag in VOID_TAGS:
+            return
+        attrs = dict((name, value or '') for name, value in attrs)
+        self.depth += 1
+        if tag == 'title':
+            self.in_title = True
+        if self.skip_depth is not None:
+            return
+        if tag in SKIPPED_TAGS or 'headerlink' in attrs.get(
+                'class', '').split():
+            self.skip_depth = self.depth
+            return
+        if self.main_depth is None:
+            if is_main_content(tag, attrs):
+                self.main_depth = self.depth
+            return
+        if is_section(tag, attrs):
+            self.section_stack.append([self.depth, attrs.get('id', ''), None])
+        elif tag in HEADINGS:
+            self.heading = []
+            self.section_content = []
+            section_id = ''
+            if self.section_stack:
+                section_id = self.section_stack[-1][1]
+                self.section_stack[-1][2] = self.section_content
+            self.sections.append({
+                'id': section_id,
+                'title': '',
+                'content': self.section_content,
+            })
+
+    def handle_endtag(self, tag):
+        if tag in BLOCK_TAGS:
+            self.handle_data(' ')
+        if tag in VOID_TAGS:
+            return
+        if tag == 'title':
+            self.in_title = False
+        if self.skip_depth == self.depth:
+            self.skip_depth = None
+        elif self.main_depth == self.depth:
+            self.main_depth = None
+        elif self.section_stack and self.section_stack[-1][0] == self.depth:
+            self.section_stack.pop()
+            # Text after a subsection belongs to the parent section again.
+            self.section_content = None
+            if self.section_stack:
+                self.section_content = self.section_stack[-1][2]
+        elif tag in HEADINGS and self.heading is not None:
+            self.sections[-1]['title'] = normalize(''.join(self.heading))
+            self.heading = None
+        self.depth = max(0, self.depth - 1)
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title.append(data)
+        if self.skip_depth is not None or self.main_depth is None:
+            return
+        self.body.append(data)
+        if self.heading is not None:
+            self.heading.append(data)
+            return
+        if self.section_content is not None:
+            self.section_content.append(data)
+
+    def handle_entityref(self, name):
+        # Only called on Python 2, Python 3 converts references itself.
+        self.handle_data(unescape('&{};'.format(name)))
+
+    def handle_charref(self, name):
+        self.handle_data(unescape('&#{};'.format(name)))
+
+    def get_record(self, path):
+        sections = [
+            {
+                'id': section['id'],
+                'title': section['title'],
+                'content': normalize(''.join(section['content'])),
+            }
+            for section in self.sections
+        ]
+        if sections and sections[0]['title']:
+            title = sections[0]['title']
+        else:
+            # Sphinx appends the project name to the <title>.
+            title = normalize(''.join(self.title)).split(u' \u2014 ')[0]
+        return {
+            'path': path,
+            'title': title,
+            'sections': sections,
+            'body': normalize(''.join(self.body)),
+        }
+
+
+def parse_page(html_file, path):
+    """
+    Return the search record of the page in ``html_file``.
+    """
+    parser = PageParser()
+    with io.open(html_file, 'r', encoding='utf-8', errors='replace') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+    parser.close()
+    return parser.get_record(path)
+
+
+def iter_pages(html_dir):
+    """
+    Yield ``(html_file, path)`` of all pages in the HTML output.
+    """
+    for root, dirs, files in os.walk(html_dir):
+        if root == html_dir:
+            dirs[:] = [
+                directory for directory in dirs
+                if directory not in IGNORED_DIRECTORIES]
+        dirs.sort()
+        for filename in sorted(files):
+            name, extension = os.path.splitext(filename)
+            if extension != '.html':
+                continue
+            html_file = os.path.join(root, filename)
+            path = os.path.relpath(
+                os.path.join(root, name), html_dir).replace(os.sep, '/')
+            if path in IGNORED_PAGES:
+                continue
+            yield html_file, path
+
+
+def write_record(args):
+    html_file, path, out_dir = args
+    record = parse_page(html_file, path)
+    out_file = os.path.join(out_dir, *path.split('/')) + '.fjson'
+    out_file_dir = os.path.dirname(out_file)
+    if not os.path.exists(out_file_dir):
+        try:
+            os.makedirs(out_file_dir)
+        except OSError:
+            # Created by another worker in the meantime.
+            pass
+    with io.open(out_file, 'w', encoding='utf-8') as f:
+        f.write(text_type(
+            json.dumps(record, sort_keys=True, ensure_ascii=False)))
+    return path
+
+
+def write_search_data(html_dir, out_dir, processes=1):
+    """
+    Write the search record of every page in ``html_dir`` as ``.fjson`` file
+    to ``out_dir``. Pages are parsed in a pool of ``processes``, or one
+    after another inside of a daemonic process, e.g. a worker of the pool of
+    ``build(jobs>1)``, which must not start processes. Returns the paths of
+    the pages.
+    """
+    tasks = [
+        (html_file, path, out_dir)
+        for html_file, path in iter_pages(html_dir)]
+    if multiprocessing.current_process().daemon:
+        processes = 1
+    if processes <= 1 or len(tasks) <= 1:
+        return [write_record(task) for task in tasks]
+    pool = Pool(processes=min(processes, len(tasks)))
+    try:
+        return pool.map(write_record, tasks, chunksize=8)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,279 @@
+"""
+Compact inverted index of the search records, stored in a single file that
+is memory-mapped and queried in place.
+
+All integers are little-endian unsigned 32 bit. The file contains:
+
+- the header: magic, number of documents, number of terms and number of
+  postings
+- the document offsets (``documents + 1``) into the document blob
+- the document blob, ``path\\0title`` of every document in UTF-8
+- the term offsets (``terms + 1``) into the term blob
+- the term blob, all terms in UTF-8 sorted by their bytes
+- the postings offsets (``terms + 1``) into the postings arrays
+- the document ids of all postings, sorted by term and document
+- the term frequencies of all postings in the same order
+
+Every section starts at a multiple of four bytes.
+"""
+
+import io
+import json
+import math
+import mmap
+import os
+import re
+import struct
+
+from .files import atomic_write
+
+
+__all__ = ('IndexWriter', 'SearchIndex', 'build_index', 'tokenize')
+
+
+MAGIC = b'RTDIDX01'
+HEADER = struct.Struct('<8sIII')
+
+# Terms in the title count this many times.
+TITLE_WEIGHT = 3
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_RE.findall(text)]
+
+
+def pad(data):
+    return data + b'\0' * (-len(data) % 4)
+
+
+def pack_array(values):
+    return struct.pack('<{}I'.format(len(values)), *values)
+
+
+def get_offsets(items):
+    offsets = [0]
+    for item in items:
+        offsets.append(offsets[-1] + len(item))
+    return offsets
+
+
+def iter_records(search_data_dir):
+    """
+    Yield the records of all ``.fjson`` files in ``search_data_dir`` one by
+    one, sorted by path.
+    """
+    for root, dirs, files in os.walk(search_data_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.endswith('.fjson'):
+                continue
+            with io.open(os.path.join(root, filename), encoding='utf-8') as f:
+                yield json.load(f)
+
+
+class IndexWriter(object):
+    """
+    Collects documents in memory and writes them as index file.
+    """
+
+    def __init__(self):
+        self.documents = []
+        self.postings = {}
+
+    def add_document(self, path, title, text, frequencies=None):
+        """
+        Add a document and return its id. The term ``frequencies`` are
+        counted from ``title`` and ``text`` unless given.
+        """
+        doc_id = len(self.documents)
+        self.documents.append((path, title))
+        if frequencies is None:
+            frequencies = {}
+            for term in tokenize(text):
+                frequencies[term] = frequencies.get(term, 0) + 1
+            for term in tokenize(title):
+                frequencies[term] = frequencies.get(term, 0) + TITLE_WEIGHT
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, []).append((doc_id, frequency))
+        return doc_id
+
+    def add_postings(self, term, postings):
+        """
+        Add ``(doc_id, frequency)`` postings of ``term`` for documents that
+        were added without term frequencies.
+        """
+        self.postings.setdefault(term, []).extend(postings)
+
+    def add_record(self, record):
+        return self.add_document(
+            record['path'], record.get('title', ''), record.get('body', ''))
+
+    def write(self, path):
+        """
+        Write the index to ``path``. The file is replaced atomically.
+        """
+        documents = [
+            u'{}\0{}'.format(doc_path, title).encode('utf-8')
+            for doc_path, title in self.documents]
+        terms = sorted(
+            (term.encode('utf-8'), term) for term in self.postings)
+        doc_ids = []
+        frequencies = []
+        postings_offsets = [0]
+        for encoded_term, term in terms:
+            for doc_id, frequency in sorted(self.postings[term]):
+                doc_ids.append(doc_id)
+                frequencies.append(frequency)
+            postings_offsets.append(len(doc_ids))
+        encoded_terms = [encoded_term for encoded_term, term in terms]
+
+        sections = [
+            HEADER.pack(MAGIC, len(documents), len(terms), len(doc_ids)),
+            pack_array(get_offsets(documents)),
+            pad(b''.join(documents)),
+            pack_array(get_offsets(encoded_terms)),
+            pad(b''.join(encoded_terms)),
+            pack_array(postings_offsets),
+            pack_array(doc_ids),
+            pack_array(frequencies),
+        ]
+        with atomic_write(path, 'wb') as f:
+            for section in sections:
+                f.write(section)
+
+
+class SearchIndex(object):
+    """
+    Read-only view of an index file. Nothing is loaded up front, lookups
+    read the memory-mapped file directly.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.document_count, self.term_count, postings_count = (
+            HEADER.unpack_from(self.data, 0))
+        if magic != MAGIC:
+            raise ValueError('{} is not a search index'.format(path))
+
+        position = HEADER.size
+        self.document_offsets = position
+        position += 4 * (self.document_count + 1)
+        self.document_blob = position
+        position += self.read_uint(
+            self.document_offsets, self.document_count)
+        position += -position % 4
+        self.term_offsets = position
+        position += 4 * (self.term_count + 1)
+        self.term_blob = position
+        position += self.read_uint(self.term_offsets, self.term_count)
+        position += -position % 4
+        self.postings_offsets = position
+        position += 4 * (self.term_count + 1)
+        self.doc_ids = position
+        position += 4 * postings_count
+        self.frequencies = position
+
+    def close(self):
+        self.data.close()
+
+    def __len__(self):
+        return self.document_count
+
+    def read_uint(self, array, index):
+        return struct.unpack_from('<I', self.data, array + 4 * index)[0]
+
+    def read_uints(self, array, start, stop):
+        return struct.unpack_from(
+            '<{}I'.format(stop - start), self.data, array + 4 * start)
+
+    def get_document(self, doc_id):
+        """
+        Return ``(path, title)`` of a document.
+        """
+        start, stop = self.read_uints(
+            self.document_offsets, doc_id, doc_id + 2)
+        document = self.data[
+            self.document_blob + start:self.document_blob + stop]
+        path, title = document.decode('utf-8').split(u'\0', 1)
+        return path, title
+
+    def get_term(self, term_id):
+        start, stop = self.read_uints(self.term_offsets, term_id, term_id + 2)
+        return self.data[self.term_blob + start:self.term_blob + stop]
+
+    def find_term(self, term):
+        """
+        Return the id of ``term`` or ``None``. Binary search over the sorted
+        term dictionary.
+        """
+        encoded_term = term.encode('utf-8')
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_term(middle) < encoded_term:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self.get_term(low) == encoded_term:
+            return low
+        return None
+
+    def terms(self):
+        for term_id in range(self.term_count):
+            yield self.get_term(term_id).decode('utf-8')
+
+    def get_postings(self, term_id):
+        start, stop = self.read_uints(
+            self.postings_offsets, term_id, term_id + 2)
+        return list(zip(
+            self.read_uints(self.doc_ids, start, stop),
+            self.read_uints(self.frequencies, start, stop)))
+
+    def lookup(self, term):
+        """
+        Return ``(doc_id, frequency)`` of all documents containing ``term``.
+        """
+        term_id = self.find_term(term.lower())
+        if term_id is None:
+            return []
+        return self.get_postings(term_id)
+
+    def score(self, query):
+        """
+        Return a dict mapping the ids of matching documents to their TF-IDF
+        score for ``query``.
+        """
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.lookup(term)
+            if not postings:
+                continue
+            idf = math.log(1 + float(self.document_count) / len(postings))
+            for doc_id, frequency in postings:
+                scores[doc_id] = scores.get(doc_id, 0) + frequency * idf
+        return scores
+
+    def search(self, query, limit=10):
+        """
+        Return up to ``limit`` ``(path, title, score)`` of the best matching
+        documents.
+        """
+        scores = self.score(query)
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [
+            self.get_document(doc_id) + (score,)
+            for doc_id, score in best[:limit]]
+
+
+def build_index(search_data_dir, path):
+    """
+    Write the index of all records in ``search_data_dir`` to ``path``.
+    """
+    writer = IndexWriter()
+    for record in iter_records(search_data_dir):
+        writer.add_record(record)
+    writer.write(path)
+    return len(writer.documents)
@@ -0,0 +1,77 @@
+"""
+Manifest of the content hashes of all search records, and the changes
+between two manifests. Consumers only have to reindex the pages listed in
+the changes.
+"""
+
+import hashlib
+import io
+import json
+import os
+
+from .files import atomic_write
+
+
+__all__ = (
+    'build_manifest', 'diff_manifests', 'load_manifest', 'write_json')
+
+
+def get_file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def build_manifest(search_data_dir):
+    """
+    Return a dict mapping the path of every page in ``search_data_dir`` to
+    the hash of its record.
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(search_data_dir):
+        for filename in files:
+            if not filename.endswith('.fjson'):
+                continue
+            record_file = os.path.join(root, filename)
+            path = os.path.relpath(
+                record_file[:-len('.fjson')], search_data_dir)
+            manifest[path.replace(os.sep, '/')] = get_file_hash(record_file)
+    return manifest
+
+
+def diff_manifests(old, new):
+    """
+    Return the sorted ``added``, ``changed`` and ``removed`` pages between
+    the manifests ``old`` and ``new``.
+    """
+    return {
+        'added': sorted(path for path in new if path not in old),
+        'changed': sorted(
+            path for path in new if path in old and old[path] != new[path]),
+        'removed': sorted(path for path in old if path not in new),
+    }
+
+
+def load_manifest(path):
+    """
+    Return the manifest stored at ``path``, or an empty one if there is
+    none.
+    """
+    try:
+        with io.open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_json(path, data):
+    """
+    Write ``data`` as JSON to ``path``. The file is replaced atomically.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with atomic_write(path) as f:
+        json.dump(data, f, sort_keys=True, indent=2)
@@ -0,0 +1,104 @@
+/*
+ * Loads the search index of Sphinx's search page from the shards written by
+ * readthedocs_build.search.shards. The manifest is loaded on page load, the
+ * objects file and the shards of the query's words right before each query
+ * runs.
+ */
+(function () {
+  var root = (window.DOCUMENTATION_OPTIONS && DOCUMENTATION_OPTIONS.URL_ROOT) || '';
+  var shardRoot = root + '_static/searchindex/';
+  var manifest = null;
+  var index = null;
+  var loaded = {};
+  var objectsLoaded = null;
+  var originalQuery = Search.query;
+
+  function fetchJSON(url) {
+    return fetch(url).then(function (response) {
+      if (!response.ok) {
+        throw new Error('Could not load ' + url);
+      }
+      return response.json();
+    });
+  }
+
+  function getWords(query) {
+    var stemmer = typeof Stemmer === 'undefined' ? null : new Stemmer();
+    var words = [];
+    query.toLowerCase().split(/[^\w\u00c0-\uffff]+/).forEach(function (word) {
+      if (!word) {
+        return;
+      }
+      words.push(word);
+      if (stemmer) {
+        words.push(stemmer.stemWord(word));
+      }
+    });
+    return words;
+  }
+
+  function loadObjects() {
+    if (!manifest.objects_file) {
+      return Promise.resolve();
+    }
+    if (!objectsLoaded) {
+      objectsLoaded = fetchJSON(shardRoot + manifest.objects_file).then(
+        function (objects) {
+          for (var name in objects) {
+            index[name] = objects[name];
+          }
+        });
+    }
+    return objectsLoaded;
+  }
+
+  function loadShards(query) {
+    getWords(query).forEach(function (word) {
+      var key = word.substr(0, manifest.prefix_length);
+      if (manifest.shards[key] && !loaded[key]) {
+        loaded[key] = fetchJSON(shardRoot + manifest.shards[key]).then(
+          function (shard) {
+            ['terms', 'titleterms'].forEach(function (name) {
+              for (var term in shard[name]) {
+                index[name][term] = shard[name][term];
+              }
+            });
+          });
+      }
+    });
+    // Also wait for shards that an earlier query is still loading.
+    return Promise.all(Object.keys(loaded).map(function (key) {
+      return loaded[key];
+    }));
+  }
+
+  var manifestLoaded = fetchJSON(shardRoot + 'manifest.json').then(
+    function (data) {
+      manifest = data;
+      index = {};
+      for (var name in data) {
+        if (['shards', 'prefix_length', 'objects_file'].indexOf(name) < 0) {
+          index[name] = data[name];
+        }
+      }
+      index.terms = {};
+      index.titleterms = {};
+    });
+
+  Search.loadIndex = function () {
+    manifestLoaded.then(function () {
+      Search.setIndex(index);
+    });
+  };
+
+  Search.query = function (query) {
+    var search = this;
+    manifestLoaded.then(function () {
+      return Promise.all([loadObjects(), loadShards(query)]);
+    }).then(function () {
+      originalQuery.call(search, query);
+    });
+  };
+
+  Search.loadIndex();
+})();
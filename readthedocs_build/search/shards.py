@@ -0,0 +1,240 @@
+"""
+Split Sphinx's ``searchindex.js`` into shards that the search page loads on
+demand.
+
+``_static/searchindex/manifest.json`` contains the documents and the
+object types of the index, plus the name of the shard of every term prefix.
+Each shard contains the terms and title terms starting with its prefix.
+The ``objects``, ``alltitles`` and ``indexentries`` are matched anywhere in
+their names, so they can't be sharded by prefix. They are moved into
+``_static/searchindex/objects.json``. ``_static/searchindex-loader.js``
+loads the manifest with the page. The objects file and the shards of the
+query's words are only loaded when a query runs.
+
+Sphinx also matches query words inside of other terms. With shards, those
+partial matches are only found among the terms of the loaded shards.
+"""
+
+import binascii
+import io
+import json
+import os
+import pkgutil
+import re
+import shutil
+
+from six import text_type
+
+
+__all__ = ('ShardError', 'load_searchindex', 'shard_searchindex')
+
+
+SEARCHINDEX_RE = re.compile(
+    r'^\s*Search\.setIndex\((.*)\)\s*;?\s*$', re.DOTALL)
+
+SEARCHINDEX_SCRIPT_RE = re.compile(
+    r'<script[^>]*src="[^"]*searchindex\.js"[^>]*>\s*</script>')
+
+LOAD_INDEX_RE = re.compile(r'Search\.loadIndex\([^)]*\);?')
+
+LOADER_FILENAME = 'searchindex-loader.js'
+
+SHARDED_KEYS = ('terms', 'titleterms')
+
+# Keys of the index that are loaded with the first query.
+OBJECT_KEYS = ('objects', 'alltitles', 'indexentries')
+
+OBJECTS_FILENAME = 'objects.json'
+
+
+class ShardError(Exception):
+    pass
+
+
+class JavaScriptParser(object):
+    """
+    Parser for the JavaScript literals that Sphinx writes. Older Sphinx
+    versions don't quote object keys, so the index is not always JSON.
+    """
+
+    number_re = re.compile(r'-?\d+(\.\d+)?([eE][+-]?\d+)?')
+    name_re = re.compile(r'[A-Za-z_$][\w$]*')
+    whitespace_re = re.compile(r'\s*')
+    string_re = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+
+    def __init__(self, source):
+        self.source = source
+        self.position = 0
+
+    def fail(self, message):
+        raise ShardError('{message} at position {position}'.format(
+            message=message, position=self.position))
+
+    def skip_whitespace(self):
+        self.position = self.whitespace_re.match(
+            self.source, self.position).end()
+
+    def peek(self):
+        self.skip_whitespace()
+        if self.position >= len(self.source):
+            self.fail('Unexpected end')
+        return self.source[self.position]
+
+    def expect(self, character):
+        if self.peek() != character:
+            self.fail('Expected {!r}'.format(character))
+        self.position += 1
+
+    def parse(self):
+        value = self.parse_value()
+        self.skip_whitespace()
+        if self.position != len(self.source):
+            self.fail('Unexpected data')
+        return value
+
+    def parse_value(self):
+        character = self.peek()
+        if character == '{':
+            return self.parse_object()
+        if character == '[':
+            return self.parse_array()
+        if character == '"':
+            return self.parse_string()
+        match = self.number_re.match(self.source, self.position)
+        if match:
+            self.position = match.end()
+            return json.loads(match.group())
+        match = self.name_re.match(self.source, self.position)
+        constants = {'true': True, 'false': False, 'null': None}
+        if match and match.group() in constants:
+            self.position = match.end()
+            return constants[match.group()]
+        self.fail('Unexpected value')
+
+    def parse_string(self):
+        match = self.string_re.match(self.source, self.position)
+        if not match:
+            self.fail('Unterminated string')
+        self.position = match.end()
+        return json.loads(match.group())
+
+    def parse_key(self):
+        if self.peek() == '"':
+            return self.parse_string()
+        match = self.name_re.match(self.source, self.position)
+        if not match:
+            self.fail('Expected key')
+        self.position = match.end()
+        return match.group()
+
+    def parse_object(self):
+        self.expect('{')
+        result = {}
+        if self.peek() == '}':
+            self.position += 1
+            return result
+        while True:
+            key = self.parse_key()
+            self.expect(':')
+            result[key] = self.parse_value()
+            if self.peek() == ',':
+                self.position += 1
+                continue
+            self.expect('}')
+            return result
+
+    def parse_array(self):
+        self.expect('[')
+        result = []
+        if self.peek() == ']':
+            self.position += 1
+            return result
+        while True:
+            result.append(self.parse_value())
+            if self.peek() == ',':
+                self.position += 1
+                continue
+            self.expect(']')
+            return result
+
+
+def parse_searchindex(source):
+    match = SEARCHINDEX_RE.match(source)
+    if not match:
+        raise ShardError('Not a Sphinx search index')
+    return JavaScriptParser(match.group(1)).parse()
+
+
+def load_searchindex(path):
+    with io.open(path, encoding='utf-8') as f:
+        return parse_searchindex(f.read())
+
+
+def get_shard_key(term, prefix_length):
+    return term[:prefix_length]
+
+
+def get_shard_filename(key):
+    # Prefixes may contain any character, keep the filenames portable.
+    return '{}.json'.format(
+        binascii.hexlify(key.encode('utf-8')).decode('ascii') or '_')
+
+
+def dump_json(path, data):
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(text_type(json.dumps(
+            data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)))
+
+
+def patch_search_page(search_page):
+    """
+    Replace loading ``searchindex.js`` with the shard loader.
+    """
+    with io.open(search_page, encoding='utf-8') as f:
+        content = f.read()
+    content = SEARCHINDEX_SCRIPT_RE.sub('', content)
+    content = LOAD_INDEX_RE.sub('', content)
+    loader = '<script src="_static/{}"></script>\n'.format(LOADER_FILENAME)
+    content = content.replace('</body>', loader + '</body>', 1)
+    with io.open(search_page, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def shard_searchindex(html_dir, prefix_length=2):
+    """
+    Shard the ``searchindex.js`` of the HTML output in ``html_dir``. The
+    original index is kept. Returns the number of shards.
+    """
+    index = load_searchindex(os.path.join(html_dir, 'searchindex.js'))
+    shards = {}
+    for sharded_key in SHARDED_KEYS:
+        for term, documents in index.pop(sharded_key, {}).items():
+            shard = shards.setdefault(
+                get_shard_key(term, prefix_length),
+                dict((key, {}) for key in SHARDED_KEYS))
+            shard[sharded_key][term] = documents
+
+    shard_dir = os.path.join(html_dir, '_static', 'searchindex')
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(shard_dir)
+    manifest = dict(index)
+    objects = dict(
+        (key, manifest.pop(key)) for key in OBJECT_KEYS if key in manifest)
+    if objects:
+        dump_json(os.path.join(shard_dir, OBJECTS_FILENAME), objects)
+        manifest['objects_file'] = OBJECTS_FILENAME
+    manifest['prefix_length'] = prefix_length
+    manifest['shards'] = {}
+    for key, shard in shards.items():
+        filename = get_shard_filename(key)
+        dump_json(os.path.join(shard_dir, filename), shard)
+        manifest['shards'][key] = filename
+    dump_json(os.path.join(shard_dir, 'manifest.json'), manifest)
+
+    loader = pkgutil.get_data(__name__.rsplit('.', 1)[0], LOADER_FILENAME)
+    with open(os.path.join(html_dir, '_static', LOADER_FILENAME), 'wb') as f:
+        f.write(loader)
+    search_page = os.path.join(html_dir, 'search.html')
+    if os.path.exists(search_page):
+        patch_search_page(search_page)
+    return len(shards)
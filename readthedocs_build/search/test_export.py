@@ -0,0 +1,106 @@
+from six.moves import BaseHTTPServer
+import gzip
+import io
+import json
+import threading
+
+from .export import BulkWriter
+from .export import DirectorySink
+from .export import HttpSink
+from .export import export_search_data
+from .test_index import write_records
+
+
+RECORDS = [
+    {'path': 'index', 'title': 'Welcome', 'body': 'Hello'},
+    {'path': 'guide/install', 'title': 'Install', 'body': 'pip install'},
+    {'path': 'guide/usage', 'title': 'Usage', 'body': 'Use it'},
+]
+
+
+def read_lines(data):
+    return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+
+class BulkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.requests.append((self.headers, body))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def describe_export_search_data():
+    def it_writes_bulk_lines(tmpdir):
+        write_records(tmpdir.join('search_data'), RECORDS)
+        chunks = export_search_data(
+            str(tmpdir.join('search_data')),
+            DirectorySink(str(tmpdir.join('export'))),
+            'docs')
+        assert chunks == ['bulk-00001.ndjson']
+        lines = read_lines(tmpdir.join('export', chunks[0]).read('rb'))
+        assert lines[0] == {'index': {'_id': 'docs/index'}}
+        assert lines[1] == dict(RECORDS[0], project='docs')
+        assert len(lines) == 6
+
+    def it_splits_chunks_by_size(tmpdir):
+        write_records(tmpdir.join('search_data'), RECORDS)
+        chunks = export_search_data(
+            str(tmpdir.join('search_data')),
+            DirectorySink(str(tmpdir.join('export'))),
+            'docs',
+            max_bytes=200)
+        assert chunks == [
+            'bulk-00001.ndjson', 'bulk-00002.ndjson', 'bulk-00003.ndjson']
+        for chunk in chunks:
+            assert tmpdir.join('export', chunk).size() <= 200
+        assert sorted(
+            path.basename for path in tmpdir.join('export').listdir()
+        ) == chunks
+
+    def it_compresses_chunks(tmpdir):
+        write_records(tmpdir.join('search_data'), RECORDS)
+        chunks = export_search_data(
+            str(tmpdir.join('search_data')),
+            DirectorySink(str(tmpdir.join('export'))),
+            'docs',
+            compress=True)
+        assert chunks == ['bulk-00001.ndjson.gz']
+        with gzip.open(str(tmpdir.join('export', chunks[0]))) as f:
+            assert len(read_lines(f.read())) == 6
+
+    def it_posts_chunks_to_url(tmpdir):
+        write_records(tmpdir.join('search_data'), RECORDS)
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), BulkHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        del BulkHandler.requests[:]
+        try:
+            url = 'http://127.0.0.1:{}/_bulk'.format(server.server_port)
+            export_search_data(
+                str(tmpdir.join('search_data')), HttpSink(url), 'docs',
+                max_bytes=300, compress=True)
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert len(BulkHandler.requests) == 2
+        headers, body = BulkHandler.requests[0]
+        assert headers.get('Content-Type') == 'application/x-ndjson'
+        assert headers.get('Content-Encoding') == 'gzip'
+        lines = read_lines(gzip.GzipFile(fileobj=io.BytesIO(body)).read())
+        assert lines[0] == {'index': {'_id': 'docs/index'}}
+
+
+def test_directory_sink_removes_old_chunks(tmpdir):
+    tmpdir.join('bulk-00009.ndjson').write('')
+    writer = BulkWriter(DirectorySink(str(tmpdir)))
+    writer.write('docs/index', {'path': 'index'})
+    assert writer.close() == ['bulk-00001.ndjson']
+    assert [path.basename for path in tmpdir.listdir()] == [
+        'bulk-00001.ndjson']
@@ -0,0 +1,132 @@
+import fcntl
+import json
+import os
+import threading
+
+from .global_index import GlobalIndex
+from .global_index import READERS_LOCK
+from .global_index import find_projects
+from .manifest import build_manifest
+from .manifest import write_json
+
+
+def write_project(output_base, name, records):
+    search_data = output_base.join(name, 'search_data')
+    if search_data.exists():
+        search_data.remove()
+    for record in records:
+        search_data.join(record['path'] + '.fjson').write(
+            json.dumps(record), ensure=True)
+    write_json(
+        str(search_data.join('manifest.json')),
+        build_manifest(str(search_data)))
+    return str(search_data)
+
+
+def get_paths(results):
+    return [(project, path) for project, path, title, score in results]
+
+
+def describe_global_index():
+    def it_searches_all_projects(tmpdir):
+        index = GlobalIndex(str(tmpdir.join('index')))
+        index.add_project('one', write_project(tmpdir, 'one', [
+            {'path': 'index', 'title': 'One', 'body': 'install one'}]))
+        index.add_project('two', write_project(tmpdir, 'two', [
+            {'path': 'index', 'title': 'Two', 'body': 'install install'}]))
+        assert get_paths(index.search('install')) == [
+            ('two', 'index'), ('one', 'index')]
+        assert get_paths(index.search('one')) == [('one', 'index')]
+
+    def it_rewrites_only_changed_project(tmpdir):
+        index = GlobalIndex(str(tmpdir.join('index')))
+        one = write_project(tmpdir, 'one', [
+            {'path': 'index', 'title': 'One', 'body': 'old'}])
+        index.add_project('one', one)
+        index.add_project('two', write_project(tmpdir, 'two', [
+            {'path': 'index', 'title': 'Two', 'body': 'old'}]))
+        segments = tmpdir.join('index', 'segments')
+        files = set(segments.listdir())
+
+        assert not index.add_project('one', one)
+        assert set(segments.listdir()) == files
+
+        index.add_project('one', write_project(tmpdir, 'one', [
+            {'path': 'index', 'title': 'One', 'body': 'new'}]))
+        assert len(set(segments.listdir()) - files) == 1
+        assert len(files - set(segments.listdir())) == 1
+        assert get_paths(index.search('old')) == [('two', 'index')]
+        assert get_paths(index.search('new')) == [('one', 'index')]
+
+    def it_removes_project(tmpdir):
+        index = GlobalIndex(str(tmpdir.join('index')))
+        index.add_project('one', write_project(tmpdir, 'one', [
+            {'path': 'index', 'title': 'One', 'body': 'text'}]))
+        index.remove_project('one')
+        assert index.search('text') == []
+        assert tmpdir.join('index', 'segments').listdir() == []
+
+
+def describe_readers():
+    def it_keeps_open_segments_readable(tmpdir):
+        index = GlobalIndex(str(tmpdir.join('index')))
+        index.add_project('one', write_project(tmpdir, 'one', [
+            {'path': 'index', 'title': 'One', 'body': 'text'}]))
+        state, indexes = index.open_segments()
+        index.remove_project('one')
+        assert tmpdir.join('index', 'segments').listdir() == []
+        results = indexes[0].search('text')
+        assert [path for path, title, score in results] == ['one\x1findex']
+        indexes[0].close()
+
+    def it_removes_segments_after_readers_opened_them(tmpdir):
+        index = GlobalIndex(str(tmpdir.join('index')))
+        index.add_project('one', write_project(tmpdir, 'one', [
+            {'path': 'index', 'title': 'One', 'body': 'text'}]))
+        segments = tmpdir.join('index', 'segments')
+        with index.lock(READERS_LOCK, fcntl.LOCK_SH):
+            remove = threading.Thread(
+                target=index.remove_project, args=('one',))
+            remove.start()
+            remove.join(0.2)
+            assert remove.is_alive()
+            assert len(segments.listdir()) == 1
+        remove.join()
+        assert segments.listdir() == []
+        assert index.search('text') == []
+
+
+def describe_compaction():
+    def it_merges_segments_and_drops_deleted_documents(tmpdir):
+        index = GlobalIndex(str(tmpdir.join('index')), max_segments=2)
+        for name in ('one', 'two', 'three'):
+            index.add_project(name, write_project(tmpdir, name, [
+                {'path': 'index', 'title': name, 'body': 'common'},
+                {'path': 'other', 'title': 'Other', 'body': name}]))
+        assert index.compact_in_background().join() is None
+        assert len(tmpdir.join('index', 'segments').listdir()) == 1
+        assert len(get_paths(index.search('common'))) == 3
+
+        index.add_project('two', write_project(tmpdir, 'two', [
+            {'path': 'index', 'title': 'two', 'body': 'changed'}]))
+        assert index.compact_in_background() is None
+        assert get_paths(index.search('common')) == [
+            ('one', 'index'), ('three', 'index')]
+        assert index.compact()
+        assert len(tmpdir.join('index', 'segments').listdir()) == 1
+        assert get_paths(index.search('common')) == [
+            ('one', 'index'), ('three', 'index')]
+        assert get_paths(index.search('changed two')) == [
+            ('two', 'index')]
+        assert get_paths(index.search('three')) == [
+            ('three', 'index'), ('three', 'other')]
+
+
+def test_find_projects(tmpdir):
+    tmpdir.join('docs', 'search_data').ensure(dir=True)
+    tmpdir.join('api', 'docs', 'search_data', 'sub').ensure(dir=True)
+    tmpdir.join('nothing', 'html').ensure(dir=True)
+    assert find_projects(str(tmpdir)) == {
+        'docs': os.path.join(str(tmpdir), 'docs', 'search_data'),
+        'api/docs': os.path.join(str(tmpdir), 'api', 'docs', 'search_data'),
+    }
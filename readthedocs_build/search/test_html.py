@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from multiprocessing import Pool
+import json
+
+from .html import iter_pages
+from .html import parse_page
+from .html import write_search_data
+
+
+PAGE = u'''<!DOCTYPE html>
+<html>
+  <head>
+    <title>Installation — Project 1.0 documentation</title>
+    <script>var ignored = 1;</script>
+  </head>
+  <body>
+    <div class="sphinxsidebar">Sidebar</div>
+    <div class="body" role="main">
+      <div class="section" id="installation">
+        <h1>Installation<a class="headerlink" href="#installation">¶</a></h1>
+        <p>Run <code>pip&nbsp;install</code> &amp; enjoy.</p>
+        <div class="section" id="requirements">
+          <h2>Requirements<a class="headerlink" href="#req">¶</a></h2>
+          <p>Python<br/>only.</p>
+        </div>
+      </div>
+    </div>
+    <div class="footer">Footer</div>
+  </body>
+</html>
+'''
+
+
+def write_page(tmpdir, path, content=PAGE):
+    tmpdir.join(path).write_text(content, encoding='utf-8', ensure=True)
+    return str(tmpdir.join(path))
+
+
+def describe_parse_page():
+    def it_extracts_sections(tmpdir):
+        record = parse_page(write_page(tmpdir, 'install.html'), 'install')
+        assert record['path'] == 'install'
+        assert record['title'] == 'Installation'
+        assert record['sections'] == [
+            {
+                'id': 'installation',
+                'title': 'Installation',
+                'content': 'Run pip install & enjoy.',
+            },
+            {
+                'id': 'requirements',
+                'title': 'Requirements',
+                'content': 'Python only.',
+            },
+        ]
+        assert record['body'] == (
+            'Installation Run pip install & enjoy. Requirements Python only.')
+
+    def it_credits_text_after_subsections_to_the_parent(tmpdir):
+        html_file = write_page(
+            tmpdir, 'page.html',
+            u'<div role="main"><section id="top"><h1>Top</h1><p>before</p>'
+            u'<section id="sub"><h2>Sub</h2><p>in sub</p></section>'
+            u'<p>after sub</p></section></div>')
+        record = parse_page(html_file, 'page')
+        assert record['sections'] == [
+            {'id': 'top', 'title': 'Top', 'content': 'before after sub'},
+            {'id': 'sub', 'title': 'Sub', 'content': 'in sub'},
+        ]
+
+    def it_supports_html5_sections(tmpdir):
+        html_file = write_page(
+            tmpdir, 'page.html',
+            u'<div itemprop="articleBody"><section id="intro">'
+            u'<h1>Intro</h1><p>Text</p></section></div>')
+        record = parse_page(html_file, 'page')
+        assert record['sections'] == [
+            {'id': 'intro', 'title': 'Intro', 'content': 'Text'}]
+
+    def it_falls_back_to_html_title(tmpdir):
+        html_file = write_page(
+            tmpdir, 'page.html',
+            u'<title>Page — Project</title>'
+            u'<div role="main"><p>No headings</p></div>')
+        record = parse_page(html_file, 'page')
+        assert record['title'] == 'Page'
+        assert record['body'] == 'No headings'
+
+
+def test_iter_pages_skips_generated_files(tmpdir):
+    for path in ('index.html', 'guide/install.html', 'genindex.html',
+                 'search.html', '_static/page.html', 'objects.inv'):
+        write_page(tmpdir, path)
+    assert [path for html_file, path in iter_pages(str(tmpdir))] == [
+        'index', 'guide/install']
+
+
+def test_write_search_data(tmpdir):
+    html_dir = tmpdir.mkdir('html')
+    for path in ('index.html', 'guide/install.html', 'guide/usage.html'):
+        write_page(html_dir, path)
+    out_dir = tmpdir.join('search_data')
+    paths = write_search_data(str(html_dir), str(out_dir), processes=2)
+    assert paths == ['index', 'guide/install', 'guide/usage']
+    record = json.loads(out_dir.join('guide', 'install.fjson').read())
+    assert record['path'] == 'guide/install'
+    assert record['title'] == 'Installation'
+
+
+def write_in_worker(args):
+    html_dir, out_dir = args
+    return write_search_data(html_dir, out_dir, processes=2)
+
+
+def test_write_search_data_in_daemonic_worker(tmpdir):
+    html_dir = tmpdir.mkdir('html')
+    for path in ('index.html', 'usage.html'):
+        write_page(html_dir, path)
+    out_dir = tmpdir.join('search_data')
+    pool = Pool(processes=1)
+    try:
+        paths = pool.map(write_in_worker, [(str(html_dir), str(out_dir))])
+    finally:
+        pool.close()
+        pool.join()
+    assert paths == [['index', 'usage']]
+    assert out_dir.join('usage.fjson').exists()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from click.testing import CliRunner
+import json
+import os
+import stat
+
+from .benchmark import main as benchmark
+from .index import IndexWriter
+from .index import SearchIndex
+from .index import build_index
+from .index import tokenize
+
+
+def write_records(search_data_dir, records):
+    for record in records:
+        search_data_dir.join(record['path'] + '.fjson').write(
+            json.dumps(record), ensure=True)
+
+
+RECORDS = [
+    {'path': 'index', 'title': 'Welcome', 'body': 'Install the package.'},
+    {'path': 'guide/install', 'title': u'Installation',
+     'body': 'Install with pip. Install often.'},
+    {'path': 'guide/usage', 'title': 'Usage', 'body': u'Use it. Café.'},
+]
+
+
+def test_tokenize():
+    assert tokenize(u'Hello, World! Café_1') == ['hello', 'world', u'café_1']
+
+
+def describe_search_index():
+    def it_looks_up_postings(tmpdir):
+        write_records(tmpdir.join('search_data'), RECORDS)
+        path = str(tmpdir.join('search.idx'))
+        assert build_index(str(tmpdir.join('search_data')), path) == 3
+        index = SearchIndex(path)
+        assert len(index) == 3
+        assert index.get_document(1) == ('guide/install', 'Installation')
+        assert index.lookup('install') == [(0, 1), (1, 2)]
+        assert index.lookup('Installation') == [(1, 3)]
+        assert index.lookup(u'café') == [(2, 1)]
+        assert index.lookup('missing') == []
+        index.close()
+
+    def it_ranks_results(tmpdir):
+        write_records(tmpdir.join('search_data'), RECORDS)
+        path = str(tmpdir.join('search.idx'))
+        build_index(str(tmpdir.join('search_data')), path)
+        index = SearchIndex(path)
+        results = index.search('install package')
+        assert [(doc_path, title) for doc_path, title, score in results] == [
+            ('index', 'Welcome'),
+            ('guide/install', 'Installation'),
+        ]
+        assert index.search('install', limit=1)[0][0] == 'guide/install'
+        index.close()
+
+    def it_lists_terms_in_order(tmpdir):
+        writer = IndexWriter()
+        writer.add_document('a', '', 'b a c a')
+        path = str(tmpdir.join('search.idx'))
+        writer.write(path)
+        index = SearchIndex(path)
+        assert list(index.terms()) == ['a', 'b', 'c']
+        assert index.lookup('a') == [(0, 2)]
+        index.close()
+
+    def it_writes_empty_index(tmpdir):
+        path = str(tmpdir.join('search.idx'))
+        IndexWriter().write(path)
+        index = SearchIndex(path)
+        assert len(index) == 0
+        assert index.search('anything') == []
+        index.close()
+
+    def it_writes_index_readable_by_others(tmpdir):
+        path = str(tmpdir.join('search.idx'))
+        umask = os.umask(0o022)
+        try:
+            IndexWriter().write(path)
+        finally:
+            os.umask(umask)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+        assert tmpdir.listdir() == [tmpdir.join('search.idx')]
+
+
+def test_benchmark(tmpdir):
+    write_records(tmpdir, RECORDS)
+    result = CliRunner().invoke(
+        benchmark, ['index', str(tmpdir), 'install', '--repeat', '1'])
+    assert result.exit_code == 0, result.output
+    assert "'install': scan" in result.output
@@ -0,0 +1,46 @@
+import os
+import stat
+
+from .manifest import build_manifest
+from .manifest import diff_manifests
+from .manifest import load_manifest
+from .manifest import write_json
+
+
+def test_build_manifest(tmpdir):
+    tmpdir.join('index.fjson').write('{"path": "index"}')
+    tmpdir.join('guide', 'install.fjson').write('{}', ensure=True)
+    tmpdir.join('manifest.json').write('{}')
+    manifest = build_manifest(str(tmpdir))
+    assert sorted(manifest) == ['guide/install', 'index']
+    assert manifest['guide/install'] == (
+        '44136fa355b3678a1146ad16f7e8649e94fb4fc21fe77e8310c060f61caaff8a')
+
+
+def test_diff_manifests():
+    old = {'index': 'a', 'install': 'b', 'usage': 'c'}
+    new = {'index': 'a', 'install': 'changed', 'api': 'd'}
+    assert diff_manifests(old, new) == {
+        'added': ['api'],
+        'changed': ['install'],
+        'removed': ['usage'],
+    }
+
+
+def describe_load_manifest():
+    def it_loads_written_manifest(tmpdir):
+        path = str(tmpdir.join('state', 'docs.json'))
+        write_json(path, {'index': 'a'})
+        assert load_manifest(path) == {'index': 'a'}
+
+    def it_writes_manifest_readable_by_others(tmpdir):
+        path = str(tmpdir.join('manifest.json'))
+        umask = os.umask(0o022)
+        try:
+            write_json(path, {'index': 'a'})
+        finally:
+            os.umask(umask)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+    def it_returns_empty_manifest_if_missing(tmpdir):
+        assert load_manifest(str(tmpdir.join('missing.json'))) == {}
@@ -0,0 +1,99 @@
+import json
+
+from click.testing import CliRunner
+from pytest import raises
+
+from .benchmark import main as benchmark
+from .shards import ShardError
+from .shards import load_searchindex
+from .shards import shard_searchindex
+
+
+# Written like Sphinx' jsdump, object keys are not quoted.
+SEARCHINDEX = (
+    'Search.setIndex({docnames:["index","install"],'
+    'filenames:["index.rst","install.rst"],objects:{"":{pip:[1,0,1,"-"]}},'
+    'alltitles:{Install:[[1,null]]},indexentries:{},'
+    'terms:{instal:1,index:[0,1],"caf\\u00e9":0,pip:1},'
+    'titleterms:{instal:1,welcom:0},titles:["Welcome","Install"],'
+    'envversion:52,objnames:{},objtypes:{},value:-1.5e3,flag:true})')
+
+SEARCH_PAGE = (
+    '<html><head>'
+    '<script type="text/javascript" src="_static/searchtools.js"></script>'
+    '<script type="text/javascript">'
+    'jQuery(function() { Search.loadIndex("searchindex.js"); });'
+    '</script>'
+    '<script type="text/javascript" src="searchindex.js" defer></script>'
+    '</head><body></body></html>')
+
+
+def create_html(tmpdir):
+    tmpdir.join('searchindex.js').write(SEARCHINDEX)
+    tmpdir.join('search.html').write(SEARCH_PAGE)
+    tmpdir.mkdir('_static')
+    return tmpdir
+
+
+def describe_load_searchindex():
+    def it_parses_javascript_literals(tmpdir):
+        create_html(tmpdir)
+        index = load_searchindex(str(tmpdir.join('searchindex.js')))
+        assert index['terms'] == {
+            'instal': 1, 'index': [0, 1], u'caf\xe9': 0, 'pip': 1}
+        assert index['value'] == -1500
+        assert index['flag'] is True
+
+    def it_rejects_other_files(tmpdir):
+        tmpdir.join('searchindex.js').write('var x = 1;')
+        with raises(ShardError):
+            load_searchindex(str(tmpdir.join('searchindex.js')))
+
+
+def describe_shard_searchindex():
+    def it_writes_shards_and_manifest(tmpdir):
+        create_html(tmpdir)
+        assert shard_searchindex(str(tmpdir)) == 4
+        shard_dir = tmpdir.join('_static', 'searchindex')
+        manifest = json.loads(shard_dir.join('manifest.json').read())
+        assert 'terms' not in manifest
+        assert 'objects' not in manifest
+        assert 'alltitles' not in manifest
+        assert manifest['objects_file'] == 'objects.json'
+        objects = json.loads(shard_dir.join('objects.json').read())
+        assert objects == {
+            'objects': {'': {'pip': [1, 0, 1, '-']}},
+            'alltitles': {'Install': [[1, None]]},
+            'indexentries': {},
+        }
+        assert manifest['titles'] == ['Welcome', 'Install']
+        assert manifest['prefix_length'] == 2
+        assert sorted(manifest['shards']) == [
+            'ca', 'in', 'pi', 'we']
+        shard = json.loads(shard_dir.join(manifest['shards']['in']).read())
+        assert shard == {
+            'terms': {'instal': 1, 'index': [0, 1]},
+            'titleterms': {'instal': 1},
+        }
+        assert tmpdir.join('searchindex.js').exists()
+
+    def it_patches_search_page(tmpdir):
+        create_html(tmpdir)
+        shard_searchindex(str(tmpdir))
+        search_page = tmpdir.join('search.html').read()
+        assert 'searchindex.js' not in search_page
+        assert 'Search.loadIndex' not in search_page
+        assert '_static/searchtools.js' in search_page
+        assert (
+            '<script src="_static/searchindex-loader.js"></script>'
+            in search_page)
+        assert tmpdir.join('_static', 'searchindex-loader.js').exists()
+
+
+def test_benchmark(tmpdir):
+    create_html(tmpdir)
+    result = CliRunner().invoke(
+        benchmark, ['shards', str(tmpdir), 'install', '--repeat', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'manifest: ' in result.output
+    assert "'install': 3 files" in result.output
@@ -1,8 +1,16 @@
 from mock import patch
 from mock import Mock
+from pytest import raises
+import os
 
 from .build import build
+from .build import build_group
+from .build import build_stages
+from .build import group_by_environment
 from .builder import builder_types
+from .builder.host import RunningBuilds
+from .builder.timing import TimingReport
+from .scheduler import Stage
 
 
 def test_build_triggers_sphinx_builder(tmpdir):
@@ -16,3 +24,237 @@ def test_build_triggers_sphinx_builder(tmpdir):
             build(project_config)
             sphinx_mock.assert_called_with(build_config=project_config[0])
             sphinx_mock.build.assert_called_with()
+
+
+def get_project_config(tmpdir):
+    def build_config(name, python):
+        return {
+            'name': name,
+            'type': 'sphinx',
+            'python': python,
+            'output_base': str(tmpdir),
+        }
+    return [
+        build_config('en', {'version': 2}),
+        build_config('de', {'version': 2}),
+        build_config('api', {'version': 3}),
+    ]
+
+
+def test_group_by_environment(tmpdir):
+    project_config = get_project_config(tmpdir)
+    groups = group_by_environment(project_config)
+    assert [[c['name'] for c in group] for group in groups] == [
+        ['en', 'de'],
+        ['api'],
+    ]
+
+
+def test_build_returns_timing_reports(tmpdir):
+    project_config = get_project_config(tmpdir)[:1]
+    sphinx_mock = Mock()
+    sphinx_mock.return_value.build.return_value = {'name': 'en'}
+    with patch.dict(builder_types, {'sphinx': sphinx_mock}):
+        assert build(project_config) == [{'name': 'en'}]
+
+
+def test_build_refills_virtualenv_pools_after_the_builds(tmpdir):
+    project_config = get_project_config(tmpdir)[:1]
+    sphinx_mock = Mock()
+    calls = []
+    sphinx_mock.return_value.build.side_effect = lambda: calls.append('build')
+    sphinx_mock.return_value.refill_virtualenv_pool.side_effect = (
+        lambda: calls.append('refill'))
+    with patch.dict(builder_types, {'sphinx': sphinx_mock}):
+        build(project_config)
+    assert calls == ['build', 'refill']
+
+
+def test_build_refills_each_virtualenv_pool_once(tmpdir):
+    project_config = get_project_config(tmpdir)
+    for build_config in project_config:
+        build_config['venv_pool'] = {'path': str(tmpdir), 'versions': [3]}
+    sphinx_mock = Mock()
+    with patch.dict(builder_types, {'sphinx': sphinx_mock}):
+        build(project_config)
+    assert sphinx_mock.return_value.refill_virtualenv_pool.call_count == 1
+
+
+def describe_build_group():
+    def it_shares_one_virtualenv(tmpdir):
+        en, de, api = get_project_config(tmpdir)
+        sphinx_mock = Mock()
+        with patch.dict(builder_types, {'sphinx': sphinx_mock}):
+            build_group([en, de])
+            owner = sphinx_mock.return_value
+            sphinx_mock.assert_any_call(build_config=en)
+            sphinx_mock.assert_any_call(build_config=en, venv=owner.venv)
+            sphinx_mock.assert_any_call(build_config=de, venv=owner.venv)
+            owner.setup.assert_called_once_with()
+            owner.cleanup.assert_called_once_with()
+
+    def it_writes_one_log_per_config(tmpdir):
+        en, de, api = get_project_config(tmpdir)
+
+        class Builder(object):
+            venv = None
+
+            def __init__(self, build_config, venv=None):
+                self.build_config = build_config
+                self.timings = TimingReport(build_config['name'])
+
+            def setup(self):
+                os.system('echo setup')
+
+            def build(self):
+                os.system('echo build {}'.format(self.build_config['name']))
+
+            def cleanup(self):
+                pass
+
+        with patch.dict(builder_types, {'sphinx': Builder}):
+            build_group([en, de])
+        assert tmpdir.join('en', 'build.log').read() == 'setup\nbuild en\n'
+        assert tmpdir.join('de', 'build.log').read() == 'build de\n'
+
+    def it_cleans_up_on_error(tmpdir):
+        en, de, api = get_project_config(tmpdir)
+        sphinx_mock = Mock()
+        sphinx_mock.return_value.build.side_effect = ValueError
+        with patch.dict(builder_types, {'sphinx': sphinx_mock}):
+            with raises(ValueError):
+                build_group([en, de])
+            sphinx_mock.return_value.cleanup.assert_called_once_with()
+
+    def it_cleans_up_and_writes_timings_if_setup_fails(tmpdir):
+        en, de, api = get_project_config(tmpdir)
+        sphinx_mock = Mock()
+        owner = sphinx_mock.return_value
+        owner.setup.side_effect = ValueError
+        with patch.dict(builder_types, {'sphinx': sphinx_mock}):
+            with raises(ValueError):
+                build_group([en, de])
+        owner.cleanup.assert_called_once_with()
+        owner.write_timings.assert_called_once_with()
+        assert not owner.build.called
+
+    def it_writes_no_owner_timings_after_setup(tmpdir):
+        en, de, api = get_project_config(tmpdir)
+        sphinx_mock = Mock()
+        with patch.dict(builder_types, {'sphinx': sphinx_mock}):
+            build_group([en, de])
+        assert not sphinx_mock.return_value.write_timings.called
+
+
+def test_build_with_jobs_uses_process_pool(tmpdir):
+    project_config = get_project_config(tmpdir)
+    with patch('readthedocs_build.build.Pool') as Pool:
+        Pool.return_value.map.return_value = [
+            [{'name': 'en'}, {'name': 'de'}], [{'name': 'api'}]]
+        build(project_config, jobs=4)
+        Pool.assert_called_with(processes=2, maxtasksperchild=1)
+        args, kwargs = Pool.return_value.map.call_args
+        assert args[0] is build_group
+        assert len(args[1]) == 2
+
+
+def test_build_with_jobs_returns_reports_in_config_order(tmpdir):
+    en, de, api = get_project_config(tmpdir)
+    project_config = [en, api, de]
+
+    def build_groups(function, groups, chunksize):
+        return [
+            [{'name': build_config['name']} for build_config in group]
+            for group in groups]
+
+    with patch('readthedocs_build.build.Pool') as Pool:
+        Pool.return_value.map.side_effect = build_groups
+        reports = build(project_config, jobs=4)
+    assert [report['name'] for report in reports] == ['en', 'api', 'de']
+
+
+class StageBuilder(object):
+    """
+    Builder that records the order of its stages.
+    """
+
+    calls = []
+
+    def __init__(self, build_config, venv=None):
+        self.build_config = build_config
+        self.venv = venv
+        self.timings = TimingReport(build_config['name'])
+
+    def get_stages(self, owner=None, cleanup_after=()):
+        name = self.build_config['name']
+
+        def call(stage):
+            return self.timings.timed(
+                stage, lambda: self.calls.append((name, stage)))
+
+        if owner is None:
+            stages = [Stage(name + ':project', call('project'))]
+        else:
+            stages = [Stage(name + ':virtualenv', call('virtualenv'),
+                            dependencies=[owner.build_config['name'] +
+                                          ':project'])]
+        stages.append(Stage(name + ':html', call('html'),
+                            dependencies=[stages[0].name]))
+        stages.append(Stage(name + ':cleanup', call('cleanup'),
+                            dependencies=[stage.name for stage in stages] +
+                            list(cleanup_after),
+                            always=True))
+        return stages
+
+
+def describe_build_stages():
+    def it_schedules_all_configs(tmpdir):
+        StageBuilder.calls = []
+        project_config = get_project_config(tmpdir)
+        with patch.dict(builder_types, {'sphinx': StageBuilder}):
+            reports = build_stages(project_config, jobs=2)
+        calls = StageBuilder.calls
+        assert [report['name'] for report in reports] == ['en', 'de', 'api']
+        assert [stage['name'] for stage in reports[1]['stages']] == [
+            'virtualenv', 'html', 'cleanup']
+        assert calls.index(('en', 'project')) < calls.index(
+            ('de', 'virtualenv'))
+        # The shared virtualenv is cleaned up after all its users.
+        assert calls.index(('de', 'cleanup')) < calls.index(
+            ('en', 'cleanup'))
+        assert ('api', 'project') in calls
+
+    def it_registers_every_config_as_running_build(tmpdir):
+        project_config = get_project_config(tmpdir)
+        counts = []
+
+        class CountingBuilder(StageBuilder):
+            def get_stages(self, owner=None, cleanup_after=()):
+                stages = super(CountingBuilder, self).get_stages(
+                    owner=owner, cleanup_after=cleanup_after)
+                stages.append(Stage(
+                    self.build_config['name'] + ':count',
+                    lambda: counts.append(RunningBuilds(
+                        str(tmpdir.join('running'))).count())))
+                return stages
+
+        running = patch(
+            'readthedocs_build.build.RunningBuilds',
+            lambda: RunningBuilds(str(tmpdir.join('running'))))
+        with running, patch.dict(builder_types, {'sphinx': CountingBuilder}):
+            build_stages(project_config, jobs=2)
+        assert counts == [3, 3, 3]
+        assert tmpdir.join('running').listdir() == []
+
+    def it_returns_reports_in_config_order(tmpdir):
+        en, de, api = get_project_config(tmpdir)
+        with patch.dict(builder_types, {'sphinx': StageBuilder}):
+            reports = build_stages([en, api, de], jobs=2)
+        assert [report['name'] for report in reports] == ['en', 'api', 'de']
+
+    def it_is_used_by_build_with_stages(tmpdir):
+        project_config = get_project_config(tmpdir)
+        with patch('readthedocs_build.build.build_stages') as build_stages:
+            build(project_config, jobs=2, io_jobs=4, stages=True)
+            build_stages.assert_called_with(
+                project_config, jobs=2, io_jobs=4)
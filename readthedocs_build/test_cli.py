@@ -1,5 +1,6 @@
 from click.testing import CliRunner
 from mock import patch
+import json
 import os
 
 from .builder.base import BaseBuilder
@@ -75,3 +76,180 @@ def test_outdir_default(tmpdir):
             project_config = args[0]
             outdir = str(tmpdir.join('_readthedocs_build'))
             assert project_config[0]['output_base'] == outdir
+
+
+def test_venv_cache_is_passed_to_env_config(tmpdir):
+    with apply_fs(tmpdir, minimal_config).as_cwd():
+        with patch('readthedocs_build.cli.build') as build:
+            run(['--venv-cache=cache'])
+            args, kwargs = build.call_args
+            project_config = args[0]
+            venv_cache = project_config[0]['venv_cache']
+            assert venv_cache['path'] == str(tmpdir.join('cache'))
+
+
+def test_wheelhouse_is_passed_to_env_config(tmpdir):
+    with apply_fs(tmpdir, minimal_config).as_cwd():
+        with patch('readthedocs_build.cli.build') as build:
+            run(['--wheelhouse=wheels', '--offline'])
+            args, kwargs = build.call_args
+            project_config = args[0]
+            assert project_config[0]['wheelhouse'] == {
+                'path': str(tmpdir.join('wheels')),
+                'offline': True,
+            }
+
+
+def describe_wheelhouse_command():
+    def it_lists_wheels(tmpdir):
+        tmpdir.join('foo-1.0-py2.py3-none-any.whl').write('x' * 10)
+        result = run(['wheelhouse', str(tmpdir)])
+        assert result.exit_code == 0, result.output
+        assert 'foo-1.0-py2.py3-none-any.whl' in result.output
+        assert '1 wheels, 10 bytes' in result.output
+
+    def it_fills_wheelhouse(tmpdir):
+        requirements = tmpdir.join('requirements.txt')
+        requirements.write('')
+        with patch('readthedocs_build.builder.wheelhouse.run') as wheel_run:
+            wheel_run.return_value = 0
+            result = run([
+                'wheelhouse', str(tmpdir.join('wheels')), 'Sphinx',
+                '-r', str(requirements)])
+            assert result.exit_code == 0, result.output
+            args, kwargs = wheel_run.call_args
+            assert args[0][-2:] == [
+                'Sphinx', '-r{}'.format(requirements)]
+
+    def it_fails_if_wheels_cannot_be_built(tmpdir):
+        with patch('readthedocs_build.builder.wheelhouse.run') as wheel_run:
+            wheel_run.return_value = 1
+            result = run(['wheelhouse', str(tmpdir), 'Sphinx'])
+            assert result.exit_code == 1
+
+
+def describe_pool_fill_command():
+    def it_fills_pool(tmpdir):
+        with patch('readthedocs_build.cli.VirtualEnvPool') as VirtualEnvPool:
+            pool = VirtualEnvPool.return_value
+            pool.get_stats.return_value = {'ready': {'2.7': 1, '3': 1}}
+            result = run([
+                'pool', 'fill', str(tmpdir), '--version', '2.7',
+                '--version', '3', '--size', '1'])
+            assert result.exit_code == 0, result.output
+            args, kwargs = VirtualEnvPool.call_args
+            assert args == (str(tmpdir),)
+            assert kwargs['versions'] == ('2.7', '3')
+            assert kwargs['size'] == 1
+            assert 'Sphinx>=1.5.2' in kwargs['dependencies']
+            assert kwargs['wheelhouse'] is None
+            pool.fill.assert_called_once_with()
+        assert '2.7: 1 ready' in result.output
+        assert '3: 1 ready' in result.output
+
+    def it_defaults_to_supported_versions(tmpdir):
+        with patch('readthedocs_build.cli.VirtualEnvPool') as VirtualEnvPool:
+            VirtualEnvPool.return_value.get_stats.return_value = {'ready': {}}
+            result = run(['pool', 'fill', str(tmpdir)])
+            assert result.exit_code == 0, result.output
+            args, kwargs = VirtualEnvPool.call_args
+            assert kwargs['versions'] == [2, 2.7, 3, 3.5]
+
+    def it_skips_pool_filled_by_another_process(tmpdir):
+        with patch('readthedocs_build.cli.VirtualEnvPool') as VirtualEnvPool:
+            pool = VirtualEnvPool.return_value
+            pool.fill.return_value = False
+            pool.get_stats.return_value = {'ready': {}}
+            result = run(['pool', 'fill', str(tmpdir)])
+        assert result.exit_code == 0, result.output
+        assert 'filled by another process' in result.output
+
+
+def test_jobs_are_passed_to_build(tmpdir):
+    with apply_fs(tmpdir, minimal_config).as_cwd():
+        with patch('readthedocs_build.cli.build') as build:
+            run(['--jobs=3'])
+            args, kwargs = build.call_args
+            assert kwargs['jobs'] == 3
+
+
+def test_stages_are_passed_to_build(tmpdir):
+    with apply_fs(tmpdir, minimal_config).as_cwd():
+        with patch('readthedocs_build.cli.build') as build:
+            run(['--stages', '--io-jobs=4'])
+            args, kwargs = build.call_args
+            assert kwargs['stages']
+            assert kwargs['io_jobs'] == 4
+
+
+def test_timings_are_printed(tmpdir):
+    with apply_fs(tmpdir, minimal_config).as_cwd():
+        with patch('readthedocs_build.cli.build') as build:
+            build.return_value = [{
+                'name': 'docs',
+                'duration': 2.5,
+                'exit_code': 0,
+                'rusage': {'user_time': 1.5, 'max_rss': 2048},
+                'stages': [{
+                    'name': 'html',
+                    'duration': 2,
+                    'exit_code': 0,
+                    'rusage': {'user_time': 1.5, 'max_rss': 2048},
+                    'subprocesses': [{}],
+                }],
+            }]
+            result = CliRunner().invoke(main, ['--timings'])
+            assert result.exit_code == 0, result.output
+            lines = result.output.splitlines()
+            assert lines[1].split() == [
+                'docs', 'html', '2.00', '0', '1', '1.50', '2.0']
+            assert lines[2].split() == [
+                'docs', 'total', '2.50', '0', '1', '1.50', '2.0']
+
+
+def test_resource_sampler_is_passed_to_config(tmpdir):
+    with apply_fs(tmpdir, minimal_config).as_cwd():
+        with patch('readthedocs_build.cli.load') as load:
+            with patch('readthedocs_build.cli.build'):
+                run(['--resource-sampler=0.5'])
+            args, kwargs = load.call_args
+            assert args[1]['resource_sampler'] == {'interval': 0.5}
+
+
+def test_capture_logs_is_passed_to_config(tmpdir):
+    with apply_fs(tmpdir, minimal_config).as_cwd():
+        with patch('readthedocs_build.cli.load') as load:
+            with patch('readthedocs_build.cli.build'):
+                run(['--capture-logs', '--log-tail=16'])
+            args, kwargs = load.call_args
+            assert args[1]['log_capture'] == {'tail_size': 16384}
+
+
+def test_resources_renders_timelines(tmpdir):
+    tmpdir.join('out', 'docs', 'resources.json').write(json.dumps({
+        'name': 'docs',
+        'interval': 1,
+        'series': [
+            {'stage': 'html', 'label': 'sphinx-build', 'started': 0,
+             'samples': [[0, 1024, 0, 0, 0], [1, 2048, 0, 0, 0]]},
+        ],
+    }), ensure=True)
+    result = CliRunner().invoke(main, ['resources', str(tmpdir.join('out'))])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0] == 'docs'
+    assert lines[2].split()[:2] == ['html', '2.0']
+
+
+def describe_search_merge():
+    def it_indexes_projects(tmpdir):
+        tmpdir.join('out', 'docs', 'search_data', 'index.fjson').write(
+            '{"path": "index", "title": "Index", "body": "text"}',
+            ensure=True)
+        runner = CliRunner()
+        args = ['search-merge', str(tmpdir.join('index')),
+                str(tmpdir.join('out'))]
+        result = runner.invoke(main, args)
+        assert result.exit_code == 0, result.output
+        assert result.output == 'indexed docs\n'
+        assert tmpdir.join('index', 'state.json').exists()
@@ -0,0 +1,106 @@
+from pytest import raises
+import threading
+import time
+
+from .scheduler import Scheduler
+from .scheduler import SchedulerError
+from .scheduler import Stage
+
+
+def record(calls, name, delay=0):
+    def function():
+        time.sleep(delay)
+        calls.append(name)
+    return function
+
+
+def fail():
+    raise ValueError('failed')
+
+
+def describe_scheduler():
+    def it_runs_stages_after_their_dependencies():
+        calls = []
+        scheduler = Scheduler()
+        scheduler.add(Stage('c', record(calls, 'c'), dependencies=['b']))
+        scheduler.add(Stage('b', record(calls, 'b', 0.05),
+                            dependencies=['a']))
+        scheduler.add(Stage('a', record(calls, 'a', 0.05)))
+        scheduler.run()
+        assert calls == ['a', 'b', 'c']
+
+    def it_runs_independent_stages_in_parallel():
+        barrier = []
+        event = threading.Event()
+
+        def wait():
+            barrier.append(True)
+            if len(barrier) == 2:
+                event.set()
+            assert event.wait(5)
+
+        scheduler = Scheduler()
+        scheduler.add(Stage('a', wait))
+        scheduler.add(Stage('b', wait))
+        scheduler.run()
+
+    def it_limits_stages_per_resource():
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def work():
+            with lock:
+                running.append(True)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+
+        scheduler = Scheduler(limits={'cpu': 2, 'io': 1})
+        for index in range(4):
+            scheduler.add(Stage('cpu{}'.format(index), work))
+        scheduler.run()
+        assert max(peak) == 2
+
+    def it_records_times():
+        scheduler = Scheduler()
+        stage = scheduler.add(Stage('a', lambda: None))
+        scheduler.run()
+        assert stage.started <= stage.finished
+
+    def it_skips_dependents_of_failed_stages():
+        calls = []
+        scheduler = Scheduler()
+        failed = scheduler.add(Stage('a', fail))
+        skipped = scheduler.add(
+            Stage('b', record(calls, 'b'), dependencies=['a']))
+        scheduler.add(Stage('c', record(calls, 'c'), dependencies=['b']))
+        scheduler.add(Stage('d', record(calls, 'd')))
+        scheduler.add(Stage('cleanup', record(calls, 'cleanup'),
+                            dependencies=['a', 'b', 'c', 'd'], always=True))
+        with raises(ValueError):
+            scheduler.run()
+        assert sorted(calls) == ['cleanup', 'd']
+        assert calls[-1] == 'cleanup'
+        assert failed.failed
+        assert skipped.skipped
+
+    def it_rejects_duplicate_stages():
+        scheduler = Scheduler()
+        scheduler.add(Stage('a', lambda: None))
+        with raises(SchedulerError):
+            scheduler.add(Stage('a', lambda: None))
+
+    def it_rejects_unknown_dependencies():
+        scheduler = Scheduler()
+        scheduler.add(Stage('a', lambda: None, dependencies=['b']))
+        with raises(SchedulerError):
+            scheduler.run()
+
+    def it_detects_cycles():
+        scheduler = Scheduler()
+        scheduler.add(Stage('a', lambda: None, dependencies=['b']))
+        scheduler.add(Stage('b', lambda: None, dependencies=['a']))
+        with raises(SchedulerError):
+            scheduler.run()
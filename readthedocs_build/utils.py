@@ -1,5 +1,6 @@
 import contextlib
 import os
+import sys
 
 
 @contextlib.contextmanager
@@ -16,3 +17,30 @@ def cd(directory):
         yield
     finally:
         os.chdir(old_path)
+
+
+@contextlib.contextmanager
+def redirect_output(path):
+    """
+    Redirect stdout and stderr of this process and all of its subprocesses
+    into the file at ``path``::
+
+        with redirect_output('build.log'):
+            subprocess.call(['sphinx-build', ...])
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    old_stdout = os.dup(1)
+    old_stderr = os.dup(2)
+    with open(path, 'ab') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(old_stdout, 1)
+        os.dup2(old_stderr, 2)
+        os.close(old_stdout)
+        os.close(old_stderr)